@@ -11,13 +11,19 @@ def create_app():
     app.config.from_object(Config)
     app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(hours=1)
     
+    # Instrumentación de peticiones (latencia, errores, tasa)
+    from app import metrics
+    metrics.init_app(app)
+    
     # Registrar rutas
-    from app.routes import main_bp, auth_bp, cliente_bp, barbero_bp
+    from app.routes import main_bp, auth_bp, cliente_bp, barbero_bp, propietario_bp, admin_bp
     
     app.register_blueprint(main_bp)
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(cliente_bp, url_prefix='/cliente')
     app.register_blueprint(barbero_bp, url_prefix='/barbero')
+    app.register_blueprint(propietario_bp, url_prefix='/propietario')
+    app.register_blueprint(admin_bp, url_prefix='/admin')
     
     # Context processor para tener el usuario disponible en todos los templates
     from app.auth import get_current_user, is_authenticated
@@ -29,4 +35,21 @@ def create_app():
             'is_authenticated': is_authenticated()
         }
     
+    # Eventos de disponibilidad en tiempo real
+    from app import eventos
+    eventos.init_app(app)
+    
+    # Los resúmenes de analytics se descartan cuando cambia la agenda
+    from app import analytics
+    analytics.init_app(app)
+    
+    # Lista de espera: ofrece los huecos que liberan las cancelaciones
+    from app import lista_espera
+    lista_espera.init_app(app)
+    
+    # Tareas en segundo plano: se registran aquí y las arrancan servidor.py,
+    # asgi.py y run.py (solo las ejecuta el worker líder)
+    from app import scheduler
+    scheduler.init_app(app)
+    
     return app
\ No newline at end of file
@@ -0,0 +1,155 @@
+import xml.etree.ElementTree as ET
+from datetime import date, timedelta
+from app import database as db
+from app import metrics
+from app.database import get_connection, get_db_cursor
+
+# Analizador de índices.
+#
+# Ejecuta cada consulta de lectura de app/database.py contra una base con
+# datos (p. ej. después de seed_data.py), captura las sentencias del catálogo
+# (app/queries.py) que emite, las vuelve a ejecutar con SET STATISTICS XML ON
+# y revisa el plan real: marca los recorridos completos (Table Scan / Index
+# Scan) y los lookups, con las filas estimadas y las reales de cada operador.
+#
+# Uso:
+#     python -m app.advisor
+
+SHOWPLAN_NS = {'p': 'http://schemas.microsoft.com/sqlserver/2004/07/showplan'}
+OPERADORES_SCAN = ('Table Scan', 'Clustered Index Scan', 'Index Scan')
+OPERADORES_LOOKUP = ('Key Lookup', 'RID Lookup')
+
+
+def obtener_muestras():
+    """Obtiene IDs reales de la base para usarlos como parámetros de ejemplo"""
+    muestras = {}
+    with get_db_cursor() as cursor:
+        cursor.execute("SELECT TOP 1 id, barberia_id, usuario_id FROM Barberos WHERE activo = 1 ORDER BY id")
+        row = cursor.fetchone()
+        muestras['barbero_id'], muestras['barberia_id'], muestras['usuario_barbero_id'] = row
+        cursor.execute("""
+            SELECT TOP 1 u.id, u.email FROM Usuarios u
+            INNER JOIN Roles r ON u.rol_id = r.id
+            WHERE r.nombre = 'Cliente' ORDER BY u.id
+        """)
+        muestras['cliente_id'], muestras['email'] = cursor.fetchone()
+        cursor.execute("SELECT TOP 1 propietario_id FROM Barberias WHERE id = ?", (muestras['barberia_id'],))
+        muestras['propietario_id'] = cursor.fetchone()[0]
+        cursor.execute("SELECT TOP 1 id FROM Servicios WHERE activo = 1 ORDER BY id")
+        muestras['servicio_id'] = cursor.fetchone()[0]
+        cursor.execute("SELECT TOP 1 id FROM Citas ORDER BY id DESC")
+        row = cursor.fetchone()
+        muestras['cita_id'] = row[0] if row else 0
+
+    # Próximo día laborable (lunes a viernes)
+    fecha = date.today() + timedelta(days=1)
+    while fecha.weekday() >= 5:
+        fecha += timedelta(days=1)
+    muestras['fecha'] = fecha
+    return muestras
+
+
+# Consultas de lectura a analizar: (nombre, función que la ejecuta con las muestras)
+CONSULTAS = [
+    ('obtener_usuario_por_email', lambda m: db.obtener_usuario_por_email(m['email'])),
+    ('obtener_usuario_por_id', lambda m: db.obtener_usuario_por_id(m['cliente_id'])),
+    ('obtener_rol_por_nombre', lambda m: db.obtener_rol_por_nombre('Cliente')),
+    ('obtener_barberias_activas', lambda m: db.obtener_barberias_activas()),
+    ('obtener_barberia_por_id', lambda m: db.obtener_barberia_por_id(m['barberia_id'])),
+    ('obtener_barberias_por_propietario', lambda m: db.obtener_barberias_por_propietario(m['propietario_id'])),
+    ('obtener_servicios_por_barberia', lambda m: db.obtener_servicios_por_barberia(m['barberia_id'])),
+    ('obtener_servicio_por_id', lambda m: db.obtener_servicio_por_id(m['servicio_id'])),
+    ('obtener_barberos_por_barberia', lambda m: db.obtener_barberos_por_barberia(m['barberia_id'])),
+    ('obtener_citas_por_cliente', lambda m: db.obtener_citas_por_cliente(m['cliente_id'], desde=db.horizonte_archivo())),
+    ('obtener_slots_disponibles', lambda m: db.obtener_slots_disponibles(m['barbero_id'], m['fecha'])),
+    ('obtener_estadisticas_barbero', lambda m: db.obtener_estadisticas_barbero(m['barbero_id'])),
+    ('obtener_barbero_por_usuario_id', lambda m: db.obtener_barbero_por_usuario_id(m['usuario_barbero_id'])),
+    ('obtener_citas_por_barbero (fecha)', lambda m: db.obtener_citas_por_barbero(m['barbero_id'], fecha=m['fecha'])),
+    ('obtener_citas_por_barbero (recientes)', lambda m: db.obtener_citas_por_barbero(m['barbero_id'], desde=db.horizonte_archivo())),
+    ('obtener_cita_por_id', lambda m: db.obtener_cita_por_id(m['cita_id'])),
+    ('obtener_estado_cita_por_nombre', lambda m: db.obtener_estado_cita_por_nombre('Cancelada')),
+]
+
+
+def _plan_real(conn, sql, params):
+    """Ejecuta la sentencia con STATISTICS XML y devuelve el XML del plan real"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SET STATISTICS XML ON")
+        cursor.execute(sql, params)
+        while True:
+            if cursor.description and cursor.description[0][0].endswith('XML Showplan'):
+                return cursor.fetchone()[0]
+            if not cursor.nextset():
+                return None
+    finally:
+        cursor.execute("SET STATISTICS XML OFF")
+        cursor.close()
+
+
+def analizar_plan(plan_xml):
+    """Devuelve los operadores relevantes del plan: scans y lookups con sus filas"""
+    hallazgos = []
+    raiz = ET.fromstring(plan_xml)
+    for relop in raiz.iter(f"{{{SHOWPLAN_NS['p']}}}RelOp"):
+        operador = relop.get('PhysicalOp')
+        if operador not in OPERADORES_SCAN + OPERADORES_LOOKUP:
+            continue
+        objeto = relop.find('.//p:Object', SHOWPLAN_NS)
+        filas_reales = sum(int(contador.get('ActualRows', 0))
+                           for contador in relop.findall('p:RunTimeInformation/p:RunTimeCountersPerThread', SHOWPLAN_NS))
+        hallazgos.append({
+            'operador': operador,
+            'tabla': objeto.get('Table', '').strip('[]') if objeto is not None else '',
+            'indice': objeto.get('Index', '').strip('[]') if objeto is not None else '',
+            'filas_estimadas': float(relop.get('EstimateRows', 0)),
+            'filas_leidas_estimadas': float(relop.get('EstimatedRowsRead') or relop.get('TableCardinality') or 0),
+            'filas_reales': filas_reales,
+            'es_scan': operador in OPERADORES_SCAN
+        })
+    return hallazgos
+
+
+def analizar_consultas():
+    """Ejecuta todas las consultas registradas y devuelve los hallazgos por consulta"""
+    muestras = obtener_muestras()
+    resultados = []
+    conn = get_connection()
+    try:
+        for nombre, ejecutar in CONSULTAS:
+            with metrics.capturar_sentencias() as sentencias:
+                ejecutar(muestras)
+            for nombre_catalogo, sql, params in sentencias:
+                plan = _plan_real(conn, sql, params)
+                resultados.append({
+                    'consulta': f"{nombre} → {nombre_catalogo or 'sin catálogo'}",
+                    'sql': ' '.join(sql.split()),
+                    'hallazgos': analizar_plan(plan) if plan else []
+                })
+    finally:
+        conn.close()
+    return resultados
+
+
+def imprimir_reporte(resultados):
+    total_scans = 0
+    for resultado in resultados:
+        scans = [h for h in resultado['hallazgos'] if h['es_scan']]
+        lookups = [h for h in resultado['hallazgos'] if not h['es_scan']]
+        total_scans += len(scans)
+        marca = '⚠️ ' if scans else '✓ '
+        print(f"\n{marca} {resultado['consulta']}")
+        print(f"    {resultado['sql'][:140]}")
+        for h in scans + lookups:
+            print(f"    • {h['operador']} en {h['tabla']}"
+                  f"{' (' + h['indice'] + ')' if h['indice'] else ''}: "
+                  f"estimadas {h['filas_estimadas']:.0f}, leídas {h['filas_leidas_estimadas']:.0f}, "
+                  f"reales {h['filas_reales']}")
+    print("\n" + "=" * 60)
+    print(f"  {len(resultados)} sentencias analizadas, {total_scans} scan(s) detectado(s)")
+    print("=" * 60 + "\n")
+
+
+if __name__ == '__main__':
+    print("🔎 Analizando planes de ejecución...")
+    imprimir_reporte(analizar_consultas())
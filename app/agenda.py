@@ -0,0 +1,175 @@
+import bisect
+import heapq
+from datetime import datetime, time, timedelta
+from itertools import repeat
+from config import Config
+from app import calendario, reservas
+from app.cache import CacheTTL
+from app.database import (obtener_citas_ocupadas_barberia, obtener_citas_ocupadas_barberias,
+                          obtener_slots_disponibles)
+
+# Cálculo de huecos libres en la agenda de los barberos.
+#
+# Las horas se manejan como segundos desde medianoche. Las citas ocupadas de
+# un barbero se funden en intervalos disjuntos y ordenados, así que saber si
+# un momento está ocupado es una búsqueda binaria en lugar de recorrer todas
+# las citas del día. Para buscar huecos de una duración dada, una cita que
+# choca indica directamente dónde seguir buscando (su fin), así que recorrer
+# un día cuesta lo que sus citas más los huecos devueltos, no cada paso de
+# la rejilla.
+#
+# Los tramos de trabajo de cada barbero y día salen de app/calendario.py
+# (horario semanal con sus excepciones); un día puede tener varios si hay
+# pausas, y la rejilla de cada tramo empieza en su hora de inicio. Los huecos
+# retenidos por otros clientes (app/reservas.py) cuentan como ocupados.
+
+PASO_MINUTOS = 30  # rejilla de los horarios que se ofrecen al cliente
+
+_disponibilidad = CacheTTL(ttl=Config.DISPONIBILIDAD_CACHE_TTL, max_entradas=100_000, nombre='disponibilidad')
+
+
+def segundos(hora):
+    return hora.hour * 3600 + hora.minute * 60 + hora.second
+
+
+def hora(segundos_dia):
+    return time(segundos_dia // 3600, segundos_dia // 60 % 60, segundos_dia % 60)
+
+
+class Ocupacion:
+    """Intervalos ocupados [inicio, fin) de un barbero en un día"""
+
+    def __init__(self, intervalos=()):
+        self.inicios, self.fines = [], []
+        for inicio, fin in sorted((segundos(i), segundos(f)) for i, f in intervalos):
+            if self.fines and inicio <= self.fines[-1]:
+                self.fines[-1] = max(self.fines[-1], fin)
+            else:
+                self.inicios.append(inicio)
+                self.fines.append(fin)
+
+    def ocupado(self, momento):
+        """Si el segundo del día `momento` cae dentro de alguna cita"""
+        i = bisect.bisect_right(self.inicios, momento) - 1
+        return i >= 0 and momento < self.fines[i]
+
+    def choque(self, inicio, fin):
+        """Fin de la cita que se solapa con [inicio, fin), o None si el intervalo está libre"""
+        i = bisect.bisect_right(self.inicios, inicio) - 1
+        if i >= 0 and inicio < self.fines[i]:
+            return self.fines[i]
+        if i + 1 < len(self.inicios) and self.inicios[i + 1] < fin:
+            return self.fines[i + 1]
+        return None
+
+
+def slots_libres(hora_inicio, hora_fin, ocupacion, desde=None, paso=PASO_MINUTOS):
+    """
+    Genera las horas de inicio (time) de la rejilla del horario que no caen
+    dentro de una cita, a partir de `desde` (time) si se indica.
+    """
+    actual, fin = segundos(hora_inicio), segundos(hora_fin)
+    minimo = segundos(desde) if desde is not None else 0
+    while actual < fin:
+        if actual >= minimo and not ocupacion.ocupado(actual):
+            yield hora(actual)
+        actual += paso * 60
+
+
+def horarios_libres(barbero_id, fecha, cliente_id=None):
+    """Horas (time) de la rejilla libres de un barbero en una fecha, en orden, para `cliente_id`"""
+    info = obtener_slots_disponibles(barbero_id, fecha)
+    tramos = info['turnos']
+    if tramos is None:
+        tramos = calendario.expandir(fecha, fecha, barbero_ids=[barbero_id])[0].get((barbero_id, fecha), [])
+    retenidas = reservas.ocupadas(fecha, fecha, barbero_ids=[barbero_id], excepto_cliente=cliente_id)
+    ocupacion = Ocupacion(info['citas_ocupadas'] + retenidas.get((barbero_id, fecha), []))
+    return [slot for inicio, fin in tramos for slot in slots_libres(inicio, fin, ocupacion)]
+
+
+def huecos(hora_inicio, hora_fin, ocupacion, duracion_minutos, desde=None, paso=PASO_MINUTOS):
+    """
+    Genera, en segundos del día, los inicios de la rejilla del horario donde
+    cabe un servicio de `duracion_minutos` sin solaparse con ninguna cita.
+    """
+    paso, duracion = paso * 60, duracion_minutos * 60
+    actual, fin = segundos(hora_inicio), segundos(hora_fin)
+    if desde is not None and segundos(desde) > actual:
+        actual += -(-(segundos(desde) - actual) // paso) * paso
+    while actual + duracion <= fin:
+        libre_en = ocupacion.choque(actual, actual + duracion)
+        if libre_en is None:
+            yield actual
+            actual += paso
+        else:
+            # Saltar al primer paso de la rejilla tras la cita que choca
+            actual += -(-(libre_en - actual) // paso) * paso
+
+
+def primeros_huecos(barberia_id, duracion_minutos, cantidad=5, desde=None, cliente_id=None):
+    """
+    Los `cantidad` huecos más próximos de una barbería para un servicio de
+    `duracion_minutos`, con cualquiera de sus barberos: [(fecha, hora, barbero_id)]
+    en orden. Se exploran HUECOS_DIAS_MAX días desde `desde` (hoy, a partir
+    de ahora) y las citas se cargan por ventanas de HUECOS_VENTANA_DIAS días,
+    así que si hay hueco pronto solo se hacen dos consultas (más la de
+    retenciones). Lo que retiene `cliente_id` cuenta como libre.
+    """
+    ahora = datetime.now()
+    desde = desde or ahora.date()
+    resultado = []
+    ventana = Config.HUECOS_VENTANA_DIAS
+    for primer_dia in range(0, Config.HUECOS_DIAS_MAX, ventana):
+        inicio_ventana = desde + timedelta(days=primer_dia)
+        fin_ventana = desde + timedelta(days=min(primer_dia + ventana, Config.HUECOS_DIAS_MAX) - 1)
+        tramos, _ = calendario.turnos(inicio_ventana, fin_ventana, barberia_ids=[barberia_id])
+        ocupadas = obtener_citas_ocupadas_barberia(barberia_id, inicio_ventana, fin_ventana)
+        for clave, retenidas in reservas.ocupadas(inicio_ventana, fin_ventana, barberia_ids=[barberia_id],
+                                                  excepto_cliente=cliente_id).items():
+            ocupadas.setdefault(clave, []).extend(retenidas)
+        por_fecha = {}
+        for (barbero_id, fecha), lista in tramos.items():
+            por_fecha.setdefault(fecha, []).extend((barbero_id, inicio, fin) for inicio, fin in lista)
+        for fecha in sorted(por_fecha):
+            minimo = ahora.time() if fecha == ahora.date() else None
+            # Mezcla perezosa de los huecos de cada tramo, por hora y luego por barbero
+            candidatos = heapq.merge(*(
+                zip(huecos(inicio, fin, Ocupacion(ocupadas.get((barbero_id, fecha), ())), duracion_minutos, minimo),
+                    repeat(barbero_id))
+                for barbero_id, inicio, fin in por_fecha[fecha]))
+            for momento, barbero_id in candidatos:
+                resultado.append((fecha, hora(momento), barbero_id))
+                if len(resultado) >= cantidad:
+                    return resultado
+    return resultado
+
+
+def barberias_con_disponibilidad(barberia_ids, fecha):
+    """
+    Subconjunto de `barberia_ids` con al menos un hueco libre en `fecha`
+    (a partir de ahora, si es hoy). Los resultados se cachean
+    DISPONIBILIDAD_CACHE_TTL segundos; las que faltan se calculan con dos
+    consultas para todas a la vez.
+    """
+    disponibles, pendientes = set(), []
+    for barberia_id in barberia_ids:
+        valor = _disponibilidad.obtener((barberia_id, fecha))
+        if valor is None:
+            pendientes.append(barberia_id)
+        elif valor:
+            disponibles.add(barberia_id)
+    if not pendientes:
+        return disponibles
+
+    ahora = datetime.now()
+    desde = ahora.time() if fecha == ahora.date() else None
+    tramos, barberias = calendario.turnos(fecha, fecha, barberia_ids=pendientes)
+    ocupadas = obtener_citas_ocupadas_barberias(pendientes, fecha)
+    for (barbero_id, _), retenidas in reservas.ocupadas(fecha, fecha, barberia_ids=pendientes).items():
+        ocupadas.setdefault(barbero_id, []).extend(retenidas)
+    libres = {barberias[barbero_id] for (barbero_id, _), lista in tramos.items()
+              if any(next(slots_libres(inicio, fin, Ocupacion(ocupadas.get(barbero_id, ())), desde), None)
+                     for inicio, fin in lista)}
+    for barberia_id in pendientes:
+        _disponibilidad.guardar((barberia_id, fecha), barberia_id in libres)
+    return disponibles | libres
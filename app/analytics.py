@@ -0,0 +1,165 @@
+from datetime import date, timedelta
+from config import Config
+from app.cache import CacheTTL
+from app.database import get_db_connection, consultar_todos, variante_citas, en_paralelo, al_cambiar_agenda
+
+# Todas las agregaciones se resuelven en SQL con GROUP BY sobre el rango de
+# fechas; Python solo recibe filas ya agrupadas (días, horas, barberos o
+# servicios), nunca las citas una por una. Las sentencias están en el
+# catálogo de app/queries.py (analytics_*).
+
+# Estados que ocupan tiempo en la agenda (Pendiente, Confirmada, Completada)
+ESTADOS_OCUPAN_AGENDA = (1, 2, 3)
+ESTADO_COMPLETADA = 3
+
+NOMBRES_DIAS = {1: 'Domingo', 2: 'Lunes', 3: 'Martes', 4: 'Miércoles',
+                5: 'Jueves', 6: 'Viernes', 7: 'Sábado'}
+
+_cache_resumenes = CacheTTL(ttl=Config.ANALYTICS_CACHE_TTL, nombre='analytics')
+
+
+def dia_semana_sql(conexion, fecha):
+    """DATEPART(WEEKDAY, fecha) según el DATEFIRST de la sesión de SQL Server"""
+    return conexion.ejecutar('dia_semana', (fecha,)).fetchone()[0]
+
+
+def contar_dias_semana(fecha_inicio, fecha_fin, dia_inicial):
+    """
+    Cuenta cuántas veces aparece cada día de la semana en el rango (inclusive),
+    con la numeración de SQL Server; dia_inicial es la de fecha_inicio.
+    """
+    total_dias = (fecha_fin - fecha_inicio).days + 1
+    conteo = {dia: total_dias // 7 for dia in range(1, 8)}
+    for i in range(total_dias % 7):
+        conteo[(dia_inicial - 1 + i) % 7 + 1] += 1
+    return conteo
+
+
+# --- CONSULTAS AGRUPADAS ---
+
+def ingresos_barberia(barberia_id, fecha_inicio, fecha_fin):
+    """Ingresos y volumen de citas de una barbería, totales y por día"""
+    por_dia = consultar_todos(variante_citas('analytics_ingresos', fecha_inicio),
+                              (ESTADO_COMPLETADA, ESTADO_COMPLETADA,
+                               barberia_id, fecha_inicio, fecha_fin))
+    for dia in por_dia:
+        dia['completadas'] = dia['completadas'] or 0
+        dia['ingresos'] = float(dia['ingresos']) if dia['ingresos'] else 0
+
+    ingresos = sum(d['ingresos'] for d in por_dia)
+    completadas = sum(d['completadas'] for d in por_dia)
+    return {
+        'ingresos': ingresos,
+        'total_citas': sum(d['total_citas'] for d in por_dia),
+        'completadas': completadas,
+        'ticket_promedio': ingresos / completadas if completadas else 0,
+        'por_dia': por_dia
+    }
+
+
+def ocupacion_por_barbero(barberia_id, fecha_inicio, fecha_fin):
+    """Minutos reservados frente a minutos disponibles según el horario de cada barbero"""
+    with get_db_connection() as conexion:
+        dia_inicial = dia_semana_sql(conexion, fecha_inicio)
+        horarios = conexion.todos('analytics_horarios', (barberia_id,))
+        reservas = conexion.todos(variante_citas('analytics_reservas', fecha_inicio),
+                                  (fecha_inicio, fecha_fin) + ESTADOS_OCUPAN_AGENDA + (barberia_id,))
+
+    dias = contar_dias_semana(fecha_inicio, fecha_fin, dia_inicial)
+    minutos_disponibles = {}
+    for horario in horarios:
+        barbero_id = horario['barbero_id']
+        minutos_disponibles[barbero_id] = (minutos_disponibles.get(barbero_id, 0)
+                                           + horario['minutos'] * dias[horario['dia_semana']])
+
+    ocupacion = []
+    for reserva in reservas:
+        disponibles = minutos_disponibles.get(reserva['barbero_id'], 0)
+        ocupacion.append({
+            'barbero_id': reserva['barbero_id'],
+            'barbero': reserva['barbero'],
+            'citas': reserva['citas'],
+            'minutos_reservados': reserva['minutos'],
+            'minutos_disponibles': disponibles,
+            'ocupacion': (reserva['minutos'] * 100 / disponibles) if disponibles else 0
+        })
+    ocupacion.sort(key=lambda b: b['ocupacion'], reverse=True)
+    return ocupacion
+
+
+def mapa_calor_horas(barberia_id, fecha_inicio, fecha_fin):
+    """Citas agrupadas por día de la semana y hora de inicio"""
+    with get_db_connection() as conexion:
+        dia_inicial = dia_semana_sql(conexion, fecha_inicio)
+        filas = conexion.todos(variante_citas('analytics_mapa_calor', fecha_inicio),
+                               (barberia_id, fecha_inicio, fecha_fin) + ESTADOS_OCUPAN_AGENDA)
+
+    # Las filas vienen numeradas según DATEFIRST; se traducen a NOMBRES_DIAS
+    # (Domingo = 1) con la diferencia que hay en fecha_inicio
+    desfase = dia_inicial - (fecha_inicio.isoweekday() % 7 + 1)
+    celdas = {((fila['dia_semana'] - 1 - desfase) % 7 + 1, fila['hora']): fila['citas'] for fila in filas}
+    horas = sorted({hora for _, hora in celdas})
+    return {
+        'horas': horas,
+        'dias': [{
+            'dia_semana': dia,
+            'nombre': NOMBRES_DIAS[dia],
+            'citas': [celdas.get((dia, hora), 0) for hora in horas]
+        } for dia in (2, 3, 4, 5, 6, 7, 1)],
+        'maximo': max(celdas.values()) if celdas else 0
+    }
+
+
+def mezcla_servicios(barberia_id, fecha_inicio, fecha_fin):
+    """Cantidad de citas e ingresos por servicio"""
+    servicios = consultar_todos(variante_citas('analytics_servicios', fecha_inicio),
+                                (ESTADO_COMPLETADA, barberia_id, fecha_inicio, fecha_fin))
+
+    total = sum(s['citas'] for s in servicios)
+    for servicio in servicios:
+        servicio['ingresos'] = float(servicio['ingresos']) if servicio['ingresos'] else 0
+        servicio['porcentaje'] = (servicio['citas'] * 100 / total) if total else 0
+    return servicios
+
+
+# --- RESUMEN CON CACHE ---
+
+def rango_por_defecto():
+    """Rango de los últimos ANALYTICS_RANGO_DIAS días, incluyendo hoy"""
+    hoy = date.today()
+    return hoy - timedelta(days=Config.ANALYTICS_RANGO_DIAS - 1), hoy
+
+
+def obtener_resumen_barberia(barberia_id, fecha_inicio, fecha_fin):
+    """
+    Devuelve todas las métricas del dashboard de propietario para una barbería.
+    El resultado se cachea por (barberia_id, fecha_inicio, fecha_fin).
+    """
+    clave = (barberia_id, fecha_inicio, fecha_fin)
+    resumen = _cache_resumenes.obtener(clave)
+    if resumen is not None:
+        return resumen
+
+    # Las cuatro agregaciones son independientes: se ejecutan a la vez
+    rango = (barberia_id, fecha_inicio, fecha_fin)
+    ingresos, ocupacion, mapa_calor, servicios = en_paralelo(
+        (ingresos_barberia, *rango), (ocupacion_por_barbero, *rango),
+        (mapa_calor_horas, *rango), (mezcla_servicios, *rango))
+    resumen = {
+        'ingresos': ingresos,
+        'ocupacion': ocupacion,
+        'mapa_calor': mapa_calor,
+        'servicios': servicios
+    }
+    _cache_resumenes.guardar(clave, resumen)
+    return resumen
+
+
+def invalidar_resumenes(cambios):
+    """Oyente de al_cambiar_agenda: descarta los resúmenes cuyo rango incluye alguna fecha cambiada"""
+    fechas = {fecha for _, fecha in cambios}
+    _cache_resumenes.invalidar(lambda clave: any(clave[1] <= fecha <= clave[2] for fecha in fechas))
+
+
+def init_app(app):
+    al_cambiar_agenda(invalidar_resumenes)
@@ -0,0 +1,46 @@
+import time
+from app import busqueda, database, paginas
+
+# Calentamiento de un worker antes de que reciba tráfico.
+#
+# Sin él, la primera petición de cada worker paga la conexión a SQL Server,
+# la compilación de las plantillas Jinja, la construcción del índice de
+# búsqueda y el primer render de las páginas cacheadas. servidor.py lo
+# ejecuta tras el fork y asgi.py en el arranque (lifespan), si
+# CALENTAR_AL_ARRANCAR está activo.
+
+
+def _paso(tiempos, nombre, funcion):
+    inicio = time.perf_counter()
+    try:
+        funcion()
+    except Exception as e:
+        # Un worker sin calentar sigue sirviendo: solo es más lento al principio
+        print(f"Calentamiento: falló '{nombre}': {e}")
+    tiempos[nombre] = (time.perf_counter() - inicio) * 1000
+
+
+def _compilar_plantillas(app):
+    for nombre in app.jinja_env.list_templates():
+        if nombre.endswith('.html'):
+            app.jinja_env.get_template(nombre)
+
+
+def _pagina_inicio(app):
+    from app.routes import _renderizar_index
+    with app.test_request_context('/'):
+        paginas.servir('index', 0, _renderizar_index)
+
+
+def calentar(app):
+    """Ejecuta los pasos de calentamiento y devuelve su duración en ms, por paso"""
+    tiempos = {}
+    _paso(tiempos, 'conexiones', lambda: database.precalentar_pool(app.config['CALENTAR_CONEXIONES']))
+    _paso(tiempos, 'historico', database.historico_disponible)
+    _paso(tiempos, 'versiones_catalogo', lambda: paginas.version_catalogo(0))
+    _paso(tiempos, 'indice_busqueda', busqueda.actualizar)
+    _paso(tiempos, 'plantillas', lambda: _compilar_plantillas(app))
+    _paso(tiempos, 'pagina_inicio', lambda: _pagina_inicio(app))
+    print(f"🔥 Calentamiento en {sum(tiempos.values()):.0f} ms: "
+          + ', '.join(f'{nombre} {ms:.0f} ms' for nombre, ms in tiempos.items()))
+    return tiempos
@@ -0,0 +1,219 @@
+import asyncio
+import io
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote
+from app import eventos
+
+# Adaptador ASGI para servir la aplicación Flask (WSGI) con un servidor ASGI
+# como uvicorn (ver asgi.py en la raíz).
+#
+# El bucle de eventos atiende las conexiones, la lectura del cuerpo y el envío
+# de la respuesta. Las vistas siguen siendo síncronas: cada petición ocupa un
+# hilo de un pool acotado (ASGI_HILOS) mientras se ejecuta, igual que un hilo
+# de gunicorn, y bloquea en pyodbc como allí. Las respuestas por trozos
+# (exportaciones) se producen en ese pool trozo a trozo y, si el cliente se
+# desconecta, se cierra el iterable para liberar su conexión.
+#
+# Lo que este modo gana son los streams SSE: la vista valida la petición y
+# deja el canal en environ[eventos.STREAM_ASGI], y el bucle de eventos espera
+# los eventos sin ocupar ningún hilo. Con gunicorn cada stream es un hilo.
+#
+# No se usa asgiref.WsgiToAsgi porque ejecuta todas las peticiones en un único
+# hilo (thread_sensitive), lo que serializa la aplicación.
+
+_FIN = object()
+
+
+class SuscripcionAsincrona:
+    """Como eventos.Suscripcion, pero se espera desde el bucle de eventos que la crea"""
+
+    def __init__(self, canal, max_pendientes=100):
+        self.canal = canal
+        self._loop = asyncio.get_running_loop()
+        self._cola = asyncio.Queue(maxsize=max_pendientes)
+
+    def entregar(self, datos):
+        # Se llama desde cualquier hilo: la cola solo se toca en el del bucle
+        try:
+            self._loop.call_soon_threadsafe(self._poner, datos)
+        except RuntimeError:
+            pass  # bucle ya cerrado
+
+    def _poner(self, datos):
+        try:
+            self._cola.put_nowait(datos)
+        except asyncio.QueueFull:
+            pass
+
+    async def esperar(self, timeout):
+        try:
+            return await asyncio.wait_for(self._cola.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+
+class AdaptadorASGI:
+
+    def __init__(self, app_wsgi, hilos=32, al_iniciar=None, al_cerrar=None):
+        self.app_wsgi = app_wsgi
+        self.hilos = hilos
+        self.al_iniciar = al_iniciar
+        self.al_cerrar = al_cerrar
+        self._ejecutor = None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        elif scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+
+    @property
+    def ejecutor(self):
+        if self._ejecutor is None:
+            self._ejecutor = ThreadPoolExecutor(max_workers=self.hilos, thread_name_prefix='barberbook-asgi')
+        return self._ejecutor
+
+    # --- CICLO DE VIDA ---
+
+    async def _lifespan(self, receive, send):
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'lifespan.startup':
+                if self.al_iniciar:
+                    await asyncio.get_running_loop().run_in_executor(None, self.al_iniciar)
+                await send({'type': 'lifespan.startup.complete'})
+            elif mensaje['type'] == 'lifespan.shutdown':
+                if self.al_cerrar:
+                    await asyncio.get_running_loop().run_in_executor(None, self.al_cerrar)
+                if self._ejecutor:
+                    self._ejecutor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    # --- PETICIONES HTTP ---
+
+    async def _http(self, scope, receive, send):
+        cuerpo = bytearray()
+        while True:
+            mensaje = await receive()
+            if mensaje['type'] == 'http.disconnect':
+                return
+            cuerpo += mensaje.get('body', b'')
+            if not mensaje.get('more_body'):
+                break
+
+        loop = asyncio.get_running_loop()
+        inicio = {}
+
+        def start_response(estado, cabeceras, exc_info=None):
+            if exc_info and inicio.get('enviado'):
+                raise exc_info[1].with_traceback(exc_info[2])
+            inicio['estado'] = int(estado.split(' ', 1)[0])
+            inicio['cabeceras'] = [(nombre.lower().encode('latin-1'), valor.encode('latin-1'))
+                                   for nombre, valor in cabeceras]
+
+        environ = self._environ(scope, bytes(cuerpo))
+        environ[eventos.STREAM_ASGI] = None
+        resultado = await loop.run_in_executor(self.ejecutor, self.app_wsgi, environ, start_response)
+
+        stream = environ[eventos.STREAM_ASGI]
+        if stream is not None:
+            cerrar = getattr(resultado, 'close', None)
+            if cerrar:
+                await loop.run_in_executor(self.ejecutor, cerrar)
+            await send({'type': 'http.response.start', 'status': inicio['estado'], 'headers': inicio['cabeceras']})
+            await self._stream_sse(*stream, receive, send)
+            return
+
+        desconectado = asyncio.Event()
+
+        async def vigilar_desconexion():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+            desconectado.set()
+
+        vigia = asyncio.ensure_future(vigilar_desconexion())
+        iterador = iter(resultado)
+        try:
+            while not desconectado.is_set():
+                siguiente = asyncio.ensure_future(loop.run_in_executor(self.ejecutor, next, iterador, _FIN))
+                espera = asyncio.ensure_future(desconectado.wait())
+                await asyncio.wait({siguiente, espera}, return_when=asyncio.FIRST_COMPLETED)
+                espera.cancel()
+                if not siguiente.done():
+                    # El cliente se fue mientras la aplicación producía el trozo:
+                    # se espera a que termine para poder cerrar el generador
+                    await asyncio.wait({siguiente})
+                    break
+                trozo = siguiente.result()
+                if not inicio.get('enviado'):
+                    await send({'type': 'http.response.start', 'status': inicio['estado'],
+                                'headers': inicio['cabeceras']})
+                    inicio['enviado'] = True
+                if trozo is _FIN:
+                    await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+                    break
+                if trozo:
+                    await send({'type': 'http.response.body', 'body': trozo, 'more_body': True})
+        finally:
+            vigia.cancel()
+            cerrar = getattr(resultado, 'close', None)
+            if cerrar:
+                await loop.run_in_executor(self.ejecutor, cerrar)
+
+    async def _stream_sse(self, canal, latido, segundos, receive, send):
+        """Envía los eventos del canal desde el bucle de eventos hasta `segundos` o la desconexión"""
+        suscripcion = eventos.bus.suscribir(canal, SuscripcionAsincrona)
+
+        async def enviar():
+            await send({'type': 'http.response.body', 'body': b'retry: 3000\n\n', 'more_body': True})
+            limite = asyncio.get_running_loop().time() + segundos
+            while asyncio.get_running_loop().time() < limite:
+                trozo = eventos.trozo_sse(await suscripcion.esperar(latido))
+                await send({'type': 'http.response.body', 'body': trozo.encode('utf-8'), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+
+        async def vigilar_desconexion():
+            while (await receive())['type'] != 'http.disconnect':
+                pass
+
+        tareas = {asyncio.ensure_future(enviar()), asyncio.ensure_future(vigilar_desconexion())}
+        try:
+            await asyncio.wait(tareas, return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for tarea in tareas:
+                tarea.cancel()
+            eventos.bus.cancelar(suscripcion)
+
+    def _environ(self, scope, cuerpo):
+        servidor = scope.get('server') or ('localhost', 80)
+        cliente = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': quote(scope.get('root_path', '')),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope.get('query_string', b'').decode('latin-1'),
+            'SERVER_NAME': servidor[0],
+            'SERVER_PORT': str(servidor[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope.get('http_version', '1.1')}",
+            'REMOTE_ADDR': cliente[0],
+            'REMOTE_PORT': str(cliente[1]),
+            'CONTENT_LENGTH': str(len(cuerpo)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(cuerpo),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for nombre, valor in scope.get('headers', []):
+            nombre = nombre.decode('latin-1').upper().replace('-', '_')
+            valor = valor.decode('latin-1')
+            if nombre == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = valor
+            elif nombre != 'CONTENT_LENGTH':
+                clave = f'HTTP_{nombre}'
+                environ[clave] = f'{environ[clave]},{valor}' if clave in environ else valor
+        return environ
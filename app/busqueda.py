@@ -0,0 +1,357 @@
+import bisect
+import heapq
+import math
+import re
+import threading
+import time
+import unicodedata
+from datetime import date
+from itertools import islice
+from config import Config
+from app import agenda, geo, paginas
+from app.database import obtener_documentos_busqueda
+
+# Búsqueda de barberías por texto, ciudad, categoría de servicio y precio.
+#
+# Índice invertido en memoria: token -> {barberia_id: peso del mejor campo}.
+# Se construye con una sola consulta la primera vez y después solo se
+# reindexan las barberías cuya versión de catálogo cambió (triggers de la
+# migración 4, leídas por app/paginas.py), así que una búsqueda no toca
+# SQL Server. Cada BUSQUEDA_RECONSTRUIR_SEGUNDOS se reconstruye entero por si
+# cambió algo que no sube versiones (p. ej. el nombre de una categoría).
+#
+# Las barberías con coordenadas (migración 6) van además a una rejilla
+# espacial (app/geo.py) que se actualiza a la vez, para buscar las cercanas.
+
+_PALABRA = re.compile(r'[a-z0-9]+')
+_PALABRAS_VACIAS = frozenset('a al con de del e el en la las los o para por un una y'.split())
+_MAX_PREFIJOS = 50  # tokens del vocabulario que puede abarcar un prefijo
+
+# Peso de cada campo en la puntuación
+PESOS = {'nombre': 3.0, 'ciudad': 2.0, 'categoria': 2.0, 'servicio': 1.5, 'direccion': 1.0, 'descripcion': 0.5}
+_PESO_PREFIJO = 0.5  # un token que solo coincide por prefijo puntúa la mitad
+_LOTE_DISPONIBILIDAD_MAX = 500  # candidatos por consulta de disponibilidad en cercanas()
+
+
+def normalizar(texto):
+    """Minúsculas y sin tildes: 'Peluquería Ñandú' -> 'peluqueria nandu'"""
+    texto = unicodedata.normalize('NFKD', texto or '')
+    return ''.join(c for c in texto if not unicodedata.combining(c)).lower().strip()
+
+
+def tokenizar(texto):
+    """Tokens normalizados, sin palabras vacías y sin la 's' final del plural ('cortes' -> 'corte')"""
+    tokens = []
+    for palabra in _PALABRA.findall(normalizar(texto)):
+        if palabra in _PALABRAS_VACIAS:
+            continue
+        if len(palabra) > 3 and palabra.endswith('s'):
+            palabra = palabra[:-1]
+        tokens.append(palabra)
+    return tokens
+
+
+def _documentos(filas):
+    """Agrupa las filas (una por servicio) en un documento por barbería"""
+    documentos = {}
+    for fila in filas:
+        doc = documentos.get(fila['id'])
+        if doc is None:
+            doc = documentos[fila['id']] = {
+                campo: fila[campo] for campo in ('id', 'nombre', 'direccion', 'ciudad', 'telefono',
+                                                 'descripcion', 'hora_apertura', 'hora_cierre',
+                                                 'latitud', 'longitud')}
+            doc.update(servicios=[], categorias=set(), precios=[])
+        if fila['servicio'] is not None:
+            doc['servicios'].append(fila['servicio'])
+            doc['categorias'].add(fila['categoria'])
+            doc['precios'].append(fila['precio'])
+    for doc in documentos.values():
+        doc['precios'].sort()
+        doc['orden'] = normalizar(doc['nombre'])
+    return documentos
+
+
+class IndiceBusqueda:
+    """Índice invertido de barberías. Seguro entre hilos; las lecturas no consultan la base."""
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._vaciar()
+        self.versiones = None   # versiones de catálogo con las que se indexó
+        self.construido = 0.0   # momento de la última reconstrucción completa
+
+    # --- ESCRITURA ---
+
+    def _vaciar(self):
+        self._documentos = {}   # barberia_id -> documento
+        self._postings = {}     # token -> {barberia_id: peso}
+        self._vocabulario = []  # tokens ordenados, para buscar por prefijo
+        self._por_nombre = []   # ids ordenados por nombre, para listados sin texto
+        self._ordenado = True   # _vocabulario y _por_nombre al día
+        self._ciudades = {}     # ciudad normalizada -> (nombre a mostrar, ids)
+        self._categorias = {}   # categoría normalizada -> (nombre a mostrar, ids)
+
+    def _quitar(self, barberia_id):
+        doc = self._documentos.pop(barberia_id, None)
+        if doc is None:
+            return
+        self._ordenado = False
+        for token in doc['tokens']:
+            postings = self._postings[token]
+            del postings[barberia_id]
+            if not postings:
+                del self._postings[token]
+        for faceta, valores in ((self._ciudades, [doc['ciudad']]), (self._categorias, doc['categorias'])):
+            for valor in filter(None, valores):
+                clave = normalizar(valor)
+                ids = faceta[clave][1]
+                ids.discard(barberia_id)
+                if not ids:
+                    del faceta[clave]
+
+    def _agregar(self, doc):
+        pesos = {}
+        campos = [('nombre', doc['nombre']), ('ciudad', doc['ciudad']), ('direccion', doc['direccion']),
+                  ('descripcion', doc['descripcion'])]
+        campos += [('servicio', servicio) for servicio in doc['servicios']]
+        campos += [('categoria', categoria) for categoria in doc['categorias']]
+        for campo, texto in campos:
+            for token in tokenizar(texto):
+                pesos[token] = max(pesos.get(token, 0.0), PESOS[campo])
+        for token, peso in pesos.items():
+            postings = self._postings.get(token)
+            if postings is None:
+                postings = self._postings[token] = {}
+            postings[doc['id']] = peso
+        doc['tokens'] = tuple(pesos)
+        self._documentos[doc['id']] = doc
+        self._ordenado = False
+        for faceta, valores in ((self._ciudades, [doc['ciudad']]), (self._categorias, doc['categorias'])):
+            for valor in filter(None, valores):
+                faceta.setdefault(normalizar(valor), (valor, set()))[1].add(doc['id'])
+
+    def reemplazar(self, documentos, ids=None):
+        """
+        Sustituye en el índice las barberías de `ids` por `documentos` (las que
+        no estén en `documentos` se quitan: se desactivaron). Sin `ids`, todo.
+        """
+        with self._lock:
+            if ids is None:
+                self._vaciar()
+                ids = ()
+            for barberia_id in set(ids) | set(documentos):
+                self._quitar(barberia_id)
+            for doc in documentos.values():
+                self._agregar(doc)
+
+    # --- LECTURA ---
+
+    def _ordenar(self):
+        if not self._ordenado:
+            self._vocabulario = sorted(self._postings)
+            self._por_nombre = sorted(self._documentos, key=lambda i: self._documentos[i]['orden'])
+            self._ordenado = True
+
+    def _coincidencias(self, token):
+        """{barberia_id: peso} del token exacto, o de los tokens que empiezan por él"""
+        exacto = self._postings.get(token)
+        if exacto is not None:
+            return exacto
+        self._ordenar()
+        coincidencias = {}
+        inicio = bisect.bisect_left(self._vocabulario, token)
+        for candidato in self._vocabulario[inicio:inicio + _MAX_PREFIJOS]:
+            if not candidato.startswith(token):
+                break
+            postings = self._postings[candidato]
+            if not coincidencias:
+                coincidencias = {i: peso * _PESO_PREFIJO for i, peso in postings.items()}
+                continue
+            for barberia_id, peso in postings.items():
+                coincidencias[barberia_id] = max(coincidencias.get(barberia_id, 0.0), peso * _PESO_PREFIJO)
+        return coincidencias
+
+    def buscar(self, texto='', ciudad=None, categoria=None, precio_min=None, precio_max=None,
+               pagina=1, por_pagina=None):
+        """
+        Barberías que contienen todos los términos de `texto` (tal cual o, si
+        el término no existe, como prefijo) y cumplen los filtros; con precio,
+        la barbería debe tener algún servicio dentro del rango. Ordenadas por
+        relevancia (peso del campo x rareza del término) y nombre.
+        """
+        por_pagina = por_pagina or Config.BUSQUEDA_POR_PAGINA
+        with self._lock:
+            candidatos = None
+            for faceta, valor in ((self._ciudades, ciudad), (self._categorias, categoria)):
+                if valor:
+                    ids = faceta.get(normalizar(valor), (None, set()))[1]
+                    candidatos = set(ids) if candidatos is None else candidatos & ids
+
+            puntuacion = None  # barberia_id -> puntuación, solo si hay texto
+            total_docs = len(self._documentos) or 1
+            for token in tokenizar(texto):
+                coincidencias = self._coincidencias(token)
+                rareza = math.log(1 + total_docs / (len(coincidencias) or 1))
+                if puntuacion is None:
+                    puntuacion = {i: peso * rareza for i, peso in coincidencias.items()
+                                  if candidatos is None or i in candidatos}
+                else:
+                    puntuacion = {i: p + coincidencias[i] * rareza for i, p in puntuacion.items()
+                                  if i in coincidencias}
+                if not puntuacion:
+                    break
+
+            documentos = self._documentos
+            hay_precio = precio_min is not None or precio_max is not None
+            minimo = precio_min if precio_min is not None else float('-inf')
+            maximo = precio_max if precio_max is not None else float('inf')
+            inicio = (pagina - 1) * por_pagina
+
+            if puntuacion is not None:
+                # Por relevancia: solo se ordena lo necesario para llegar a la página pedida
+                filas = [(-p, documentos[i]['orden'], i) for i, p in puntuacion.items()
+                         if not hay_precio or _precio_en_rango(documentos[i]['precios'], minimo, maximo)]
+                total = len(filas)
+                pagina_ids = [fila[2] for fila in heapq.nsmallest(inicio + por_pagina, filas)[inicio:]]
+            else:
+                # Sin texto: por nombre, sobre el orden ya calculado
+                self._ordenar()
+                ids = [i for i in self._por_nombre
+                       if (candidatos is None or i in candidatos)
+                       and (not hay_precio or _precio_en_rango(documentos[i]['precios'], minimo, maximo))]
+                total = len(ids)
+                pagina_ids = ids[inicio:inicio + por_pagina]
+            puntuacion = puntuacion or {}
+            resultados = [_resultado(documentos[i], puntuacion.get(i, 0.0)) for i in pagina_ids]
+
+        return {
+            'total': total,
+            'pagina': pagina,
+            'paginas': max(1, math.ceil(total / por_pagina)),
+            'resultados': resultados,
+        }
+
+    def facetas(self):
+        """Ciudades y categorías presentes, para los filtros del formulario"""
+        with self._lock:
+            return {'ciudades': sorted((v[0] for v in self._ciudades.values()), key=normalizar),
+                    'categorias': sorted((v[0] for v in self._categorias.values()), key=normalizar)}
+
+    def documento(self, barberia_id):
+        with self._lock:
+            return self._documentos.get(barberia_id)
+
+    def __len__(self):
+        return len(self._documentos)
+
+
+def _precio_en_rango(precios, minimo, maximo):
+    i = bisect.bisect_left(precios, minimo)
+    return i < len(precios) and precios[i] <= maximo
+
+
+def _resultado(doc, puntuacion):
+    return {
+        'id': doc['id'],
+        'nombre': doc['nombre'],
+        'direccion': doc['direccion'],
+        'ciudad': doc['ciudad'],
+        'telefono': doc['telefono'],
+        'descripcion': doc['descripcion'],
+        'hora_apertura': doc['hora_apertura'].strftime('%H:%M') if doc['hora_apertura'] else None,
+        'hora_cierre': doc['hora_cierre'].strftime('%H:%M') if doc['hora_cierre'] else None,
+        'categorias': sorted(doc['categorias'], key=normalizar),
+        'precio_desde': doc['precios'][0] if doc['precios'] else None,
+        'puntuacion': round(puntuacion, 3),
+    }
+
+
+# --- API DEL MÓDULO ---
+
+indice = IndiceBusqueda()
+indice_geo = geo.IndiceGeo(Config.GEO_CELDA_GRADOS)
+_lock_actualizar = threading.Lock()
+
+
+def _pendiente(versiones):
+    """'completo', una lista de barberías cambiadas, o None si el índice está al día"""
+    if not indice.construido or time.monotonic() - indice.construido >= Config.BUSQUEDA_RECONSTRUIR_SEGUNDOS:
+        return 'completo'
+    if versiones is indice.versiones:
+        return None
+    anteriores = indice.versiones or {}
+    return [i for i, version in versiones.items() if i and anteriores.get(i) != version] or None
+
+
+def _puntos(documentos):
+    return {i: (doc['latitud'], doc['longitud']) for i, doc in documentos.items() if doc['latitud'] is not None}
+
+
+def actualizar():
+    """
+    Pone el índice al día con las versiones de catálogo. Solo consulta la base
+    si alguna barbería cambió; mientras un hilo reindexa, el resto sigue
+    buscando sobre el índice anterior (salvo la primera vez, que esperan).
+    """
+    versiones = paginas.versiones_catalogo()
+    if _pendiente(versiones) is None:
+        return
+    if not _lock_actualizar.acquire(blocking=not indice.construido):
+        return
+    try:
+        pendiente = _pendiente(versiones)  # otro hilo pudo haberlo hecho mientras esperábamos
+        if pendiente == 'completo':
+            documentos = _documentos(obtener_documentos_busqueda())
+            indice.reemplazar(documentos)
+            indice_geo.reemplazar(_puntos(documentos))
+            indice.construido = time.monotonic()
+        elif pendiente:
+            documentos = _documentos(obtener_documentos_busqueda(pendiente))
+            indice.reemplazar(documentos, ids=pendiente)
+            indice_geo.reemplazar(_puntos(documentos), ids=pendiente)
+        indice.versiones = versiones
+    finally:
+        _lock_actualizar.release()
+
+
+def buscar(texto='', ciudad=None, categoria=None, precio_min=None, precio_max=None, pagina=1):
+    actualizar()
+    return indice.buscar(texto, ciudad, categoria, precio_min, precio_max, pagina)
+
+
+def facetas():
+    actualizar()
+    return indice.facetas()
+
+
+def cercanas(lat, lon, k=10, radio_km=None, disponible_hoy=False):
+    """
+    Las `k` barberías más cercanas a (lat, lon) dentro de `radio_km`, con su
+    distancia. Con `disponible_hoy`, solo las que tienen algún hueco libre
+    hoy: los candidatos salen de la rejilla por orden de distancia y se
+    comprueban por lotes crecientes, sin recorrer las barberías lejanas.
+    """
+    actualizar()
+    k = max(1, min(k, Config.GEO_K_MAX))
+    radio_km = min(radio_km or Config.GEO_RADIO_MAX_KM, Config.GEO_RADIO_MAX_KM)
+    candidatos = indice_geo.cercanos(lat, lon, radio_km)
+    hoy = date.today()
+    resultados, tamano_lote = [], k
+    while len(resultados) < k:
+        lote = list(islice(candidatos, tamano_lote))
+        if not lote:
+            break
+        libres = agenda.barberias_con_disponibilidad([i for _, i in lote], hoy) if disponible_hoy else None
+        for distancia, barberia_id in lote:
+            doc = indice.documento(barberia_id)
+            if doc is None or (libres is not None and barberia_id not in libres):
+                continue
+            resultado = _resultado(doc, 0)
+            del resultado['puntuacion']
+            resultado['distancia_km'] = round(distancia, 2)
+            resultados.append(resultado)
+            if len(resultados) == k:
+                break
+        tamano_lote = min(tamano_lote * 4, _LOTE_DISPONIBILIDAD_MAX)
+    return resultados
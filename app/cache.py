@@ -0,0 +1,84 @@
+import threading
+import time
+
+# Caches con nombre, para poder reportar sus estadísticas (ver app/metrics.py)
+_caches_registradas = {}
+
+
+def caches_registradas():
+    """Devuelve un diccionario {nombre: cache} con las caches registradas"""
+    return dict(_caches_registradas)
+
+
+class CacheTTL:
+    """
+    Cache en memoria con expiración por tiempo (TTL), segura entre hilos.
+
+    Uso:
+        cache = CacheTTL(ttl=300, nombre='mi_cache')
+        valor = cache.obtener(clave)
+        if valor is None:
+            valor = calcular()
+            cache.guardar(clave, valor)
+    """
+
+    def __init__(self, ttl=300, max_entradas=1024, nombre=None):
+        self.ttl = ttl
+        self.max_entradas = max_entradas
+        self._datos = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if nombre:
+            _caches_registradas[nombre] = self
+
+    def obtener(self, clave):
+        """Devuelve el valor guardado o None si no existe o ya expiró"""
+        with self._lock:
+            entrada = self._datos.get(clave)
+            if entrada is None:
+                self.misses += 1
+                return None
+            expira, valor = entrada
+            if expira < time.monotonic():
+                del self._datos[clave]
+                self.misses += 1
+                return None
+            self.hits += 1
+            return valor
+
+    def guardar(self, clave, valor, ttl=None):
+        """Guarda un valor con el TTL indicado (o el de la cache)"""
+        expira = time.monotonic() + (ttl if ttl is not None else self.ttl)
+        with self._lock:
+            if len(self._datos) >= self.max_entradas and clave not in self._datos:
+                self._purgar_expiradas()
+                if len(self._datos) >= self.max_entradas:
+                    # Descartar la entrada más antigua en insertarse
+                    self._datos.pop(next(iter(self._datos)))
+            self._datos[clave] = (expira, valor)
+
+    def invalidar(self, filtro=None):
+        """Elimina todas las entradas, o solo las claves para las que filtro(clave) es True"""
+        with self._lock:
+            if filtro is None:
+                self._datos.clear()
+                return
+            for clave in [c for c in self._datos if filtro(c)]:
+                del self._datos[clave]
+
+    def estadisticas(self):
+        """Devuelve hits, misses y tamaño actual de la cache"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'entradas': len(self._datos),
+                'ratio_hits': (self.hits / total) if total else 0
+            }
+
+    def _purgar_expiradas(self):
+        ahora = time.monotonic()
+        for clave in [c for c, (expira, _) in self._datos.items() if expira < ahora]:
+            del self._datos[clave]
@@ -0,0 +1,157 @@
+from datetime import date, timedelta
+from config import Config
+from app.database import (obtener_reglas_horario, obtener_calendario, reemplazar_calendario,
+                          obtener_calendario_pendientes, borrar_calendario_pendientes,
+                          obtener_calendario_atrasados, purgar_calendario, calendario_disponible)
+
+# Calendario de trabajo de los barberos: horario semanal (Horarios_Barberos)
+# más excepciones por fecha (Excepciones_Horario: vacaciones, festivos,
+# jornadas reducidas y pausas).
+#
+# Se materializa en Calendario_Barberos, un tramo (hora_inicio, hora_fin) por
+# fila, para las próximas CALENDARIO_SEMANAS semanas. Los triggers de la
+# migración 7 apuntan en Calendario_Pendientes qué barberos cambiaron y desde
+# qué día; la tarea mantener() regenera solo esos, alarga el horizonte un día
+# cada día y borra los días pasados. Las consultas de disponibilidad leen los
+# tramos ya calculados y solo recurren a las reglas semanales para fechas o
+# barberos que el calendario aún no cubre.
+
+_LOTE_PURGA = 5000
+
+
+def tramos_del_dia(semanales, excepciones):
+    """
+    Tramos de trabajo de un día: los del horario semanal, salvo que una
+    excepción 'cerrado' anule el día o una 'horario' los sustituya (gana la
+    más reciente); después se descuentan las pausas.
+    """
+    if any(e['tipo'] == 'cerrado' for e in excepciones):
+        return []
+    tramos = sorted(semanales)
+    for e in excepciones:
+        if e['tipo'] == 'horario':
+            tramos = [(e['hora_inicio'], e['hora_fin'])]
+    for e in excepciones:
+        if e['tipo'] == 'pausa':
+            tramos = [(inicio, fin) for tramo_inicio, tramo_fin in tramos
+                      for inicio, fin in ((tramo_inicio, min(tramo_fin, e['hora_inicio'])),
+                                          (max(tramo_inicio, e['hora_fin']), tramo_fin))
+                      if inicio < fin]
+    return tramos
+
+
+def expandir(desde, hasta, barbero_ids=None, barberia_ids=None):
+    """
+    Calcula el calendario a partir de las reglas, sin leer el materializado:
+    ({(barbero_id, fecha): [(hora_inicio, hora_fin)]}, {barbero_id: barberia_id}).
+    """
+    dia_inicial, horarios, excepciones = obtener_reglas_horario(desde, hasta, barbero_ids, barberia_ids)
+    semana, barberias = {}, {}
+    for fila in horarios:
+        barberias[fila['barbero_id']] = fila['barberia_id']
+        semana.setdefault(fila['barbero_id'], {}).setdefault(fila['dia_semana'], []).append(
+            (fila['hora_inicio'], fila['hora_fin']))
+    por_dia = {}
+    for e in excepciones:
+        barberias[e['barbero_id']] = e['barberia_id']
+        fecha = max(e['fecha_desde'], desde)
+        while fecha <= min(e['fecha_hasta'], hasta):
+            por_dia.setdefault((e['barbero_id'], fecha), []).append(e)
+            fecha += timedelta(days=1)
+
+    tramos = {}
+    for dia in range((hasta - desde).days + 1):
+        fecha = desde + timedelta(days=dia)
+        # dia_semana va de 1 a 7 con la numeración de SQL Server
+        dia_semana = (dia_inicial - 1 + dia) % 7 + 1
+        for barbero_id in barberias:
+            resultado = tramos_del_dia(semana.get(barbero_id, {}).get(dia_semana, ()),
+                                       por_dia.get((barbero_id, fecha), ()))
+            if resultado:
+                tramos[(barbero_id, fecha)] = resultado
+    return tramos, barberias
+
+
+def turnos(desde, hasta, barbero_ids=None, barberia_ids=None):
+    """
+    Tramos de trabajo entre dos fechas, como expandir(), leídos del calendario
+    materializado. Los barberos cuyo calendario no llega a `hasta` (o todos,
+    sin la migración 7) se calculan con las reglas.
+    """
+    filas = obtener_calendario(desde, hasta, barbero_ids, barberia_ids)
+    if filas is None:
+        return expandir(desde, hasta, barbero_ids, barberia_ids)
+    tramos, barberias, sin_generar = {}, {}, set()
+    for fila in filas:
+        barberias[fila['barbero_id']] = fila['barberia_id']
+        if fila['hasta'] is None or fila['hasta'] < hasta:
+            sin_generar.add(fila['barbero_id'])
+        elif fila['fecha'] is not None:
+            tramos.setdefault((fila['barbero_id'], fila['fecha']), []).append(
+                (fila['hora_inicio'], fila['hora_fin']))
+    for clave in tramos:
+        tramos[clave].sort()
+    if sin_generar:
+        tramos.update(expandir(desde, hasta, barbero_ids=sorted(sin_generar))[0])
+    return tramos, barberias
+
+
+# --- MANTENIMIENTO DEL MATERIALIZADO ---
+
+def regenerar(barbero_ids, desde, hasta, subir_version=True):
+    """Recalcula y guarda el calendario de esos barberos entre dos fechas. Devuelve los tramos escritos."""
+    tramos, _ = expandir(desde, hasta, barbero_ids=barbero_ids)
+    filas = [(barbero_id, fecha, inicio, fin) for (barbero_id, fecha), lista in tramos.items()
+             for inicio, fin in lista]
+    reemplazar_calendario(barbero_ids, desde, hasta, filas, subir_version)
+    return len(filas)
+
+
+def _horizonte(hoy):
+    return hoy + timedelta(weeks=Config.CALENDARIO_SEMANAS)
+
+
+def aplicar_pendientes(hoy=None):
+    """Regenera los barberos avisados por los triggers, desde el día que cambió. Devuelve los tramos escritos."""
+    if not calendario_disponible():
+        return 0
+    hoy = hoy or date.today()
+    pendientes = obtener_calendario_pendientes()
+    grupos = {}
+    for pendiente in pendientes:
+        grupos.setdefault(max(pendiente['desde'], hoy), []).append(pendiente['barbero_id'])
+    total = 0
+    for desde, barbero_ids in grupos.items():
+        for i in range(0, len(barbero_ids), Config.CALENDARIO_LOTE):
+            total += regenerar(barbero_ids[i:i + Config.CALENDARIO_LOTE], desde, _horizonte(hoy))
+    if pendientes:
+        borrar_calendario_pendientes(pendientes)
+    return total
+
+
+def mantener():
+    """
+    Tarea periódica: aplica los cambios pendientes, genera los días nuevos
+    que entran en el horizonte (solo esos) y purga los pasados.
+    """
+    if not calendario_disponible():
+        return 0
+    hoy = date.today()
+    total = aplicar_pendientes(hoy)
+    while True:
+        atrasados = obtener_calendario_atrasados(_horizonte(hoy), Config.CALENDARIO_LOTE)
+        grupos = {}
+        for fila in atrasados:
+            generado = fila['hasta']
+            desde = hoy if generado is None or generado < hoy else generado + timedelta(days=1)
+            grupos.setdefault(desde, []).append(fila['barbero_id'])
+        for desde, barbero_ids in grupos.items():
+            # Días que antes se calculaban con las reglas: mismo resultado, sin cambiar el ETag
+            total += regenerar(barbero_ids, desde, _horizonte(hoy), subir_version=False)
+        if len(atrasados) < Config.CALENDARIO_LOTE:
+            break
+    while True:
+        borrados = purgar_calendario(hoy, _LOTE_PURGA)
+        total += borrados
+        if borrados < _LOTE_PURGA:
+            return total
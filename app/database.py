@@ -1,19 +1,221 @@
-import pyodbc
+import importlib
+import queue
+import threading
+from concurrent.futures import FIRST_EXCEPTION, ThreadPoolExecutor, wait
 from config import Config
 from contextlib import contextmanager
+from datetime import date, timedelta
+import time
+from app import metrics, queries
+
+
+class _ModuloPerezoso:
+    """Importa el módulo la primera vez que se usa uno de sus atributos"""
+
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def __getattr__(self, atributo):
+        if self._modulo is None:
+            self._modulo = importlib.import_module(self._nombre)
+        return getattr(self._modulo, atributo)
+
+
+# El driver carga el gestor ODBC: se importa con la primera conexión, no al
+# arrancar (la CLI, las herramientas y el maestro pre-fork no lo necesitan)
+pyodbc = _ModuloPerezoso('pyodbc')
+
+# Fechas centinela para los rangos abiertos de las consultas del catálogo
+FECHA_MIN = date(1900, 1, 1)
+FECHA_MAX = date(9999, 12, 31)
 
 # --- FUNCIONES HELPER PARA CONEXIÓN ---
 
 def get_connection():
-    """Obtiene una conexión a la base de datos"""
+    """Obtiene una conexión nueva a la base de datos (fuera del pool)"""
     try:
         conn = pyodbc.connect(Config.DB_CONNECTION_STRING)
         return conn
     except pyodbc.Error as e:
+        metrics.error_conexion()
         print(f"Error conectando a la base de datos: {e}")
         raise
 
 
+def _liberar(cursor):
+    """Descarta los resultados pendientes de un cursor sin perder su sentencia preparada"""
+    try:
+        while cursor.nextset():
+            pass
+    except pyodbc.Error:
+        pass  # el cursor no tenía resultados abiertos
+
+
+class ConexionPool:
+    """
+    Conexión física del pool. Guarda un cursor por cada consulta del catálogo:
+    pyodbc prepara la sentencia la primera vez y, mientras el cursor ejecute el
+    mismo texto, reutiliza el handle preparado en las siguientes llamadas.
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+        self._cursores = {}
+        self._ultimo = None
+
+    def _activar(self, cursor):
+        # Sin MARS solo puede haber un resultado abierto por conexión
+        if self._ultimo is not None and self._ultimo is not cursor:
+            _liberar(self._ultimo)
+        self._ultimo = cursor
+
+    def ejecutar(self, nombre, params=()):
+        """Ejecuta la consulta `nombre` del catálogo y devuelve su cursor"""
+        consulta = queries.obtener(nombre)
+        consulta.validar_parametros(params)
+        cursor = self._cursores.get(nombre)
+        if cursor is None:
+            cursor = self._cursores[nombre] = metrics.CursorInstrumentado(self.conn.cursor(), nombre)
+        self._activar(cursor)
+        lote = getattr(_lote_actual, 'lote', None)
+        if lote is not None:
+            lote.registrar(cursor)
+        cursor.execute(consulta.sql, tuple(params))
+        return cursor
+
+    def ejecutar_lote(self, nombre, filas):
+        """Ejecuta la sentencia `nombre` una vez por fila, enviándolas juntas (fast_executemany)"""
+        consulta = queries.obtener(nombre)
+        filas = [tuple(fila) for fila in filas]
+        if not filas:
+            return
+        consulta.validar_parametros(filas[0])
+        cursor = self._cursores.get(nombre)
+        if cursor is None:
+            crudo = self.conn.cursor()
+            crudo.fast_executemany = True
+            cursor = self._cursores[nombre] = metrics.CursorInstrumentado(crudo, nombre)
+        self._activar(cursor)
+        cursor.executemany(consulta.sql, filas)
+
+    def uno(self, nombre, params=()):
+        """Primera fila de la consulta como diccionario, o None"""
+        return queries.obtener(nombre).fila_a_dict(self.ejecutar(nombre, params).fetchone())
+
+    def todos(self, nombre, params=()):
+        """Todas las filas de la consulta como diccionarios"""
+        consulta = queries.obtener(nombre)
+        return [consulta.fila_a_dict(row) for row in self.ejecutar(nombre, params).fetchall()]
+
+    def cursor(self):
+        """Cursor libre para SQL que no está en el catálogo (DDL, scripts)"""
+        cursor = metrics.CursorInstrumentado(self.conn.cursor())
+        self._activar(cursor)
+        return cursor
+
+    def terminar(self, commit):
+        if self._ultimo is not None:
+            _liberar(self._ultimo)
+            self._ultimo = None
+        if commit:
+            self.conn.commit()
+        else:
+            self.conn.rollback()
+
+    def cerrar(self):
+        try:
+            self.conn.close()
+        except pyodbc.Error:
+            pass
+        metrics.conexion_descartada()
+
+
+# Pila LIFO: se reutiliza primero la conexión más reciente, que es la que
+# tiene más sentencias preparadas y menos riesgo de haber caducado
+_pool = queue.LifoQueue(maxsize=Config.DB_POOL_SIZE)
+
+
+def _tomar_conexion():
+    try:
+        return _pool.get_nowait()
+    except queue.Empty:
+        conexion = ConexionPool(get_connection())
+        metrics.conexion_creada()
+        return conexion
+
+
+def _devolver_conexion(conexion, descartar=False):
+    if not descartar:
+        try:
+            _pool.put_nowait(conexion)
+            return
+        except queue.Full:
+            pass
+    conexion.cerrar()
+
+
+def reiniciar_pool():
+    """Cierra las conexiones inactivas del pool (p. ej. en un proceso recién creado con fork)"""
+    while True:
+        try:
+            _pool.get_nowait().cerrar()
+        except queue.Empty:
+            return
+
+
+def precalentar_pool(cantidad):
+    """Abre `cantidad` conexiones a la vez y las deja en el pool. Devuelve cuántas hay inactivas."""
+    conexiones = []
+    try:
+        while len(conexiones) < min(cantidad, _pool.maxsize):
+            conexiones.append(_tomar_conexion())
+    finally:
+        for conexion in conexiones:
+            _devolver_conexion(conexion)
+    return _pool.qsize()
+
+
+def estado_pool():
+    return {'inactivas': _pool.qsize(), 'capacidad': _pool.maxsize}
+
+
+@contextmanager
+def get_db_connection(commit=False):
+    """
+    Presta una conexión del pool. Al devolverla hace commit (si commit=True)
+    o rollback, para que la siguiente petición no herede una transacción
+    abierta; si hubo un error de pyodbc la conexión se descarta.
+
+    Uso:
+        with get_db_connection() as conexion:
+            usuario = conexion.uno('usuario_por_id', (user_id,))
+    """
+    conexion = _tomar_conexion()
+    metrics.conexion_abierta()
+    descartar = False
+    try:
+        yield conexion
+        conexion.terminar(commit)
+    except pyodbc.Error:
+        descartar = True
+        raise
+    except BaseException:
+        # También GeneratorExit, cuando se abandona un generador a medio leer
+        try:
+            conexion.terminar(False)
+        except pyodbc.Error:
+            descartar = True
+        raise
+    finally:
+        metrics.conexion_cerrada()
+        lote = getattr(_lote_actual, 'lote', None)
+        if lote is not None:
+            # Antes de devolverla: otra petición podría recibirla con estos cursores
+            lote.soltar(conexion._cursores.values())
+        _devolver_conexion(conexion, descartar)
+
+
 @contextmanager
 def get_db_cursor(commit=False):
     """
@@ -27,539 +229,917 @@ def get_db_cursor(commit=False):
     Para INSERT/UPDATE/DELETE usar commit=True:
         with get_db_cursor(commit=True) as cursor:
             cursor.execute("INSERT INTO ...")
+
+    Las funciones de la aplicación usan las consultas del catálogo
+    (consultar_uno, consultar_todos, ejecutar); este cursor queda para SQL
+    que no se reutiliza, como DDL o scripts de mantenimiento.
+    """
+    with get_db_connection(commit) as conexion:
+        cursor = conexion.cursor()
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+
+
+def consultar_uno(nombre, params=()):
+    """Ejecuta una consulta del catálogo y devuelve la primera fila como diccionario"""
+    with get_db_connection() as conexion:
+        return conexion.uno(nombre, params)
+
+
+def consultar_todos(nombre, params=()):
+    """Ejecuta una consulta del catálogo y devuelve todas las filas como diccionarios"""
+    with get_db_connection() as conexion:
+        return conexion.todos(nombre, params)
+
+
+def iterar_consulta(nombre, params=(), lote=500):
+    """
+    Generador que devuelve las filas de una consulta del catálogo en listas de
+    hasta `lote` diccionarios, leyendo con fetchmany. La conexión queda
+    prestada mientras se consume el generador y se devuelve al pool al
+    terminar o al cerrarlo, así la memoria no depende del total de filas.
+    """
+    consulta = queries.obtener(nombre)
+    with get_db_connection() as conexion:
+        cursor = conexion.ejecutar(nombre, params)
+        while True:
+            filas = cursor.fetchmany(lote)
+            if not filas:
+                return
+            yield [consulta.fila_a_dict(row) for row in filas]
+
+
+def ejecutar(nombre, params=()):
+    """Ejecuta una sentencia de escritura del catálogo con commit. Devuelve las filas afectadas."""
+    with get_db_connection(commit=True) as conexion:
+        return conexion.ejecutar(nombre, params).rowcount
+
+
+# --- EJECUCIÓN CONCURRENTE ---
+#
+# pyodbc bloquea el hilo mientras espera a SQL Server. Este pool de hilos
+# acota cuántas llamadas a la base se ejecutan a la vez fuera del hilo de la
+# petición (DB_HILOS_MAX); cada llamada toma su propia conexión del pool.
+
+_PREFIJO_HILOS_DB = 'barberbook-db'
+_ejecutor_db = ThreadPoolExecutor(max_workers=Config.DB_HILOS_MAX, thread_name_prefix=_PREFIJO_HILOS_DB)
+
+
+def _en_hilo_db():
+    return threading.current_thread().name.startswith(_PREFIJO_HILOS_DB)
+
+
+def reiniciar_ejecutor():
+    """Crea un pool de hilos nuevo: los hilos del anterior no existen en un proceso hijo tras fork"""
+    global _ejecutor_db
+    _ejecutor_db = ThreadPoolExecutor(max_workers=Config.DB_HILOS_MAX, thread_name_prefix=_PREFIJO_HILOS_DB)
+
+
+class PlazoVencido(TimeoutError):
+    """Las llamadas de en_paralelo() no terminaron dentro del plazo"""
+
+
+class _Lote:
     """
-    conn = get_connection()
-    cursor = conn.cursor()
+    Llamadas de un en_paralelo(). Cada hilo registra aquí los cursores que usa
+    mientras ejecuta su llamada, para poder cancelar en el servidor las
+    sentencias en curso si vence el plazo o falla otra llamada del lote.
+    """
+
+    def __init__(self):
+        self.cancelado = False
+        self._cursores = {}  # hilo -> cursores usados en la llamada actual
+        self._lock = threading.Lock()
+
+    def registrar(self, cursor):
+        with self._lock:
+            if self.cancelado:
+                raise PlazoVencido('Lote de consultas cancelado')
+            self._cursores.setdefault(threading.get_ident(), set()).add(cursor)
+
+    def soltar(self, cursores=None):
+        """
+        Deja de vigilar `cursores` (o todos los del hilo). get_db_connection lo
+        llama antes de devolver la conexión al pool, porque desde ese momento
+        sus cursores pueden ser de otra petición y cancelarlos la afectaría.
+        """
+        with self._lock:
+            if cursores is None:
+                self._cursores.pop(threading.get_ident(), None)
+            else:
+                self._cursores.get(threading.get_ident(), set()).difference_update(cursores)
+
+    def cancelar(self):
+        with self._lock:
+            self.cancelado = True
+            for cursores in self._cursores.values():
+                for cursor in cursores:
+                    try:
+                        cursor.cancel()
+                    except pyodbc.Error:
+                        pass
+
+
+_lote_actual = threading.local()
+
+
+def _ejecutar_en_lote(lote, funcion, args):
+    if lote.cancelado:
+        raise PlazoVencido('Lote de consultas cancelado')
+    _lote_actual.lote = lote
     try:
-        yield cursor
-        if commit:
-            conn.commit()
-    except Exception as e:
-        conn.rollback()
-        raise e
+        return funcion(*args)
     finally:
-        cursor.close()
-        conn.close()
+        lote.soltar()
+        _lote_actual.lote = None
+
+
+def en_paralelo(*llamadas, plazo=None):
+    """
+    Ejecuta a la vez llamadas independientes, cada una como (funcion, arg1, arg2...),
+    cada una con su propia conexión del pool, y devuelve sus resultados en el
+    mismo orden. La espera total se acerca a la de la llamada más lenta.
+
+    Si alguna falla, o si no terminan todas en `plazo` segundos (por defecto
+    DB_PARALELO_PLAZO_SEGUNDOS), se cancelan las demás: las que no empezaron
+    no se ejecutan y las sentencias en curso se cancelan en el servidor. Se
+    propaga la excepción de la llamada fallida o PlazoVencido.
+
+    Uso:
+        servicios, barberos = en_paralelo((obtener_servicios_por_barberia, barberia_id),
+                                          (obtener_barberos_por_barberia, barberia_id))
+    """
+    if _en_hilo_db() or len(llamadas) < 2:
+        # Dentro de un hilo del pool esperar a otros hilos podría agotarlo
+        return [funcion(*args) for funcion, *args in llamadas]
+
+    plazo = Config.DB_PARALELO_PLAZO_SEGUNDOS if plazo is None else plazo
+    lote = _Lote()
+    futuros = [_ejecutor_db.submit(_ejecutar_en_lote, lote, funcion, args) for funcion, *args in llamadas]
+    hechos, pendientes = wait(futuros, timeout=plazo, return_when=FIRST_EXCEPTION)
+    fallido = next((f for f in hechos if f.exception() is not None), None)
+    if pendientes or fallido:
+        lote.cancelar()
+        for futuro in pendientes:
+            futuro.cancel()
+        metrics.lote_paralelo(len(llamadas), cancelado=True)
+        if fallido:
+            raise fallido.exception()
+        raise PlazoVencido(f'{len(pendientes)} de {len(llamadas)} consultas sin terminar en {plazo} s')
+    metrics.lote_paralelo(len(llamadas))
+    return [futuro.result() for futuro in futuros]
+
+
+_tablas = {}  # nombre o (tabla, columna) -> (existe, momento de la comprobación)
+
+
+def _existe(clave, comprobar):
+    """
+    Cachea la existencia de un objeto creado por una migración o tarea
+    opcional. Una vez encontrado no se vuelve a comprobar; si no existe se
+    reintenta cada 60 segundos.
+    """
+    existe, comprobado = _tablas.get(clave, (False, 0.0))
+    if existe or time.monotonic() - comprobado < 60:
+        return existe
+    existe = comprobar()
+    _tablas[clave] = (existe, time.monotonic())
+    return existe
+
+
+def tabla_existe(nombre):
+    """Indica si existe una tabla creada por una migración o tarea opcional"""
+    return _existe(nombre, lambda: consultar_uno('existe_tabla', (nombre,))['object_id'] is not None)
+
+
+def columna_existe(tabla, columna):
+    """Indica si existe una columna añadida por una migración"""
+    return _existe((tabla, columna),
+                   lambda: consultar_uno('existe_columna', (tabla, columna))['longitud'] is not None)
 
 
 # --- FUNCIONES DE USUARIOS ---
 
 def crear_usuario(email, password_hash, nombre, apellido, telefono, rol_id):
     """Crea un nuevo usuario en la base de datos"""
-    query = """
-        INSERT INTO Usuarios (email, password_hash, nombre, apellido, telefono, rol_id)
-        VALUES (?, ?, ?, ?, ?, ?)
-    """
-    with get_db_cursor(commit=True) as cursor:
-        cursor.execute(query, (email, password_hash, nombre, apellido, telefono, rol_id))
-        # Obtener el ID del usuario recién creado
-        cursor.execute("SELECT @@IDENTITY AS id")
-        user_id = cursor.fetchone()[0]
-        return user_id
+    with get_db_connection(commit=True) as conexion:
+        return conexion.ejecutar('usuario_crear',
+                                 (email, password_hash, nombre, apellido, telefono, rol_id)).fetchone()[0]
 
 
 def obtener_usuario_por_email(email):
     """Obtiene un usuario por su email"""
-    query = """
-        SELECT u.id, u.email, u.password_hash, u.nombre, u.apellido, 
-               u.telefono, u.foto_perfil, u.rol_id, u.activo, 
-               u.fecha_registro, u.ultimo_acceso, r.nombre as rol_nombre
-        FROM Usuarios u
-        INNER JOIN Roles r ON u.rol_id = r.id
-        WHERE u.email = ?
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (email,))
-        row = cursor.fetchone()
-        if row:
-            return {
-                'id': row[0],
-                'email': row[1],
-                'password_hash': row[2],
-                'nombre': row[3],
-                'apellido': row[4],
-                'telefono': row[5],
-                'foto_perfil': row[6],
-                'rol_id': row[7],
-                'activo': row[8],
-                'fecha_registro': row[9],
-                'ultimo_acceso': row[10],
-                'rol_nombre': row[11]
-            }
-        return None
+    return consultar_uno('usuario_por_email', (email,))
 
 
 def obtener_usuario_por_id(user_id):
     """Obtiene un usuario por su ID"""
-    query = """
-        SELECT u.id, u.email, u.password_hash, u.nombre, u.apellido, 
-               u.telefono, u.foto_perfil, u.rol_id, u.activo, 
-               u.fecha_registro, u.ultimo_acceso, r.nombre as rol_nombre
-        FROM Usuarios u
-        INNER JOIN Roles r ON u.rol_id = r.id
-        WHERE u.id = ?
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (user_id,))
-        row = cursor.fetchone()
-        if row:
-            return {
-                'id': row[0],
-                'email': row[1],
-                'password_hash': row[2],
-                'nombre': row[3],
-                'apellido': row[4],
-                'telefono': row[5],
-                'foto_perfil': row[6],
-                'rol_id': row[7],
-                'activo': row[8],
-                'fecha_registro': row[9],
-                'ultimo_acceso': row[10],
-                'rol_nombre': row[11]
-            }
-        return None
+    return consultar_uno('usuario_por_id', (user_id,))
 
 
 def actualizar_ultimo_acceso(user_id):
     """Actualiza la fecha de último acceso del usuario"""
-    query = "UPDATE Usuarios SET ultimo_acceso = GETDATE() WHERE id = ?"
-    with get_db_cursor(commit=True) as cursor:
-        cursor.execute(query, (user_id,))
+    ejecutar('usuario_actualizar_acceso', (user_id,))
 
 
 # --- FUNCIONES DE ROLES ---
 
 def obtener_rol_por_nombre(nombre_rol):
     """Obtiene un rol por su nombre"""
-    query = "SELECT id, nombre, descripcion FROM Roles WHERE nombre = ?"
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (nombre_rol,))
-        row = cursor.fetchone()
-        if row:
-            return {'id': row[0], 'nombre': row[1], 'descripcion': row[2]}
-        return None
+    return consultar_uno('rol_por_nombre', (nombre_rol,))
 
 
 # --- FUNCIONES DE BARBERÍAS ---
 
 def obtener_barberias_activas():
     """Obtiene todas las barberías activas"""
-    query = """
-        SELECT b.id, b.nombre, b.direccion, b.ciudad, b.telefono, 
-               b.email, b.logo, b.descripcion, b.hora_apertura, b.hora_cierre,
-               u.nombre + ' ' + u.apellido as propietario
-        FROM Barberias b
-        INNER JOIN Usuarios u ON b.propietario_id = u.id
-        WHERE b.activo = 1
-        ORDER BY b.nombre
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query)
-        rows = cursor.fetchall()
-        barberias = []
-        for row in rows:
-            barberias.append({
-                'id': row[0],
-                'nombre': row[1],
-                'direccion': row[2],
-                'ciudad': row[3],
-                'telefono': row[4],
-                'email': row[5],
-                'logo': row[6],
-                'descripcion': row[7],
-                'hora_apertura': row[8],
-                'hora_cierre': row[9],
-                'propietario': row[10]
-            })
-        return barberias
+    return consultar_todos('barberias_activas')
+
+
+def _lista_ids(ids):
+    """'1,2,3' para los filtros con STRING_SPLIT, o None"""
+    return ','.join(str(int(i)) for i in ids) if ids is not None else None
+
+
+def obtener_documentos_busqueda(barberia_ids=None):
+    """
+    Filas para el índice de búsqueda: una por servicio activo de cada barbería
+    activa (todas, o solo las de `barberia_ids`). Una barbería sin servicios
+    aparece una vez con servicio, precio y categoría en None; sin la
+    migración 6, latitud y longitud vienen en None.
+    """
+    ids = _lista_ids(barberia_ids)
+    nombre = ('busqueda_documentos' if columna_existe('Barberias', 'latitud')
+              else 'busqueda_documentos_sin_ubicacion')
+    filas = consultar_todos(nombre, (ids, ids))
+    for fila in filas:
+        for campo in ('precio', 'latitud', 'longitud'):
+            if fila[campo] is not None:
+                fila[campo] = float(fila[campo])
+    return filas
+
+
+def obtener_ubicacion_barberia(barberia_id):
+    """(latitud, longitud) de una barbería, o None si no tiene o falta la migración 6"""
+    if not columna_existe('Barberias', 'latitud'):
+        return None
+    fila = consultar_uno('barberia_ubicacion', (barberia_id,))
+    if not fila or fila['latitud'] is None:
+        return None
+    return float(fila['latitud']), float(fila['longitud'])
+
+
+def actualizar_ubicacion_barberia(barberia_id, latitud, longitud):
+    """Guarda las coordenadas de una barbería (None y None para quitarlas)"""
+    ejecutar('barberia_ubicacion_actualizar', (latitud, longitud, barberia_id))
 
 
 def obtener_barberia_por_id(barberia_id):
     """Obtiene una barbería por su ID"""
-    query = """
-        SELECT b.id, b.nombre, b.direccion, b.ciudad, b.telefono, 
-               b.email, b.logo, b.descripcion, b.hora_apertura, b.hora_cierre,
-               b.propietario_id
-        FROM Barberias b
-        WHERE b.id = ? AND b.activo = 1
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (barberia_id,))
-        row = cursor.fetchone()
-        if row:
-            return {
-                'id': row[0],
-                'nombre': row[1],
-                'direccion': row[2],
-                'ciudad': row[3],
-                'telefono': row[4],
-                'email': row[5],
-                'logo': row[6],
-                'descripcion': row[7],
-                'hora_apertura': row[8],
-                'hora_cierre': row[9],
-                'propietario_id': row[10]
-            }
-        return None
+    return consultar_uno('barberia_por_id', (barberia_id,))
+
+
+def obtener_barberias_por_propietario(propietario_id):
+    """Obtiene las barberías activas de un propietario"""
+    return consultar_todos('barberias_por_propietario', (propietario_id,))
 
 
 # --- FUNCIONES DE SERVICIOS ---
 
 def obtener_servicios_por_barberia(barberia_id):
     """Obtiene todos los servicios activos de una barbería"""
-    query = """
-        SELECT s.id, s.nombre, s.descripcion, s.precio, s.duracion_minutos,
-               s.imagen, c.nombre as categoria, c.icono
-        FROM Servicios s
-        INNER JOIN Categorias_Servicios c ON s.categoria_id = c.id
-        WHERE s.barberia_id = ? AND s.activo = 1
-        ORDER BY c.orden, s.nombre
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (barberia_id,))
-        rows = cursor.fetchall()
-        servicios = []
-        for row in rows:
-            servicios.append({
-                'id': row[0],
-                'nombre': row[1],
-                'descripcion': row[2],
-                'precio': float(row[3]),
-                'duracion_minutos': row[4],
-                'imagen': row[5],
-                'categoria': row[6],
-                'icono': row[7]
-            })
-        return servicios
+    servicios = consultar_todos('servicios_por_barberia', (barberia_id,))
+    for servicio in servicios:
+        servicio['precio'] = float(servicio['precio'])
+    return servicios
 
 
 def obtener_servicio_por_id(servicio_id):
     """Obtiene un servicio por su ID"""
-    query = """
-        SELECT s.id, s.barberia_id, s.nombre, s.descripcion, s.precio, 
-               s.duracion_minutos, s.imagen
-        FROM Servicios s
-        WHERE s.id = ? AND s.activo = 1
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (servicio_id,))
-        row = cursor.fetchone()
-        if row:
-            return {
-                'id': row[0],
-                'barberia_id': row[1],
-                'nombre': row[2],
-                'descripcion': row[3],
-                'precio': float(row[4]),
-                'duracion_minutos': row[5],
-                'imagen': row[6]
-            }
-        return None
+    servicio = consultar_uno('servicio_por_id', (servicio_id,))
+    if servicio:
+        servicio['precio'] = float(servicio['precio'])
+    return servicio
 
 
 # --- FUNCIONES DE BARBEROS ---
 
 def obtener_barberos_por_barberia(barberia_id):
     """Obtiene todos los barberos activos de una barbería"""
-    query = """
-        SELECT b.id, u.nombre, u.apellido, u.foto_perfil,
-               b.especialidad, b.años_experiencia, b.calificacion_promedio,
-               b.total_servicios
-        FROM Barberos b
-        INNER JOIN Usuarios u ON b.usuario_id = u.id
-        WHERE b.barberia_id = ? AND b.activo = 1
-        ORDER BY b.calificacion_promedio DESC
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (barberia_id,))
-        rows = cursor.fetchall()
-        barberos = []
-        for row in rows:
-            barberos.append({
-                'id': row[0],
-                'nombre': row[1],
-                'apellido': row[2],
-                'foto_perfil': row[3],
-                'especialidad': row[4],
-                'años_experiencia': row[5],
-                'calificacion_promedio': float(row[6]) if row[6] else 0,
-                'total_servicios': row[7]
-            })
-        return barberos
+    barberos = consultar_todos('barberos_por_barberia', (barberia_id,))
+    for barbero in barberos:
+        barbero['calificacion_promedio'] = float(barbero['calificacion_promedio'] or 0)
+    return barberos
+
+
+def obtener_barberia_de_barbero(barbero_id):
+    """ID de la barbería a la que pertenece un barbero, o None"""
+    fila = consultar_uno('barberia_de_barbero', (barbero_id,))
+    return fila['barberia_id'] if fila else None
 
 
 # --- FUNCIONES DE CITAS ---
 
-def crear_cita(cliente_id, barbero_id, servicio_id, fecha, hora_inicio, hora_fin, precio_final, notas_cliente=None):
-    """Crea una nueva cita"""
-    query = """
-        INSERT INTO Citas (cliente_id, barbero_id, servicio_id, fecha, 
-                          hora_inicio, hora_fin, estado_id, precio_final, notas_cliente)
-        VALUES (?, ?, ?, ?, ?, ?, 1, ?, ?)
+class HorarioNoDisponible(Exception):
+    """El hueco pedido ya lo ocupa otra cita o lo retiene otro cliente"""
+
+
+def crear_cita(cliente_id, barbero_id, servicio_id, fecha, hora_inicio, hora_fin, precio_final, notas_cliente=None,
+               reserva_token=None, espera=None):
     """
-    with get_db_cursor(commit=True) as cursor:
-        cursor.execute(query, (cliente_id, barbero_id, servicio_id, fecha, 
-                              hora_inicio, hora_fin, precio_final, notas_cliente))
-        cursor.execute("SELECT @@IDENTITY AS id")
-        cita_id = cursor.fetchone()[0]
-        return cita_id
-
-
-def obtener_citas_por_cliente(cliente_id):
-    """Obtiene todas las citas de un cliente"""
-    query = """
-        SELECT c.id, c.fecha, c.hora_inicio, c.hora_fin,
-               s.nombre as servicio, s.precio,
-               u.nombre + ' ' + u.apellido as barbero,
-               bar.nombre as barberia,
-               e.nombre as estado, e.color as estado_color
-        FROM Citas c
-        INNER JOIN Servicios s ON c.servicio_id = s.id
-        INNER JOIN Barberos b ON c.barbero_id = b.id
-        INNER JOIN Usuarios u ON b.usuario_id = u.id
-        INNER JOIN Barberias bar ON s.barberia_id = bar.id
-        INNER JOIN Estados_Citas e ON c.estado_id = e.id
-        WHERE c.cliente_id = ?
-        ORDER BY c.fecha DESC, c.hora_inicio DESC
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (cliente_id,))
-        rows = cursor.fetchall()
-        citas = []
-        for row in rows:
-            citas.append({
-                'id': row[0],
-                'fecha': row[1],
-                'hora_inicio': row[2],
-                'hora_fin': row[3],
-                'servicio': row[4],
-                'precio': float(row[5]),
-                'barbero': row[6],
-                'barberia': row[7],
-                'estado': row[8],
-                'estado_color': row[9]
-            })
-        return citas
+    Crea una nueva cita si el hueco sigue libre; si no, lanza
+    HorarioNoDisponible. Con `reserva_token`, la retención del cliente se
+    consume en la misma transacción, y con `espera` ((id, oferta_token) de
+    una entrada de la lista de espera) la entrada se da por atendida en ella,
+    o se lanza HorarioNoDisponible si ya no tiene esa oferta.
+    """
+    params = (cliente_id, barbero_id, servicio_id, fecha, hora_inicio, hora_fin, precio_final, notas_cliente,
+              barbero_id, fecha, hora_fin, hora_inicio)
+    with get_db_connection(commit=True) as conexion:
+        if espera is not None and not conexion.ejecutar('espera_atender', (espera[0], cliente_id, espera[1])).rowcount:
+            raise HorarioNoDisponible('La oferta ya no está disponible')
+        if reservas_temporales_disponible():
+            if reserva_token:
+                conexion.ejecutar('reserva_temporal_consumir', (reserva_token, cliente_id))
+            creada = conexion.ejecutar('cita_crear', params + (barbero_id, fecha, cliente_id, hora_fin, hora_inicio))
+        else:
+            creada = conexion.ejecutar('cita_crear_sin_reservas', params)
+        fila = creada.fetchone()
+        if fila is None:
+            raise HorarioNoDisponible('Ese horario ya no está disponible, elige otro')
+        cita_id = fila[0]
+        _encolar_notificaciones(conexion, 'cita_creada', [cita_id], ('cliente', 'barbero'))
+        _encolar_recordatorios(conexion, [cita_id])
+    _avisar_cambio_agenda([(barbero_id, fecha)])
+    return cita_id
+
+
+def obtener_citas_por_cliente(cliente_id, desde=None):
+    """
+    Obtiene las citas de un cliente, opcionalmente solo desde una fecha.
+    El histórico archivado solo se consulta si `desde` es anterior al horizonte.
+    """
+    citas = consultar_todos(variante_citas('citas_por_cliente', desde),
+                            (cliente_id, desde or FECHA_MIN))
+    for cita in citas:
+        cita['precio'] = float(cita['precio'])
+    return citas
 
 
 def obtener_slots_disponibles(barbero_id, fecha):
-    """Obtiene los horarios disponibles de un barbero en una fecha específica"""
-    # Primero obtenemos el horario del barbero para ese día
-    dia_semana_query = "SELECT DATEPART(WEEKDAY, ?)"
-    
-    with get_db_cursor() as cursor:
-        cursor.execute(dia_semana_query, (fecha,))
-        dia_semana = cursor.fetchone()[0]
-        
-        # Obtener horario del barbero
-        horario_query = """
-            SELECT hora_inicio, hora_fin
-            FROM Horarios_Barberos
-            WHERE barbero_id = ? AND dia_semana = ? AND activo = 1
-        """
-        cursor.execute(horario_query, (barbero_id, dia_semana))
-        horario = cursor.fetchone()
-        
-        if not horario:
-            return []
-        
-        # Obtener citas ya reservadas
-        citas_query = """
-            SELECT hora_inicio, hora_fin
-            FROM Citas
-            WHERE barbero_id = ? AND fecha = ? AND estado_id IN (1, 2)
-            ORDER BY hora_inicio
-        """
-        cursor.execute(citas_query, (barbero_id, fecha))
-        citas_ocupadas = cursor.fetchall()
-        
-        return {
-            'horario_inicio': horario[0],
-            'horario_fin': horario[1],
-            'citas_ocupadas': [(cita[0], cita[1]) for cita in citas_ocupadas]
-        }
+    """
+    Tramos de trabajo de un barbero en una fecha, del calendario materializado
+    (migración 7), y sus citas ocupadas ese día. 'turnos' es None si el
+    calendario no cubre esa fecha: hay que calcularlo con app/calendario.py.
+    """
+    with get_db_connection() as conexion:
+        turnos = None
+        if calendario_disponible():
+            filas = conexion.todos('calendario_rango', (fecha, fecha, str(int(barbero_id)), None))
+            if filas and filas[0]['hasta'] is not None and filas[0]['hasta'] >= fecha:
+                turnos = [(f['hora_inicio'], f['hora_fin']) for f in filas if f['fecha'] is not None]
+        citas_ocupadas = conexion.todos('citas_ocupadas', (barbero_id, fecha))
+    return {
+        'turnos': turnos,
+        'citas_ocupadas': [(cita['hora_inicio'], cita['hora_fin']) for cita in citas_ocupadas]
+    }
+
+
+def obtener_citas_ocupadas_barberias(barberia_ids, fecha):
+    """Citas pendientes o confirmadas de un día en varias barberías: {barbero_id: [(inicio, fin)]}"""
+    ocupadas = {}
+    for fila in consultar_todos('citas_ocupadas_barberias_dia', (fecha, _lista_ids(barberia_ids))):
+        ocupadas.setdefault(fila['barbero_id'], []).append((fila['hora_inicio'], fila['hora_fin']))
+    return ocupadas
+
+
+def obtener_citas_ocupadas_barberia(barberia_id, desde, hasta):
+    """Citas pendientes o confirmadas de una barbería entre dos fechas: {(barbero_id, fecha): [(inicio, fin)]}"""
+    ocupadas = {}
+    for fila in consultar_todos('citas_ocupadas_barberia_rango', (barberia_id, desde, hasta)):
+        ocupadas.setdefault((fila['barbero_id'], fila['fecha']), []).append((fila['hora_inicio'], fila['hora_fin']))
+    return ocupadas
+
+
+def hay_cita_solapada(barbero_id, fecha, hora_inicio, hora_fin):
+    """Si alguna cita pendiente o confirmada del barbero se solapa con [hora_inicio, hora_fin)"""
+    return consultar_uno('cita_solapada', (barbero_id, fecha, hora_fin, hora_inicio)) is not None
+
+
+# --- FUNCIONES DE RESERVAS TEMPORALES ---
+
+def reservas_temporales_disponible():
+    return tabla_existe('Reservas_Temporales')
+
+
+def reservas_temporales_con_tipo():
+    return columna_existe('Reservas_Temporales', 'tipo')
+
+
+def crear_reserva_temporal(token, cliente_id, barbero_id, fecha, hora_inicio, hora_fin, ttl_segundos,
+                           oferta=False):
+    """
+    Retiene el hueco para el cliente durante `ttl_segundos` si no lo ocupa una
+    cita ni lo retiene otro cliente. Una retención normal suelta la que el
+    cliente tuviera; una oferta de la lista de espera (oferta=True, migración
+    14) no suelta ninguna ni se suelta al retener otra. Devuelve si se retuvo.
+    """
+    params = (token, cliente_id, barbero_id, fecha, hora_inicio, hora_fin, ttl_segundos,
+              barbero_id, fecha, hora_fin, hora_inicio, barbero_id, fecha, cliente_id, hora_fin, hora_inicio)
+    if oferta:
+        nombre = 'reserva_temporal_ofrecer'
+    else:
+        nombre = 'reserva_temporal_crear' if reservas_temporales_con_tipo() else 'reserva_temporal_crear_sin_tipo'
+        params = (cliente_id,) + params
+    with get_db_connection(commit=True) as conexion:
+        cambios = conexion.todos(nombre, params)
+    _avisar_cambio_agenda({(c['barbero_id'], c['fecha']) for c in cambios})
+    return any(c['retenida'] for c in cambios)
+
+
+def obtener_reserva_temporal_cliente(cliente_id):
+    """Token de la retención normal (no oferta) en vigor del cliente, o None"""
+    fila = consultar_uno('reserva_temporal_de_cliente', (cliente_id,))
+    return fila['token'] if fila else None
+
+
+def soltar_reserva_temporal(token, cliente_id):
+    """Suelta la retención `token` del cliente antes de que venza"""
+    with get_db_connection(commit=True) as conexion:
+        soltadas = conexion.todos('reserva_temporal_soltar', (token, cliente_id))
+    _avisar_cambio_agenda({(s['barbero_id'], s['fecha']) for s in soltadas})
+
+
+def obtener_reservas_ocupadas(desde, hasta, barbero_ids=None, barberia_ids=None, excepto_cliente=None):
+    """
+    Huecos retenidos y no vencidos entre dos fechas, salvo los del cliente
+    `excepto_cliente`: {(barbero_id, fecha): [(inicio, fin)]}
+    """
+    ocupadas = {}
+    filas = consultar_todos('reservas_temporales_rango', (desde, hasta, excepto_cliente or 0,
+                                                          _lista_ids(barbero_ids), _lista_ids(barberia_ids)))
+    for fila in filas:
+        ocupadas.setdefault((fila['barbero_id'], fila['fecha']), []).append((fila['hora_inicio'], fila['hora_fin']))
+    return ocupadas
+
+
+def purgar_reservas_temporales(lote=1000):
+    """Borra un lote de retenciones vencidas. Devuelve cuántas se borraron."""
+    with get_db_connection(commit=True) as conexion:
+        borradas = conexion.todos('reservas_temporales_purgar', (lote,))
+    _avisar_cambio_agenda((b['barbero_id'], b['fecha']) for b in borradas)
+    return sum(b['borradas'] for b in borradas)
+
+
+# --- FUNCIONES DE SERIES DE CITAS ---
+
+def series_disponible():
+    return tabla_existe('Series_Citas')
+
+
+def _crear_citas_fechas(conexion, cliente_id, barbero_id, servicio_id, fechas, hora_inicio, hora_fin,
+                        precio_final, notas_cliente):
+    """Inserta en una sentencia la cita de cada fecha libre y sus recordatorios. Devuelve las fechas creadas."""
+    params = (cliente_id, barbero_id, servicio_id, hora_inicio, hora_fin, precio_final, notas_cliente,
+              ','.join(f.isoformat() for f in fechas), barbero_id, hora_fin, hora_inicio)
+    if reservas_temporales_disponible():
+        creadas = conexion.todos('citas_crear_fechas', params + (barbero_id, cliente_id, hora_fin, hora_inicio))
+    else:
+        creadas = conexion.todos('citas_crear_fechas_sin_reservas', params)
+    _encolar_recordatorios(conexion, [c['id'] for c in creadas])
+    return {c['fecha'] for c in creadas}
+
+
+def crear_serie_citas(cliente_id, barbero_id, servicio_id, fecha_inicio, fecha_fin, cada_semanas,
+                      hora_inicio, hora_fin, precio_final, notas_cliente, fechas, generada_hasta,
+                      reserva_token=None):
+    """
+    Crea la serie y, en la misma transacción, las citas de `fechas`. Si
+    alguna ya está ocupada no se crea nada y se lanza HorarioNoDisponible
+    con esas fechas. Devuelve el id de la serie.
+    """
+    with get_db_connection(commit=True) as conexion:
+        serie_id = conexion.ejecutar('serie_crear', (cliente_id, barbero_id, servicio_id, fecha_inicio, fecha_fin,
+                                                     cada_semanas, hora_inicio, hora_fin, precio_final,
+                                                     notas_cliente, generada_hasta, len(fechas),
+                                                     generada_hasta < fecha_fin)).fetchone()[0]
+        if reserva_token and reservas_temporales_disponible():
+            conexion.ejecutar('reserva_temporal_consumir', (reserva_token, cliente_id))
+        ocupadas = set(fechas) - _crear_citas_fechas(conexion, cliente_id, barbero_id, servicio_id, fechas,
+                                                     hora_inicio, hora_fin, precio_final, notas_cliente)
+        if ocupadas:
+            raise HorarioNoDisponible('Ese horario ya está ocupado el '
+                                      + ', '.join(f.strftime('%d/%m/%Y') for f in sorted(ocupadas)))
+    _avisar_cambio_agenda((barbero_id, fecha) for fecha in fechas)
+    return serie_id
+
+
+def obtener_series_pendientes(horizonte, lote=200):
+    """Series activas cuyas citas no están creadas hasta `horizonte`"""
+    return consultar_todos('series_pendientes', (lote, horizonte))
+
+
+def avanzar_serie(serie, fechas, generada_hasta, omitidas=0):
+    """
+    Crea las citas libres de `fechas` y marca la serie como generada hasta
+    `generada_hasta` (terminada si llega a su última fecha). Las ocupadas se
+    cuentan como omitidas. Devuelve cuántas citas se crearon.
+    """
+    with get_db_connection(commit=True) as conexion:
+        creadas = set()
+        if fechas:
+            creadas = _crear_citas_fechas(conexion, serie['cliente_id'], serie['barbero_id'], serie['servicio_id'],
+                                          fechas, serie['hora_inicio'], serie['hora_fin'],
+                                          serie['precio_final'], serie['notas_cliente'])
+        conexion.ejecutar('serie_avanzar', (generada_hasta, len(creadas), omitidas + len(fechas) - len(creadas),
+                                            generada_hasta < serie['fecha_fin'], serie['id']))
+    _avisar_cambio_agenda((serie['barbero_id'], fecha) for fecha in creadas)
+    return len(creadas)
+
+
+def obtener_series_cliente(cliente_id):
+    """Series activas de un cliente"""
+    if not series_disponible():
+        return []
+    return consultar_todos('series_por_cliente', (cliente_id,))
+
+
+def detener_serie(serie_id, cliente_id):
+    """Deja de crear citas de la serie (las ya creadas se mantienen). Devuelve si estaba activa."""
+    return ejecutar('serie_detener', (serie_id, cliente_id)) > 0
+
+
+# --- FUNCIONES DE LISTA DE ESPERA ---
+
+def lista_espera_disponible():
+    # Las ofertas son retenciones de tipo 'oferta' (migración 14)
+    return tabla_existe('Lista_Espera') and reservas_temporales_con_tipo()
+
+
+def crear_espera(cliente_id, barberia_id, barbero_id, servicio_id, fecha_desde, fecha_hasta):
+    """Apunta al cliente en la lista de espera (barbero_id None = cualquiera). Devuelve el id."""
+    with get_db_connection(commit=True) as conexion:
+        espera_id = conexion.ejecutar('espera_crear', (cliente_id, barberia_id, barbero_id, servicio_id,
+                                                       fecha_desde, fecha_hasta)).fetchone()[0]
+        conexion.ejecutar_lote('espera_dia_insertar', [
+            (barberia_id, fecha_desde + timedelta(days=dia), espera_id)
+            for dia in range((fecha_hasta - fecha_desde).days + 1)])
+    return espera_id
+
+
+def obtener_candidatos_espera(barberia_id, barbero_id, fecha, duracion_minutos, excluir=(), limite=10):
+    """Entradas activas que aceptan ese hueco, en orden de llegada"""
+    return consultar_todos('espera_candidatos', (limite, barberia_id, fecha, barbero_id, duracion_minutos,
+                                                 _lista_ids(excluir)))
+
+
+def ofrecer_espera(espera_id, barbero_id, fecha, hora_inicio, hora_fin, token, ttl_segundos):
+    """Marca la entrada como ofrecida con el hueco retenido por `token`. Devuelve si seguía activa."""
+    return ejecutar('espera_ofrecer', (barbero_id, fecha, hora_inicio, hora_fin, token, ttl_segundos,
+                                       espera_id)) > 0
+
+
+def obtener_ofertas_vencidas(lote=200):
+    return consultar_todos('esperas_ofertas_vencidas', (lote,))
+
+
+def reactivar_espera(espera_id):
+    """Devuelve a la cola una entrada cuya oferta venció. Devuelve si seguía ofrecida."""
+    return ejecutar('espera_reactivar', (espera_id,)) > 0
+
+
+def cerrar_espera(espera_id, cliente_id, estado):
+    """Pasa a `estado` ('atendida' o 'cancelada') una entrada abierta. Devuelve cómo estaba, o None."""
+    with get_db_connection(commit=True) as conexion:
+        return conexion.uno('espera_cerrar', (estado, espera_id, cliente_id))
+
+
+def obtener_espera_cliente(espera_id, cliente_id):
+    return consultar_uno('espera_de_cliente', (espera_id, cliente_id))
+
+
+def obtener_esperas_cliente(cliente_id):
+    """Entradas abiertas (activas u ofrecidas) de un cliente"""
+    if not lista_espera_disponible():
+        return []
+    return consultar_todos('esperas_por_cliente', (cliente_id,))
+
+
+def purgar_lista_espera(hoy, lote=5000):
+    """Da por vencidas las entradas cuyo rango ya pasó y borra sus días pasados. Devuelve las filas tocadas."""
+    total = 0
+    for nombre in ('esperas_vencer', 'esperas_dias_purgar'):
+        while True:
+            filas = ejecutar(nombre, (lote, hoy))
+            total += filas
+            if filas < lote:
+                break
+    return total
+
+
+# --- FUNCIONES DE NOTIFICACIONES ---
+# Bandeja de salida (migración 11): las escrituras de citas encolan sus
+# avisos en su misma transacción y app/notificaciones.py los envía después.
+
+def notificaciones_disponible():
+    return tabla_existe('Notificaciones_Salida')
+
+
+def _encolar_notificaciones(conexion, tipo, cita_ids, roles=('cliente',)):
+    """Encola, dentro de la transacción de `conexion`, el aviso `tipo` de esas citas para esos roles"""
+    if not cita_ids or not Config.NOTIFICACIONES_CANALES or not notificaciones_disponible():
+        return
+    conexion.ejecutar('notificaciones_encolar', (tipo, tipo, Config.NOTIFICACIONES_CANALES,
+                                                 _lista_ids(cita_ids), ','.join(roles)))
+
+
+def _encolar_recordatorios(conexion, cita_ids):
+    """Programa, dentro de la transacción de `conexion`, los recordatorios de esas citas (RECORDATORIOS_HORAS)"""
+    if not cita_ids or not Config.RECORDATORIOS_HORAS or not Config.NOTIFICACIONES_CANALES \
+            or not notificaciones_disponible():
+        return
+    conexion.ejecutar('recordatorios_encolar', (Config.RECORDATORIOS_HORAS, Config.NOTIFICACIONES_CANALES,
+                                                _lista_ids(cita_ids)))
+
+
+def tomar_notificaciones(lote, plazo_segundos):
+    """Aparta hasta `lote` notificaciones pendientes durante `plazo_segundos` y las devuelve con sus datos"""
+    with get_db_connection(commit=True) as conexion:
+        return conexion.todos('notificaciones_tomar', (lote, plazo_segundos))
+
+
+def cerrar_notificaciones(ids, estado):
+    """Marca como 'enviada' o 'descartada' esas notificaciones"""
+    if ids:
+        ejecutar('notificaciones_cerrar', (estado, ','.join(str(int(i)) for i in ids)))
+
+
+def reintentar_notificaciones(filas):
+    """filas: (estado, espera_segundos, error, id); estado 'pendiente' para reintentar o 'fallida'"""
+    if filas:
+        with get_db_connection(commit=True) as conexion:
+            conexion.ejecutar_lote('notificacion_reintentar', filas)
+
+
+def purgar_notificaciones(limite, lote=5000):
+    """Borra las notificaciones cerradas creadas antes de `limite`. Devuelve cuántas."""
+    total = 0
+    while True:
+        borradas = ejecutar('notificaciones_purgar', (lote, limite))
+        total += borradas
+        if borradas < lote:
+            return total
+
+
+# --- FUNCIONES DE RESEÑAS ---
+# Barberos.calificacion_promedio sale de la suma y el número de calificaciones
+# de Calificaciones_Barberos (migración 13), que cada reseña actualiza
+
+_ID_MAX = 2 ** 31 - 1  # `antes` de la primera página
+
+
+def resenas_disponible():
+    return tabla_existe('Calificaciones_Barberos')
+
+
+def crear_resena(cita_id, cliente_id, calificacion, comentario=None):
+    """Reseña una cita completada del cliente y actualiza la calificación de su barbero. Devuelve si se creó."""
+    with get_db_connection(commit=True) as conexion:
+        return conexion.uno('resena_crear', (calificacion, comentario, cita_id, cliente_id))['creada'] > 0
+
+
+def _pagina(filas, limite):
+    """(filas de la página, id a partir del que sigue la siguiente o None si no hay más)"""
+    if len(filas) > limite:
+        return filas[:limite], filas[limite - 1]['id']
+    return filas, None
+
+
+def obtener_resenas_barberia(barberia_id, antes=None, limite=10):
+    """Reseñas de una barbería, las más recientes primero, anteriores al id `antes`: (reseñas, siguiente)"""
+    if not resenas_disponible():
+        return [], None
+    return _pagina(consultar_todos('resenas_barberia', (limite + 1, barberia_id, antes or _ID_MAX)), limite)
+
+
+def obtener_resenas_barbero(barbero_id, antes=None, limite=10):
+    """Como obtener_resenas_barberia, para un barbero"""
+    if not resenas_disponible():
+        return [], None
+    return _pagina(consultar_todos('resenas_barbero', (limite + 1, barbero_id, antes or _ID_MAX)), limite)
+
+
+def obtener_citas_con_resena(cita_ids):
+    """Cuáles de esas citas ya tienen reseña"""
+    if not cita_ids or not resenas_disponible():
+        return set()
+    return {fila['cita_id'] for fila in consultar_todos('citas_con_resena', (_lista_ids(cita_ids),))}
+
+
+def reconciliar_calificaciones_lote(despues_de, lote):
+    """Recalcula la calificación de los `lote` barberos siguientes al id `despues_de`: {'ultimo', 'corregidos'}"""
+    with get_db_connection(commit=True) as conexion:
+        return conexion.uno('calificaciones_reconciliar', (lote, despues_de))
+
+
+# --- FUNCIONES DE HORARIOS Y CALENDARIO ---
+# Los filtros son una lista de barberos o una de barberías (de estas, solo
+# sus barberos activos)
+
+def calendario_disponible():
+    return tabla_existe('Calendario_Barberos')
+
+
+def obtener_reglas_horario(desde, hasta, barbero_ids=None, barberia_ids=None):
+    """
+    Lo necesario para calcular el calendario sin materializar: el dia_semana
+    de `desde` según SQL Server, los horarios semanales y las excepciones que
+    tocan el rango (una fila por barbero afectado).
+    """
+    filtro = (_lista_ids(barbero_ids), _lista_ids(barberia_ids))
+    with get_db_connection() as conexion:
+        dia_semana = conexion.ejecutar('dia_semana', (desde,)).fetchone()[0]
+        horarios = conexion.todos('horarios_semana', filtro)
+        excepciones = []
+        if tabla_existe('Excepciones_Horario'):
+            excepciones = conexion.todos('excepciones_rango', (hasta, desde) + filtro)
+    return dia_semana, horarios, excepciones
+
+
+def obtener_calendario(desde, hasta, barbero_ids=None, barberia_ids=None):
+    """
+    Tramos materializados entre dos fechas, con el `hasta` generado de cada
+    barbero (una fila sin fecha si no tiene tramos). None sin la migración 7.
+    """
+    if not calendario_disponible():
+        return None
+    return consultar_todos('calendario_rango', (desde, hasta, _lista_ids(barbero_ids), _lista_ids(barberia_ids)))
+
+
+def reemplazar_calendario(barbero_ids, desde, hasta, tramos, subir_version=True):
+    """
+    Sustituye en una transacción los tramos de esos barberos entre dos fechas
+    por `tramos` [(barbero_id, fecha, hora_inicio, hora_fin)] y marca su
+    calendario como generado hasta `hasta`.
+    """
+    ids = _lista_ids(barbero_ids)
+    with get_db_connection(commit=True) as conexion:
+        conexion.ejecutar('calendario_borrar_rango', (desde, hasta, ids))
+        conexion.ejecutar_lote('calendario_insertar', tramos)
+        conexion.ejecutar('calendario_marcar_generado', (ids, hasta, hasta, hasta))
+        if subir_version and tabla_existe('Versiones_Agenda'):
+            conexion.ejecutar('versiones_agenda_subir_horario', (ids,))
+
+
+def obtener_calendario_pendientes():
+    """Barberos con cambios de horario o excepciones sin aplicar: [{barbero_id, desde, marca}]"""
+    return consultar_todos('calendario_pendientes')
+
+
+def borrar_calendario_pendientes(pendientes):
+    """Quita los avisos ya aplicados (si llegó otro mientras tanto, su marca cambió y se queda)"""
+    with get_db_connection(commit=True) as conexion:
+        conexion.ejecutar_lote('calendario_pendiente_borrar', [(p['barbero_id'], p['marca']) for p in pendientes])
+
+
+def obtener_calendario_atrasados(horizonte, lote=200):
+    """Barberos activos cuyo calendario no llega a `horizonte`: [{barbero_id, hasta}]"""
+    return consultar_todos('calendario_atrasados', (lote, horizonte))
+
+
+def purgar_calendario(hasta, lote=5000):
+    """Borra un lote de tramos de días anteriores a `hasta`. Devuelve cuántos se borraron."""
+    return ejecutar('calendario_purgar', (lote, hasta))
+
+
+def obtener_excepciones_barberia(barberia_id, desde):
+    """Excepciones de horario de una barbería que terminan en `desde` o después"""
+    if not tabla_existe('Excepciones_Horario'):
+        return []
+    return consultar_todos('excepciones_por_barberia', (barberia_id, desde))
+
+
+def crear_excepcion(barberia_id, barbero_id, fecha_desde, fecha_hasta, tipo, hora_inicio=None, hora_fin=None,
+                    motivo=None):
+    """Crea una excepción de horario (barbero_id None = toda la barbería)"""
+    ejecutar('excepcion_crear', (barberia_id, barbero_id, fecha_desde, fecha_hasta, tipo,
+                                 hora_inicio, hora_fin, motivo))
+
+
+def eliminar_excepcion(excepcion_id, barberia_id):
+    """Elimina una excepción de horario de la barbería. Devuelve si existía."""
+    return ejecutar('excepcion_eliminar', (excepcion_id, barberia_id)) > 0
 
 
 # --- FUNCIONES DE ESTADÍSTICAS ---
 
 def obtener_estadisticas_barbero(barbero_id):
     """Obtiene estadísticas de un barbero"""
-    query = """
-        SELECT 
-            COUNT(*) as total_citas,
-            SUM(CASE WHEN estado_id = 3 THEN 1 ELSE 0 END) as completadas,
-            AVG(CASE WHEN estado_id = 3 THEN precio_final ELSE NULL END) as ingreso_promedio
-        FROM Citas
-        WHERE barbero_id = ?
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (barbero_id,))
-        row = cursor.fetchone()
-        if row:
-            return {
-                'total_citas': row[0],
-                'completadas': row[1],
-                'ingreso_promedio': float(row[2]) if row[2] else 0
-            }
-        return None
+    estadisticas = consultar_uno(variante_citas('estadisticas_barbero'), (barbero_id,))
+    if estadisticas:
+        estadisticas['ingreso_promedio'] = float(estadisticas['ingreso_promedio'] or 0)
+    return estadisticas
 
 
 # --- FUNCIONES ESPECÍFICAS PARA BARBEROS ---
 
 def obtener_barbero_por_usuario_id(usuario_id):
     """Obtiene el registro de barbero asociado a un usuario"""
-    query = """
-        SELECT b.id, b.usuario_id, b.barberia_id, b.especialidad, 
-               b.años_experiencia, b.calificacion_promedio, b.total_servicios,
-               bar.nombre as barberia_nombre
-        FROM Barberos b
-        INNER JOIN Barberias bar ON b.barberia_id = bar.id
-        WHERE b.usuario_id = ? AND b.activo = 1
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (usuario_id,))
-        row = cursor.fetchone()
-        if row:
-            return {
-                'id': row[0],
-                'usuario_id': row[1],
-                'barberia_id': row[2],
-                'especialidad': row[3],
-                'años_experiencia': row[4],
-                'calificacion_promedio': float(row[5]) if row[5] else 0,
-                'total_servicios': row[6],
-                'barberia_nombre': row[7]
-            }
-        return None
+    barbero = consultar_uno('barbero_por_usuario', (usuario_id,))
+    if barbero:
+        barbero['calificacion_promedio'] = float(barbero['calificacion_promedio'] or 0)
+    return barbero
 
 
-def obtener_citas_por_barbero(barbero_id, fecha=None, estado=None):
-    """Obtiene las citas de un barbero, opcionalmente filtradas por fecha y estado"""
-    query = """
-        SELECT c.id, c.fecha, c.hora_inicio, c.hora_fin,
-               u.nombre + ' ' + u.apellido as cliente_nombre,
-               u.telefono as cliente_telefono,
-               s.nombre as servicio_nombre,
-               s.precio as servicio_precio,
-               c.precio_final,
-               e.nombre as estado_nombre,
-               e.color as estado_color,
-               e.id as estado_id,
-               c.notas_cliente,
-               c.notas_barbero
-        FROM Citas c
-        INNER JOIN Usuarios u ON c.cliente_id = u.id
-        INNER JOIN Servicios s ON c.servicio_id = s.id
-        INNER JOIN Estados_Citas e ON c.estado_id = e.id
-        WHERE c.barbero_id = ?
-    """
-    params = [barbero_id]
-    
-    if fecha:
-        query += " AND c.fecha = ?"
-        params.append(fecha)
-    
+def obtener_citas_por_barbero(barbero_id, fecha=None, estado=None, desde=None, hasta=None):
+    """
+    Obtiene las citas de un barbero, opcionalmente filtradas por fecha exacta,
+    estado o rango de fechas. El histórico archivado solo se consulta si
+    el filtro de fecha llega a antes del horizonte de archivo.
+    """
+    # Fecha exacta = rango [fecha, fecha]; el estado elige la variante con su filtro
+    inicio = max(filter(None, (fecha, desde)), default=FECHA_MIN)
+    fin = fecha or hasta or FECHA_MAX
     if estado:
-        query += " AND e.nombre = ?"
-        params.append(estado)
-    
-    query += " ORDER BY c.fecha DESC, c.hora_inicio DESC"
-    
-    with get_db_cursor() as cursor:
-        cursor.execute(query, params)
-        rows = cursor.fetchall()
-        citas = []
-        for row in rows:
-            citas.append({
-                'id': row[0],
-                'fecha': row[1],
-                'hora_inicio': row[2],
-                'hora_fin': row[3],
-                'cliente_nombre': row[4],
-                'cliente_telefono': row[5],
-                'servicio_nombre': row[6],
-                'servicio_precio': float(row[7]),
-                'precio_final': float(row[8]) if row[8] else float(row[7]),
-                'estado_nombre': row[9],
-                'estado_color': row[10],
-                'estado_id': row[11],
-                'notas_cliente': row[12],
-                'notas_barbero': row[13]
-            })
-        return citas
+        citas = consultar_todos(variante_citas('citas_por_barbero_estado', fecha or desde),
+                                (barbero_id, inicio, fin, estado))
+    else:
+        citas = consultar_todos(variante_citas('citas_por_barbero', fecha or desde), (barbero_id, inicio, fin))
+    for cita in citas:
+        cita['servicio_precio'] = float(cita['servicio_precio'])
+        cita['precio_final'] = float(cita['precio_final']) if cita['precio_final'] else cita['servicio_precio']
+    return citas
 
 
 def obtener_cita_por_id(cita_id):
     """Obtiene una cita por su ID con toda la información"""
-    query = """
-        SELECT c.id, c.cliente_id, c.barbero_id, c.servicio_id, 
-               c.fecha, c.hora_inicio, c.hora_fin, c.estado_id,
-               c.notas_cliente, c.notas_barbero, c.precio_final,
-               u.nombre + ' ' + u.apellido as cliente_nombre,
-               s.nombre as servicio_nombre,
-               e.nombre as estado_nombre
-        FROM Citas c
-        INNER JOIN Usuarios u ON c.cliente_id = u.id
-        INNER JOIN Servicios s ON c.servicio_id = s.id
-        INNER JOIN Estados_Citas e ON c.estado_id = e.id
-        WHERE c.id = ?
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (cita_id,))
-        row = cursor.fetchone()
-        if row:
-            return {
-                'id': row[0],
-                'cliente_id': row[1],
-                'barbero_id': row[2],
-                'servicio_id': row[3],
-                'fecha': row[4],
-                'hora_inicio': row[5],
-                'hora_fin': row[6],
-                'estado_id': row[7],
-                'notas_cliente': row[8],
-                'notas_barbero': row[9],
-                'precio_final': float(row[10]) if row[10] else 0,
-                'cliente_nombre': row[11],
-                'servicio_nombre': row[12],
-                'estado_nombre': row[13]
-            }
-        return None
+    with get_db_connection() as conexion:
+        cita = conexion.uno('cita_por_id', (cita_id,))
+        if not cita and historico_disponible():
+            # La cita pudo haberse movido al histórico
+            cita = conexion.uno('cita_por_id_archivada', (cita_id,))
+    if cita:
+        cita['precio_final'] = float(cita['precio_final']) if cita['precio_final'] else 0
+    return cita
+
+
+def cambiar_estado_cita(cita_id, nuevo_estado_id, notas_barbero=None, avisar='cliente'):
+    """Cambia el estado de una cita y encola el aviso para `avisar` ('cliente' o 'barbero')"""
+    with get_db_connection(commit=True) as conexion:
+        cambiadas = conexion.todos('cita_cambiar_estado', (nuevo_estado_id, notas_barbero, cita_id))
+        if cambiadas:
+            _encolar_notificaciones(conexion, 'cita_estado', [cita_id], (avisar,))
+    _avisar_cambio_agenda([(c['barbero_id'], c['fecha']) for c in cambiadas])
+    return True
 
 
-def cambiar_estado_cita(cita_id, nuevo_estado_id, notas_barbero=None):
-    """Cambia el estado de una cita"""
-    query = """
-        UPDATE Citas 
-        SET estado_id = ?, 
-            notas_barbero = ?,
-            fecha_modificacion = GETDATE()
-        WHERE id = ?
+def cambiar_estado_citas(usuario_id, cita_ids, nombre_estado, notas_barbero=None):
     """
-    with get_db_cursor(commit=True) as cursor:
-        cursor.execute(query, (nuevo_estado_id, notas_barbero, cita_id))
-        return True
+    Cambia el estado de varias citas de un barbero en una sola sentencia.
+    La verificación de propiedad (la cita es del barbero del usuario) y la
+    resolución del estado por nombre se hacen dentro del mismo UPDATE.
+
+    Devuelve un diccionario {cita_id: 'actualizada' | 'rechazada'}; una cita
+    se rechaza si no existe, no pertenece al barbero o el estado no es válido.
+    """
+    cita_ids = sorted({int(cita_id) for cita_id in cita_ids})
+    if not cita_ids:
+        return {}
+
+    with get_db_connection(commit=True) as conexion:
+        filas = conexion.todos('citas_cambiar_estado_lote',
+                               (notas_barbero, nombre_estado, usuario_id,
+                                ','.join(str(cita_id) for cita_id in cita_ids)))
+        actualizadas = {fila['id'] for fila in filas}
+        _encolar_notificaciones(conexion, 'cita_estado', sorted(actualizadas))
+    _avisar_cambio_agenda({(fila['barbero_id'], fila['fecha']) for fila in filas})
+
+    return {cita_id: 'actualizada' if cita_id in actualizadas else 'rechazada'
+            for cita_id in cita_ids}
+
+
+def marcar_citas_vencidas(limite, nombre_estado='No Show', lote=500):
+    """
+    Pasa a `nombre_estado` un lote de citas Pendientes/Confirmadas cuya hora
+    de fin es anterior a `limite` (datetime). Devuelve cuántas se actualizaron.
+    """
+    return ejecutar('citas_marcar_vencidas',
+                    (lote, nombre_estado, limite.date(), limite.date(), limite.time()))
 
 
 def cancelar_cita_cliente(cita_id, cliente_id):
     """Cancela una cita desde el lado del cliente"""
     # Verificar que la cita pertenece al cliente
-    query_verificar = """
-        SELECT c.id, c.cliente_id, c.estado_id, e.nombre as estado_nombre
-        FROM Citas c
-        INNER JOIN Estados_Citas e ON c.estado_id = e.id
-        WHERE c.id = ? AND c.cliente_id = ?
-    """
-    with get_db_cursor() as cursor:
-        cursor.execute(query_verificar, (cita_id, cliente_id))
-        cita = cursor.fetchone()
-        
-        if not cita:
-            return False, "Cita no encontrada"
-        
-        # Verificar que la cita se puede cancelar (solo Pendiente o Confirmada)
-        if cita[3] not in ['Pendiente', 'Confirmada']:
-            return False, f"No puedes cancelar una cita con estado: {cita[3]}"
+    cita = consultar_uno('cita_de_cliente', (cita_id, cliente_id))
+    
+    if not cita:
+        return False, "Cita no encontrada"
+    
+    # Verificar que la cita se puede cancelar (solo Pendiente o Confirmada)
+    if cita['estado_nombre'] not in ['Pendiente', 'Confirmada']:
+        return False, f"No puedes cancelar una cita con estado: {cita['estado_nombre']}"
     
     # Obtener ID del estado "Cancelada"
     estado_cancelada = obtener_estado_cita_por_nombre('Cancelada')
@@ -568,18 +1148,179 @@ def cancelar_cita_cliente(cita_id, cliente_id):
     
     # Cancelar la cita
     try:
-        cambiar_estado_cita(cita_id, estado_cancelada['id'], "Cancelada por el cliente")
-        return True, "Cita cancelada exitosamente"
+        cambiar_estado_cita(cita_id, estado_cancelada['id'], "Cancelada por el cliente", avisar='barbero')
     except Exception as e:
         return False, f"Error al cancelar: {str(e)}"
+    _avisar_hueco_liberado(cita['barbero_id'], cita['fecha'], cita['hora_inicio'], cita['hora_fin'])
+    return True, "Cita cancelada exitosamente"
 
 
 def obtener_estado_cita_por_nombre(nombre_estado):
     """Obtiene un estado de cita por su nombre"""
-    query = "SELECT id, nombre, color FROM Estados_Citas WHERE nombre = ?"
-    with get_db_cursor() as cursor:
-        cursor.execute(query, (nombre_estado,))
-        row = cursor.fetchone()
-        if row:
-            return {'id': row[0], 'nombre': row[1], 'color': row[2]}
-        return None
\ No newline at end of file
+    return consultar_uno('estado_cita_por_nombre', (nombre_estado,))
+
+
+# --- AVISOS DE CAMBIOS EN LA AGENDA ---
+#
+# Las escrituras que cambian la disponibilidad avisan, después del commit, a
+# las funciones registradas con al_cambiar_agenda (p. ej. app/eventos.py), y
+# las cancelaciones de los clientes a las de al_liberar_hueco (app/lista_espera.py).
+
+_oyentes_agenda = []
+
+
+def al_cambiar_agenda(funcion):
+    """Registra funcion(cambios), con cambios = [(barbero_id, fecha)], para cada cambio de agenda"""
+    if funcion not in _oyentes_agenda:
+        _oyentes_agenda.append(funcion)
+
+
+def _avisar_cambio_agenda(cambios):
+    cambios = list(cambios)
+    if not cambios:
+        return
+    for funcion in _oyentes_agenda:
+        try:
+            funcion(cambios)
+        except Exception as e:
+            # Un aviso fallido no debe deshacer una escritura ya confirmada
+            print(f"Error avisando cambios de agenda: {e}")
+
+
+_oyentes_huecos = []
+
+
+def al_liberar_hueco(funcion):
+    """Registra funcion(barbero_id, fecha, hora_inicio, hora_fin) para cada cita que cancela un cliente"""
+    if funcion not in _oyentes_huecos:
+        _oyentes_huecos.append(funcion)
+
+
+def _avisar_hueco_liberado(barbero_id, fecha, hora_inicio, hora_fin):
+    for funcion in _oyentes_huecos:
+        try:
+            funcion(barbero_id, fecha, hora_inicio, hora_fin)
+        except Exception as e:
+            print(f"Error avisando hueco liberado: {e}")
+
+
+# --- FUNCIONES DE VERSIONES DE AGENDA ---
+
+def obtener_version_agenda(barbero_id, fecha):
+    """
+    Versión de la disponibilidad de un barbero en una fecha. Sube con cada
+    cita creada, modificada o cancelada ese día y con cada cambio de horario
+    del barbero (triggers de la migración 5). None si la migración no está.
+    """
+    if not tabla_existe('Versiones_Agenda'):
+        return None
+    return consultar_uno('version_agenda', (barbero_id, fecha, FECHA_MIN))['version']
+
+
+def purgar_versiones_agenda(hasta):
+    """Elimina las versiones de días anteriores a `hasta`. Devuelve cuántas se borraron."""
+    if not tabla_existe('Versiones_Agenda'):
+        return 0
+    return ejecutar('versiones_agenda_purgar', (hasta, FECHA_MIN))
+
+
+# --- FUNCIONES DE VERSIONES DE CATÁLOGO ---
+
+def obtener_versiones_catalogo():
+    """
+    Devuelve {barberia_id: version} de los datos públicos de cada barbería
+    (la clave 0 es la lista de barberías). Los triggers de la migración 4 suben
+    la versión en cada cambio; sin esa migración devuelve un diccionario vacío.
+    """
+    if not tabla_existe('Versiones_Catalogo'):
+        return {}
+    return {fila['barberia_id']: fila['version'] for fila in consultar_todos('versiones_catalogo')}
+
+
+# --- FUNCIONES DE ARCHIVO HISTÓRICO ---
+#
+# Las citas terminadas (Completada, Cancelada, No Show) con fecha anterior al
+# horizonte se mueven de Citas a Citas_Historico, que tiene las mismas columnas.
+# Así Citas solo guarda datos recientes y las consultas habituales no recorren
+# todo el historial; las lecturas usan la variante `_historico` de la consulta
+# (Citas UNION ALL histórico) solo cuando el rango pedido llega a antes del horizonte.
+
+TABLA_HISTORICO = queries.TABLA_HISTORICO
+ESTADOS_ARCHIVABLES = ('Completada', 'Cancelada', 'No Show')
+
+_referencias_citas = None
+
+
+def horizonte_archivo():
+    """Fecha a partir de la cual las citas siguen en la tabla Citas"""
+    return date.today() - timedelta(days=Config.ARCHIVO_HORIZONTE_DIAS)
+
+
+def historico_disponible():
+    """Indica si el archivo está habilitado y la tabla histórica existe (se cachea)"""
+    return Config.ARCHIVO_HABILITADO and tabla_existe(TABLA_HISTORICO)
+
+
+def variante_citas(nombre, desde=None):
+    """
+    Devuelve el nombre de la consulta del catálogo para leer citas desde la
+    fecha `desde`: `nombre` (solo Citas) si el rango es reciente, o
+    `nombre_historico` (con el histórico) si no; desde=None es todo el historial.
+    """
+    if desde is not None and desde >= horizonte_archivo():
+        return nombre
+    if not historico_disponible():
+        return nombre
+    return f'{nombre}_historico'
+
+
+def asegurar_tabla_historico():
+    """Crea Citas_Historico con las mismas columnas que Citas si no existe"""
+    with get_db_cursor(commit=True) as cursor:
+        cursor.execute("SELECT OBJECT_ID(?, 'U')", (TABLA_HISTORICO,))
+        if cursor.fetchone()[0] is None:
+            # El UNION ALL evita que SELECT INTO copie la propiedad IDENTITY de id
+            cursor.execute(f"""
+                SELECT TOP 0 * INTO {TABLA_HISTORICO} FROM Citas
+                UNION ALL
+                SELECT TOP 0 * FROM Citas
+            """)
+            cursor.execute(f"CREATE CLUSTERED INDEX IX_{TABLA_HISTORICO}_fecha ON {TABLA_HISTORICO} (fecha, id)")
+            cursor.execute(f"CREATE INDEX IX_{TABLA_HISTORICO}_barbero ON {TABLA_HISTORICO} (barbero_id, fecha)")
+            cursor.execute(f"CREATE INDEX IX_{TABLA_HISTORICO}_cliente ON {TABLA_HISTORICO} (cliente_id, fecha)")
+    _tablas[TABLA_HISTORICO] = (True, time.monotonic())
+
+
+def _registrar_consulta_archivo():
+    """
+    Registra en el catálogo la sentencia que archiva un lote. Se arma una vez
+    por proceso porque excluye las citas referenciadas por otras tablas
+    (pagos, reseñas...), que se descubren en sys.foreign_key_columns.
+    """
+    global _referencias_citas
+    if _referencias_citas is None:
+        _referencias_citas = [(fila['tabla'], fila['columna'])
+                              for fila in consultar_todos('referencias_a_citas')]
+    exclusiones = ''.join(
+        f" AND NOT EXISTS (SELECT 1 FROM [{tabla}] r WHERE r.[{columna}] = Citas.id)"
+        for tabla, columna in _referencias_citas
+    )
+    queries.registrar('archivar_citas_lote', f"""
+        DELETE TOP (?) FROM Citas
+        OUTPUT deleted.* INTO {TABLA_HISTORICO}
+        WHERE fecha < ?
+          AND estado_id IN (SELECT id FROM Estados_Citas WHERE nombre IN (?, ?, ?))
+          {exclusiones}
+    """, ('lote', 'limite', 'estado', 'estado', 'estado'))
+
+
+def archivar_citas_lote(limite, lote=1000):
+    """
+    Mueve al histórico un lote de citas terminadas con fecha anterior a `limite`,
+    en una sola sentencia (DELETE ... OUTPUT INTO). Las citas referenciadas por
+    otras tablas (pagos, reseñas...) se quedan en Citas para no romper sus FK.
+    Devuelve cuántas citas se movieron.
+    """
+    if _referencias_citas is None:
+        _registrar_consulta_archivo()
+    return ejecutar('archivar_citas_lote', (lote, limite) + ESTADOS_ARCHIVABLES)
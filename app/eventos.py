@@ -0,0 +1,292 @@
+import json
+import queue
+import socket
+import threading
+import time
+from abc import ABC, abstractmethod
+from config import Config
+from app.cache import CacheTTL
+
+# Publicación/suscripción de eventos en el proceso, para empujar cambios de
+# disponibilidad a las páginas de reserva abiertas (Server-Sent Events).
+#
+# Cada página se suscribe al canal de una (barbería, fecha). Las escrituras de
+# agenda de app/database.py avisan a publicar_cambios_agenda(), que publica en
+# ese canal. Con varios workers, el backend reenvía cada evento a los demás
+# procesos: BackendMemoria solo entrega dentro del proceso y BackendUDP usa un
+# broker local mínimo (python -m app.eventos) que hace de sustituto de un
+# broker real como Redis pub/sub.
+#
+# Los eventos solo avisan de que algo cambió; el cliente vuelve a pedir
+# /cliente/horarios-disponibles, que con su ETag suele responder 304.
+#
+# Con gunicorn cada stream abierto ocupa un hilo del worker durante
+# SSE_MAX_SEGUNDOS, así que hay como mucho SSE_MAX_CONEXIONES por proceso
+# (servidor.py suma esas plazas a los hilos de petición). Al resto se le
+# responde 503 y la página sondea la disponibilidad cada SSE_SONDEO_SEGUNDOS.
+# En el modo ASGI el stream lo recorre el bucle de eventos (app/asgi.py) y no
+# ocupa ningún hilo: la ruta deja (canal, latido, segundos) en environ[STREAM_ASGI].
+
+STREAM_ASGI = 'barberbook.stream_asgi'
+
+
+def canal_disponibilidad(barberia_id, fecha):
+    return f'disponibilidad:{barberia_id}:{fecha.isoformat()}'
+
+
+class Suscripcion:
+    """Cola de eventos de un canal para un cliente conectado"""
+
+    def __init__(self, canal, max_pendientes=100):
+        self.canal = canal
+        self._cola = queue.Queue(maxsize=max_pendientes)
+
+    def entregar(self, datos):
+        try:
+            self._cola.put_nowait(datos)
+        except queue.Full:
+            pass  # cliente lento: basta con que tenga eventos pendientes
+
+    def esperar(self, timeout):
+        """Devuelve el siguiente evento o None si pasa `timeout` sin eventos"""
+        try:
+            return self._cola.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+
+class _Bus:
+    """Suscripciones locales del proceso, por canal"""
+
+    def __init__(self):
+        self._canales = {}
+        self._lock = threading.Lock()
+
+    def suscribir(self, canal, tipo=Suscripcion):
+        suscripcion = tipo(canal)
+        with self._lock:
+            self._canales.setdefault(canal, set()).add(suscripcion)
+        return suscripcion
+
+    def cancelar(self, suscripcion):
+        with self._lock:
+            suscritos = self._canales.get(suscripcion.canal)
+            if suscritos is not None:
+                suscritos.discard(suscripcion)
+                if not suscritos:
+                    del self._canales[suscripcion.canal]
+
+    def entregar(self, canal, datos):
+        with self._lock:
+            suscritos = list(self._canales.get(canal, ()))
+        for suscripcion in suscritos:
+            suscripcion.entregar(datos)
+
+    def total_suscripciones(self):
+        with self._lock:
+            return sum(len(s) for s in self._canales.values())
+
+
+# --- BACKENDS ---
+
+class BackendEventos(ABC):
+    """
+    Interfaz de los backends. publicar() entrega el evento a los suscriptores
+    de este proceso y lo hace llegar a los demás workers; iniciar() arranca lo
+    necesario para recibir los eventos publicados por otros procesos.
+    """
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def iniciar(self):
+        pass
+
+    def detener(self):
+        pass
+
+    @abstractmethod
+    def publicar(self, canal, datos):
+        pass
+
+
+class BackendMemoria(BackendEventos):
+    """Solo dentro del proceso (un único worker o desarrollo)"""
+
+    def publicar(self, canal, datos):
+        self.bus.entregar(canal, datos)
+
+
+class BackendUDP(BackendEventos):
+    """
+    Comparte eventos entre workers de la misma máquina a través del broker
+    UDP de este módulo. Cada worker saluda al broker periódicamente desde su
+    socket, y el broker reenvía cada evento a todos los demás workers.
+    """
+
+    SALUDO_CADA_SEGUNDOS = 10
+
+    def __init__(self, bus, direccion_broker):
+        super().__init__(bus)
+        host, puerto = direccion_broker.rsplit(':', 1)
+        self.broker = (host, int(puerto))
+        self._socket = None
+        self._hilo = None
+        self._detener = threading.Event()
+
+    def iniciar(self):
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._socket.bind(('127.0.0.1', 0))
+        self._socket.settimeout(1.0)
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._recibir, name='barberbook-eventos', daemon=True)
+        self._hilo.start()
+
+    def detener(self):
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(2)
+        if self._socket:
+            self._socket.close()
+
+    def publicar(self, canal, datos):
+        self.bus.entregar(canal, datos)
+        self._enviar({'tipo': 'evento', 'canal': canal, 'datos': datos})
+
+    def _enviar(self, mensaje):
+        try:
+            self._socket.sendto(json.dumps(mensaje).encode('utf-8'), self.broker)
+        except OSError as e:
+            print(f"Eventos: no se pudo contactar al broker {self.broker}: {e}")
+
+    def _recibir(self):
+        ultimo_saludo = 0.0
+        while not self._detener.is_set():
+            if time.monotonic() - ultimo_saludo >= self.SALUDO_CADA_SEGUNDOS:
+                self._enviar({'tipo': 'hola'})
+                ultimo_saludo = time.monotonic()
+            try:
+                paquete, _ = self._socket.recvfrom(65536)
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            try:
+                mensaje = json.loads(paquete)
+            except ValueError:
+                continue
+            if mensaje.get('tipo') == 'evento':
+                self.bus.entregar(mensaje['canal'], mensaje['datos'])
+
+
+def ejecutar_broker(direccion, olvido_segundos=30):
+    """Broker UDP: reenvía cada evento a los workers que saludaron en los últimos `olvido_segundos`"""
+    host, puerto = direccion.rsplit(':', 1)
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((host, int(puerto)))
+    workers = {}  # dirección -> último mensaje
+    print(f"📡 Broker de eventos escuchando en {direccion}")
+    while True:
+        paquete, origen = sock.recvfrom(65536)
+        ahora = time.monotonic()
+        workers[origen] = ahora
+        try:
+            mensaje = json.loads(paquete)
+        except ValueError:
+            continue
+        if mensaje.get('tipo') != 'evento':
+            continue
+        for worker, visto in list(workers.items()):
+            if ahora - visto > olvido_segundos:
+                del workers[worker]
+            elif worker != origen:
+                sock.sendto(paquete, worker)
+
+
+# --- API DEL MÓDULO ---
+
+bus = _Bus()
+backend = BackendMemoria(bus)
+
+_barberia_de_barbero = CacheTTL(ttl=3600, nombre='barberia_de_barbero')
+
+_lock_streams = threading.Lock()
+_streams = {'abiertos': 0}
+
+
+def suscribir(canal):
+    return bus.suscribir(canal)
+
+
+def cancelar(suscripcion):
+    bus.cancelar(suscripcion)
+
+
+def publicar(canal, datos):
+    backend.publicar(canal, datos)
+
+
+def trozo_sse(datos):
+    if datos is None:
+        return ': latido\n\n'
+    return f'event: disponibilidad\ndata: {json.dumps(datos)}\n\n'
+
+
+def flujo_sse(canal, latido, segundos):
+    """Stream SSE de un canal durante `segundos`; bloquea el hilo que lo recorre"""
+    limite = time.monotonic() + segundos
+    suscripcion = bus.suscribir(canal)
+    try:
+        yield 'retry: 3000\n\n'
+        while time.monotonic() < limite:
+            yield trozo_sse(suscripcion.esperar(latido))
+    finally:
+        bus.cancelar(suscripcion)
+
+
+def ocupar_stream(maximo):
+    """Reserva una plaza para un stream SSE; False si ya hay `maximo` abiertos en este proceso"""
+    with _lock_streams:
+        if _streams['abiertos'] >= maximo:
+            return False
+        _streams['abiertos'] += 1
+        return True
+
+
+def liberar_stream():
+    with _lock_streams:
+        _streams['abiertos'] -= 1
+
+
+def publicar_cambios_agenda(cambios):
+    """Publica un evento por cada (barbero_id, fecha) cambiado en el canal de su barbería"""
+    from app.database import obtener_barberia_de_barbero
+
+    for barbero_id, fecha in cambios:
+        barberia_id = _barberia_de_barbero.obtener(barbero_id)
+        if barberia_id is None:
+            barberia_id = obtener_barberia_de_barbero(barbero_id)
+            if barberia_id is None:
+                continue
+            _barberia_de_barbero.guardar(barbero_id, barberia_id)
+        publicar(canal_disponibilidad(barberia_id, fecha),
+                 {'barbero_id': barbero_id, 'fecha': fecha.isoformat()})
+
+
+def init_app(app):
+    """Elige el backend según EVENTOS_BACKEND y se suscribe a los cambios de agenda"""
+    global backend
+    from app.database import al_cambiar_agenda
+
+    if app.config.get('EVENTOS_BACKEND') == 'udp':
+        backend = BackendUDP(bus, app.config['EVENTOS_BROKER'])
+    else:
+        backend = BackendMemoria(bus)
+    backend.iniciar()
+    al_cambiar_agenda(publicar_cambios_agenda)
+
+
+if __name__ == '__main__':
+    ejecutar_broker(Config.EVENTOS_BROKER)
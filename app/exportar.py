@@ -0,0 +1,68 @@
+import csv
+import io
+import json
+from datetime import date, timedelta
+from config import Config
+from app.database import iterar_consulta, variante_citas
+from app.queries import COLUMNAS_EXPORTACION
+
+# Exportación del historial de citas en CSV o NDJSON.
+#
+# Las filas se leen por lotes con fetchmany y cada lote se convierte en un
+# trozo de texto que Flask envía en cuanto está listo (respuesta chunked), así
+# la memoria del worker no crece con el tamaño del historial.
+
+FORMATOS = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+}
+
+
+def rango_exportacion(desde=None, hasta=None):
+    """Completa el rango pedido; por defecto los últimos EXPORTAR_RANGO_DIAS días"""
+    hasta = hasta or date.today()
+    desde = desde or hasta - timedelta(days=Config.EXPORTAR_RANGO_DIAS - 1)
+    return (desde, hasta) if desde <= hasta else (hasta, desde)
+
+
+def _valor(valor):
+    """Fechas y horas en ISO, decimales como número"""
+    if hasattr(valor, 'isoformat'):
+        return valor.isoformat()
+    if valor is not None and not isinstance(valor, (int, float, str)):
+        return float(valor)
+    return valor
+
+
+def _lotes_csv(lotes):
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer)
+    escritor.writerow(COLUMNAS_EXPORTACION)
+    yield '\ufeff' + buffer.getvalue()  # BOM para que Excel detecte UTF-8
+    for filas in lotes:
+        buffer.seek(0)
+        buffer.truncate()
+        escritor.writerows([_valor(fila[columna]) for columna in COLUMNAS_EXPORTACION]
+                           for fila in filas)
+        yield buffer.getvalue()
+
+
+def _lotes_ndjson(lotes):
+    for filas in lotes:
+        yield ''.join(json.dumps({columna: _valor(valor) for columna, valor in fila.items()},
+                                 ensure_ascii=False) + '\n'
+                      for fila in filas)
+
+
+def exportar_citas(ambito, entidad_id, desde, hasta, formato='csv'):
+    """
+    Devuelve un generador de trozos de texto con las citas de un barbero
+    (ambito='barbero') o de una barbería (ambito='barberia') en el rango.
+    """
+    nombre = variante_citas(f'exportar_citas_{ambito}', desde)
+    lotes = iterar_consulta(nombre, (entidad_id, desde, hasta), lote=Config.EXPORTAR_LOTE)
+    return _lotes_csv(lotes) if formato == 'csv' else _lotes_ndjson(lotes)
+
+
+def nombre_archivo(prefijo, desde, hasta, formato):
+    return f"{prefijo}_{desde.isoformat()}_{hasta.isoformat()}.{FORMATOS[formato][1]}"
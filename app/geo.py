@@ -0,0 +1,132 @@
+import heapq
+import math
+import threading
+
+# Índice espacial de barberías en memoria: una rejilla de celdas de
+# `celda_grados` x `celda_grados` (latitud, longitud) con los ids de cada celda.
+#
+# La búsqueda de las más cercanas recorre anillos de celdas alrededor del
+# punto y devuelve las barberías en orden de distancia, de forma perezosa:
+# el consumidor puede ir filtrando (p. ej. por disponibilidad) y dejar de
+# pedir en cuanto tiene suficientes. Sin vuelta por el antimeridiano: las
+# barberías están en un solo país.
+
+RADIO_TIERRA_KM = 6371.0
+_KM_POR_GRADO = math.pi * RADIO_TIERRA_KM / 180
+
+
+def distancia_km(lat1, lon1, lat2, lon2):
+    """Distancia haversine entre dos puntos"""
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = (math.sin(dlat / 2) ** 2
+         + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2)
+    return 2 * RADIO_TIERRA_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+class IndiceGeo:
+    """Rejilla de puntos por id. Segura entre hilos."""
+
+    def __init__(self, celda_grados=0.02):
+        self.celda = celda_grados
+        self._lock = threading.Lock()
+        self._puntos = {}  # id -> (lat, lon)
+        self._celdas = {}  # (fila, columna) -> frozenset(ids)
+        self._limites = None  # (fila_min, fila_max, col_min, col_max) de las celdas ocupadas
+
+    def _celda_de(self, lat, lon):
+        return math.floor(lat / self.celda), math.floor(lon / self.celda)
+
+    def reemplazar(self, puntos, ids=None):
+        """
+        Sustituye los puntos de `ids` por los de `puntos` ({id: (lat, lon)}); los
+        ids que no estén en `puntos` se quitan. Sin `ids`, se reemplaza todo.
+
+        Copia al escribir: las búsquedas en curso siguen sobre los diccionarios
+        anteriores, que nunca se modifican, así que leer no necesita el lock.
+        """
+        with self._lock:
+            if ids is None:
+                nuevos_puntos, celdas = {}, {}
+                ids = ()
+            else:
+                nuevos_puntos, celdas = dict(self._puntos), dict(self._celdas)
+            for id_ in set(ids) | set(puntos):
+                anterior = nuevos_puntos.pop(id_, None)
+                if anterior is not None:
+                    celda = self._celda_de(*anterior)
+                    celdas[celda] = celdas[celda] - {id_}
+                    if not celdas[celda]:
+                        del celdas[celda]
+            for id_, (lat, lon) in puntos.items():
+                nuevos_puntos[id_] = (lat, lon)
+                celda = self._celda_de(lat, lon)
+                celdas[celda] = celdas.get(celda, frozenset()) | {id_}
+            limites = None
+            if celdas:
+                filas = [f for f, _ in celdas]
+                columnas = [c for _, c in celdas]
+                limites = (min(filas), max(filas), min(columnas), max(columnas))
+            self._puntos, self._celdas, self._limites = nuevos_puntos, celdas, limites
+
+    def _anillo(self, fila, columna, r, limites):
+        """Celdas a distancia de Chebyshev exactamente r de (fila, columna), dentro de `limites`"""
+        fila_min, fila_max, col_min, col_max = limites
+        if r == 0:
+            yield fila, columna
+            return
+        desde, hasta = max(columna - r, col_min), min(columna + r, col_max)
+        for f in (fila - r, fila + r):
+            if fila_min <= f <= fila_max:
+                for c in range(desde, hasta + 1):
+                    yield f, c
+        desde, hasta = max(fila - r + 1, fila_min), min(fila + r - 1, fila_max)
+        for c in (columna - r, columna + r):
+            if col_min <= c <= col_max:
+                for f in range(desde, hasta + 1):
+                    yield f, c
+
+    def _lado_km(self, lat):
+        """Lado más corto de una celda a esa latitud (el ancho se encoge con el coseno)"""
+        return self.celda * _KM_POR_GRADO * max(0.01, math.cos(math.radians(min(89.0, abs(lat)))))
+
+    def cercanos(self, lat, lon, radio_km=None):
+        """
+        Genera (distancia_km, id) en orden creciente de distancia, hasta
+        `radio_km` si se indica. Tras recorrer el anillo r, ningún punto de
+        anillos posteriores puede estar a menos de r celdas del punto pedido,
+        así que los candidatos ya vistos por debajo de esa cota se entregan.
+        """
+        with self._lock:
+            celdas, puntos, limites = self._celdas, self._puntos, self._limites
+        if limites is None:
+            return
+        fila, columna = self._celda_de(lat, lon)
+        # Fuera de los límites no hay puntos: se empieza en el primer anillo que los toca
+        r_min = max(0, limites[0] - fila, fila - limites[1], limites[2] - columna, columna - limites[3])
+        r_max = max(abs(fila - limites[0]), abs(fila - limites[1]),
+                    abs(columna - limites[2]), abs(columna - limites[3]))
+        if radio_km is not None:
+            lado_minimo = self._lado_km(abs(lat) + radio_km / _KM_POR_GRADO)
+            r_max = min(r_max, int(radio_km / lado_minimo) + 1)
+
+        pendientes = []  # heap de (distancia, id)
+        for r in range(r_min, r_max + 1):
+            for celda in self._anillo(fila, columna, r, limites):
+                for id_ in celdas.get(celda, ()):
+                    distancia = distancia_km(lat, lon, *puntos[id_])
+                    if radio_km is None or distancia <= radio_km:
+                        heapq.heappush(pendientes, (distancia, id_))
+            # Cota conservadora: el lado de celda más estrecho hasta el anillo siguiente
+            cota = r * self._lado_km(abs(lat) + (r + 1) * self.celda)
+            while pendientes and pendientes[0][0] <= cota:
+                yield heapq.heappop(pendientes)
+        while pendientes:
+            yield heapq.heappop(pendientes)
+
+    def en_radio(self, lat, lon, radio_km):
+        """Lista de (distancia_km, id) dentro del radio, ordenada"""
+        return list(self.cercanos(lat, lon, radio_km))
+
+    def __len__(self):
+        return len(self._puntos)
@@ -0,0 +1,114 @@
+from datetime import date, datetime, timedelta
+from config import Config
+from app import calendario, lista_espera, notificaciones, reservas, series
+from app.database import (marcar_citas_vencidas, asegurar_tabla_historico,
+                          archivar_citas_lote, horizonte_archivo, purgar_versiones_agenda,
+                          reconciliar_calificaciones_lote, resenas_disponible)
+
+# Tareas periódicas que ejecuta el planificador (ver app/scheduler.py).
+# Cada tarea devuelve el número de filas que procesó.
+
+
+def barrer_citas_vencidas():
+    """
+    Marca como 'No Show' las citas Pendientes/Confirmadas cuya hora ya pasó.
+    Trabaja por lotes (una transacción por lote) para no bloquear Citas.
+    """
+    limite = datetime.now() - timedelta(minutes=Config.NO_SHOW_MARGEN_MINUTOS)
+    total = 0
+    while True:
+        actualizadas = marcar_citas_vencidas(limite, lote=Config.NO_SHOW_LOTE)
+        total += actualizadas
+        if actualizadas < Config.NO_SHOW_LOTE:
+            return total
+
+
+def archivar_citas_historicas():
+    """
+    Mueve al histórico las citas terminadas más antiguas que el horizonte,
+    un lote por transacción.
+    """
+    asegurar_tabla_historico()
+    limite = horizonte_archivo()
+    total = 0
+    while True:
+        movidas = archivar_citas_lote(limite, lote=Config.ARCHIVO_LOTE)
+        total += movidas
+        if movidas < Config.ARCHIVO_LOTE:
+            return total
+
+
+def purgar_versiones_pasadas():
+    """Borra las versiones de agenda de días que ya pasaron"""
+    return purgar_versiones_agenda(date.today())
+
+
+def mantener_calendario():
+    """Aplica cambios de horario y excepciones al calendario materializado y alarga su horizonte"""
+    return calendario.mantener()
+
+
+def purgar_reservas_vencidas():
+    """Borra las retenciones de huecos que vencieron sin convertirse en cita"""
+    return reservas.purgar_vencidas()
+
+
+def materializar_series():
+    """Crea las citas de las series recurrentes que entran en el horizonte"""
+    return series.materializar()
+
+
+def mantener_lista_espera():
+    """Reofrece los huecos de las ofertas de la lista de espera que vencieron"""
+    return lista_espera.mantener()
+
+
+def despachar_notificaciones():
+    """Envía las notificaciones pendientes de la bandeja de salida"""
+    return notificaciones.despachar()
+
+
+def purgar_notificaciones_enviadas():
+    """Borra las notificaciones ya cerradas más antiguas que la retención"""
+    return notificaciones.purgar()
+
+
+def reconciliar_calificaciones():
+    """
+    Recalcula, por lotes de barberos, la suma y el número de calificaciones
+    de sus reseñas y corrige los acumulados que se hayan desviado.
+    """
+    if not resenas_disponible():
+        return 0
+    total, ultimo = 0, 0
+    while True:
+        resultado = reconciliar_calificaciones_lote(ultimo, Config.RESENAS_LOTE)
+        if resultado['ultimo'] is None:
+            return total
+        total += resultado['corregidos']
+        ultimo = resultado['ultimo']
+
+
+def registrar_tareas(programador):
+    """Registra todas las tareas periódicas de la aplicación"""
+    programador.registrar('barrer_citas_vencidas', barrer_citas_vencidas,
+                          cada_segundos=Config.NO_SHOW_CADA_SEGUNDOS)
+    if Config.ARCHIVO_HABILITADO:
+        programador.registrar('archivar_citas_historicas', archivar_citas_historicas,
+                              cada_segundos=Config.ARCHIVO_CADA_SEGUNDOS)
+    programador.registrar('purgar_versiones_pasadas', purgar_versiones_pasadas,
+                          cada_segundos=Config.VERSIONES_PURGA_CADA_SEGUNDOS)
+    programador.registrar('mantener_calendario', mantener_calendario,
+                          cada_segundos=Config.CALENDARIO_CADA_SEGUNDOS)
+    programador.registrar('purgar_reservas_vencidas', purgar_reservas_vencidas,
+                          cada_segundos=Config.RESERVAS_PURGA_CADA_SEGUNDOS)
+    programador.registrar('materializar_series', materializar_series,
+                          cada_segundos=Config.SERIES_CADA_SEGUNDOS)
+    programador.registrar('mantener_lista_espera', mantener_lista_espera,
+                          cada_segundos=Config.LISTA_ESPERA_CADA_SEGUNDOS)
+    programador.registrar('despachar_notificaciones', despachar_notificaciones,
+                          cada_segundos=Config.NOTIFICACIONES_CADA_SEGUNDOS)
+    programador.registrar('purgar_notificaciones_enviadas', purgar_notificaciones_enviadas,
+                          cada_segundos=Config.NOTIFICACIONES_PURGA_CADA_SEGUNDOS)
+    programador.registrar('reconciliar_calificaciones', reconciliar_calificaciones,
+                          cada_segundos=Config.RESENAS_RECONCILIAR_CADA_SEGUNDOS)
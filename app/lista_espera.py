@@ -0,0 +1,138 @@
+import queue
+import threading
+from datetime import date, datetime, timedelta
+from config import Config
+from app import reservas
+from app.database import (al_liberar_hueco, cerrar_espera, crear_espera, lista_espera_disponible,
+                          obtener_barberia_de_barbero, obtener_candidatos_espera, obtener_espera_cliente,
+                          obtener_ofertas_vencidas, ofrecer_espera, purgar_lista_espera, reactivar_espera)
+
+# Lista de espera: clientes que quieren un hueco en una barbería (con un
+# barbero concreto o cualquiera) para un servicio entre dos fechas.
+#
+# Cuando un cliente cancela una cita, el hueco se encola y un hilo del
+# proceso lo ofrece fuera de la petición: busca los candidatos de esa
+# barbería y fecha (una búsqueda en la clave de Lista_Espera_Dias, en orden
+# de llegada) y retiene el hueco a nombre del primero cuyo servicio cabe,
+# durante LISTA_ESPERA_OFERTA_SEGUNDOS. La oferta es una retención aparte
+# (reservas.retener con oferta=True): no suelta la del cliente ni la suelta
+# él al reservar otra hora, y se salta a quien está a mitad de una reserva.
+# Si sobra hueco se ofrece el resto al siguiente. El cliente acepta desde su panel; si la oferta vence, la tarea
+# mantener() le devuelve a la cola y ofrece el hueco al siguiente.
+
+_cola = queue.Queue()
+_hilo = None
+_hilo_lock = threading.Lock()
+
+
+def _sumar_minutos(fecha, hora, minutos):
+    return (datetime.combine(fecha, hora) + timedelta(minutes=minutos)).time()
+
+
+def apuntar(cliente_id, barberia_id, barbero_id, servicio_id, fecha_desde, dias=None):
+    """Apunta al cliente desde `fecha_desde` durante `dias` días (LISTA_ESPERA_DIAS). Devuelve el id."""
+    dias = min(dias or Config.LISTA_ESPERA_DIAS, Config.LISTA_ESPERA_DIAS_MAX)
+    return crear_espera(cliente_id, barberia_id, barbero_id, servicio_id, fecha_desde,
+                        fecha_desde + timedelta(days=dias - 1))
+
+
+def ofrecer(barbero_id, fecha, hora_inicio, hora_fin, excluir=()):
+    """
+    Ofrece el hueco [hora_inicio, hora_fin) a los candidatos, en orden, hasta
+    agotarlo. Devuelve los ids de las entradas a las que se ofreció.
+    """
+    if datetime.combine(fecha, hora_inicio) <= datetime.now():
+        return []
+    barberia_id = obtener_barberia_de_barbero(barbero_id)
+    excluir, ofrecidas = set(excluir), []
+    while hora_inicio < hora_fin:
+        duracion = int((datetime.combine(fecha, hora_fin) - datetime.combine(fecha, hora_inicio)).total_seconds() // 60)
+        candidatos = obtener_candidatos_espera(barberia_id, barbero_id, fecha, duracion, excluir,
+                                               Config.LISTA_ESPERA_CANDIDATOS)
+        if not candidatos:
+            break
+        for candidato in candidatos:
+            excluir.add(candidato['id'])
+            if reservas.reteniendo(candidato['cliente_id']):
+                continue  # está reservando otra hora; el hueco pasa al siguiente
+            fin = _sumar_minutos(fecha, hora_inicio, candidato['duracion_minutos'])
+            token = reservas.retener(candidato['cliente_id'], barbero_id, fecha, hora_inicio, fin,
+                                     ttl=Config.LISTA_ESPERA_OFERTA_SEGUNDOS, oferta=True)
+            if token is None:
+                return ofrecidas  # alguien lo reservó antes
+            if ofrecer_espera(candidato['id'], barbero_id, fecha, hora_inicio, fin, token,
+                              Config.LISTA_ESPERA_OFERTA_SEGUNDOS):
+                ofrecidas.append(candidato['id'])
+                hora_inicio = fin
+                break
+            # La entrada se cerró mientras tanto: el hueco sigue siendo para el siguiente
+            reservas.soltar(token, candidato['cliente_id'])
+    return ofrecidas
+
+
+def aceptar(espera_id, cliente_id):
+    """Reserva el hueco ofrecido al cliente. Devuelve el id de la cita o None si no hay oferta."""
+    espera = obtener_espera_cliente(espera_id, cliente_id)
+    if not espera or espera['estado'] != 'ofrecida':
+        return None
+    # La entrada se da por atendida en la misma transacción que crea la cita
+    return reservas.confirmar(espera['oferta_token'], cliente_id=cliente_id,
+                              barbero_id=espera['oferta_barbero_id'], servicio_id=espera['servicio_id'],
+                              fecha=espera['oferta_fecha'], hora_inicio=espera['oferta_hora_inicio'],
+                              hora_fin=espera['oferta_hora_fin'], precio_final=espera['precio'],
+                              espera=(espera_id, espera['oferta_token']))
+
+
+def retirar(espera_id, cliente_id):
+    """Saca al cliente de la lista; si tenía un hueco ofrecido, pasa al siguiente. Devuelve si estaba."""
+    anterior = cerrar_espera(espera_id, cliente_id, 'cancelada')
+    if anterior is None:
+        return False
+    if anterior['estado'] == 'ofrecida':
+        reservas.soltar(anterior['oferta_token'], cliente_id)
+        _encolar(anterior['oferta_barbero_id'], anterior['oferta_fecha'], anterior['oferta_hora_inicio'],
+                 anterior['oferta_hora_fin'], {espera_id})
+    return True
+
+
+def mantener():
+    """Tarea periódica: reofrece los huecos de las ofertas vencidas y purga lo pasado"""
+    if not lista_espera_disponible():
+        return 0
+    total = 0
+    for oferta in obtener_ofertas_vencidas():
+        if reactivar_espera(oferta['id']):
+            ofrecer(oferta['oferta_barbero_id'], oferta['oferta_fecha'], oferta['oferta_hora_inicio'],
+                    oferta['oferta_hora_fin'], excluir={oferta['id']})
+            total += 1
+    return total + purgar_lista_espera(date.today())
+
+
+# --- TRABAJO EN SEGUNDO PLANO ---
+
+def _encolar(barbero_id, fecha, hora_inicio, hora_fin, excluir=frozenset()):
+    global _hilo
+    _cola.put((barbero_id, fecha, hora_inicio, hora_fin, excluir))
+    with _hilo_lock:
+        if _hilo is None or not _hilo.is_alive():
+            _hilo = threading.Thread(target=_trabajar, name='barberbook-lista-espera', daemon=True)
+            _hilo.start()
+
+
+def _trabajar():
+    while True:
+        hueco = _cola.get()
+        try:
+            ofrecer(*hueco)
+        except Exception as e:
+            print(f"Lista de espera: no se pudo ofrecer el hueco {hueco[:4]}: {e}")
+
+
+def hueco_liberado(barbero_id, fecha, hora_inicio, hora_fin):
+    """Oyente de al_liberar_hueco: encola el hueco sin hacer esperar a la petición"""
+    if lista_espera_disponible():
+        _encolar(barbero_id, fecha, hora_inicio, hora_fin)
+
+
+def init_app(app):
+    al_liberar_hueco(hueco_liberado)
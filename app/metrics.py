@@ -0,0 +1,443 @@
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from config import Config
+from app.cache import caches_registradas
+
+# Métricas operativas en memoria del proceso. Todo se actualiza con
+# operaciones O(1) bajo un único lock para no penalizar cada petición.
+
+# Límites de los buckets del histograma de latencia (en segundos)
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_inicio_proceso = time.time()
+
+
+class _Histograma:
+    """Histograma acumulativo al estilo Prometheus"""
+
+    def __init__(self, buckets=BUCKETS_LATENCIA):
+        self.buckets = buckets
+        self.conteos = [0] * (len(buckets) + 1)  # el último es +Inf
+        self.suma = 0.0
+        self.total = 0
+
+    def observar(self, valor):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.conteos[i] += 1
+                break
+        else:
+            self.conteos[-1] += 1
+        self.suma += valor
+        self.total += 1
+
+    def acumulados(self):
+        """Devuelve [(limite, conteo_acumulado)] incluyendo '+Inf'"""
+        resultado = []
+        acumulado = 0
+        for limite, conteo in zip(self.buckets + ('+Inf',), self.conteos):
+            acumulado += conteo
+            resultado.append((limite, acumulado))
+        return resultado
+
+    def percentil(self, p):
+        """Aproxima el percentil p (0-100) con el límite superior del bucket"""
+        if not self.total:
+            return 0
+        objetivo = self.total * p / 100
+        for limite, acumulado in self.acumulados():
+            if acumulado >= objetivo:
+                return limite if limite != '+Inf' else self.buckets[-1]
+        return self.buckets[-1]
+
+
+class _VentanaTasa:
+    """Contador por segundo de los últimos N segundos, para calcular la tasa reciente"""
+
+    def __init__(self, segundos=60):
+        self.segundos = segundos
+        self.slots = [(0, 0)] * segundos  # (segundo, conteo)
+
+    def sumar(self, ahora):
+        segundo = int(ahora)
+        i = segundo % self.segundos
+        marca, conteo = self.slots[i]
+        self.slots[i] = (segundo, conteo + 1 if marca == segundo else 1)
+
+    def tasa(self, ahora):
+        limite = int(ahora) - self.segundos
+        total = sum(conteo for marca, conteo in self.slots if marca > limite)
+        return total / self.segundos
+
+
+# --- ESTADO ---
+
+_peticiones = {}          # (endpoint, metodo, codigo) -> conteo
+_latencias = {}           # endpoint -> _Histograma
+_errores = {}             # endpoint -> conteo de respuestas 5xx / excepciones
+_ventana_peticiones = _VentanaTasa()
+
+_consultas = {'total': 0, 'errores': 0, 'segundos': 0.0}
+_latencia_consultas = _Histograma()
+_consultas_lentas = deque(maxlen=50)
+_por_consulta = {}        # nombre en el catálogo -> llamadas, errores, segundos, máximo
+_conexiones = {'en_uso': 0, 'pico': 0, 'abiertas_total': 0, 'errores': 0,
+               'creadas': 0, 'descartadas': 0}
+_tareas = {}              # nombre -> ejecuciones, errores, filas, duración
+_paralelo = {'lotes': 0, 'llamadas': 0, 'cancelados': 0}  # en_paralelo() de app/database.py
+_notificaciones = {}      # canal -> lotes, enviadas, reintentos, fallidas, descartadas, segundos
+
+
+# --- REGISTRO DE EVENTOS ---
+
+def registrar_peticion(endpoint, metodo, codigo, duracion):
+    """Registra una petición HTTP terminada"""
+    ahora = time.time()
+    with _lock:
+        clave = (endpoint, metodo, codigo)
+        _peticiones[clave] = _peticiones.get(clave, 0) + 1
+        histograma = _latencias.get(endpoint)
+        if histograma is None:
+            histograma = _latencias[endpoint] = _Histograma()
+        histograma.observar(duracion)
+        if codigo >= 500:
+            _errores[endpoint] = _errores.get(endpoint, 0) + 1
+        _ventana_peticiones.sumar(ahora)
+
+
+def registrar_consulta(sql, duracion, error=False, nombre=None):
+    """Registra la ejecución de una sentencia SQL (`nombre` es su nombre en el catálogo)"""
+    nombre = nombre or 'sin_catalogo'
+    with _lock:
+        _consultas['total'] += 1
+        _consultas['segundos'] += duracion
+        if error:
+            _consultas['errores'] += 1
+        _latencia_consultas.observar(duracion)
+        consulta = _por_consulta.get(nombre)
+        if consulta is None:
+            consulta = _por_consulta[nombre] = {'llamadas': 0, 'errores': 0,
+                                                'segundos': 0.0, 'maximo': 0.0}
+        consulta['llamadas'] += 1
+        consulta['errores'] += 1 if error else 0
+        consulta['segundos'] += duracion
+        consulta['maximo'] = max(consulta['maximo'], duracion)
+        if duracion * 1000 >= Config.SLOW_QUERY_MS:
+            _consultas_lentas.append({
+                'consulta': nombre,
+                'sql': ' '.join(sql.split())[:500],
+                'ms': round(duracion * 1000, 1),
+                'momento': time.time()
+            })
+
+
+def registrar_tarea(nombre, duracion, filas, error=False):
+    """Registra la ejecución de una tarea en segundo plano"""
+    with _lock:
+        tarea = _tareas.get(nombre)
+        if tarea is None:
+            tarea = _tareas[nombre] = {'ejecuciones': 0, 'errores': 0, 'filas': 0,
+                                       'segundos': 0.0, 'ultima_duracion': 0.0,
+                                       'ultimas_filas': 0, 'ultima_ejecucion': None}
+        tarea['ejecuciones'] += 1
+        tarea['errores'] += 1 if error else 0
+        tarea['filas'] += filas
+        tarea['segundos'] += duracion
+        tarea['ultima_duracion'] = duracion
+        tarea['ultimas_filas'] = filas
+        tarea['ultima_ejecucion'] = time.time()
+
+
+def registrar_envio(canal, duracion, enviadas=0, reintentos=0, fallidas=0, descartadas=0):
+    """Registra un lote de notificaciones entregado a un canal (app/notificaciones.py)"""
+    with _lock:
+        datos = _notificaciones.get(canal)
+        if datos is None:
+            datos = _notificaciones[canal] = {'lotes': 0, 'enviadas': 0, 'reintentos': 0, 'fallidas': 0,
+                                              'descartadas': 0, 'segundos': 0.0}
+        datos['lotes'] += 1
+        datos['enviadas'] += enviadas
+        datos['reintentos'] += reintentos
+        datos['fallidas'] += fallidas
+        datos['descartadas'] += descartadas
+        datos['segundos'] += duracion
+
+
+def conexion_creada():
+    with _lock:
+        _conexiones['creadas'] += 1
+
+
+def conexion_descartada():
+    with _lock:
+        _conexiones['descartadas'] += 1
+
+
+def conexion_abierta():
+    """Una conexión del pool pasa a estar en uso"""
+    with _lock:
+        _conexiones['en_uso'] += 1
+        _conexiones['abiertas_total'] += 1
+        _conexiones['pico'] = max(_conexiones['pico'], _conexiones['en_uso'])
+
+
+def conexion_cerrada():
+    with _lock:
+        _conexiones['en_uso'] -= 1
+
+
+def error_conexion():
+    with _lock:
+        _conexiones['errores'] += 1
+
+
+def lote_paralelo(llamadas, cancelado=False):
+    with _lock:
+        _paralelo['lotes'] += 1
+        _paralelo['llamadas'] += llamadas
+        _paralelo['cancelados'] += int(cancelado)
+
+
+_captura = threading.local()
+
+
+@contextmanager
+def capturar_sentencias():
+    """
+    Mientras está activo, guarda (nombre, sql, parámetros) de cada execute()
+    del hilo actual en la lista que devuelve. Lo usa el analizador de índices.
+    """
+    _captura.sentencias = []
+    try:
+        yield _captura.sentencias
+    finally:
+        _captura.sentencias = None
+
+
+class CursorInstrumentado:
+    """Envuelve un cursor de pyodbc y mide cada execute() bajo el nombre de su consulta"""
+
+    def __init__(self, cursor, nombre=None):
+        self._cursor = cursor
+        self._nombre = nombre
+
+    def execute(self, sql, *params):
+        sentencias = getattr(_captura, 'sentencias', None)
+        if sentencias is not None:
+            valores = params[0] if len(params) == 1 and isinstance(params[0], (list, tuple)) else params
+            sentencias.append((self._nombre, sql, tuple(valores)))
+        inicio = time.perf_counter()
+        try:
+            resultado = self._cursor.execute(sql, *params)
+        except Exception:
+            registrar_consulta(sql, time.perf_counter() - inicio, error=True, nombre=self._nombre)
+            raise
+        registrar_consulta(sql, time.perf_counter() - inicio, nombre=self._nombre)
+        return resultado
+
+    def executemany(self, sql, filas):
+        inicio = time.perf_counter()
+        try:
+            resultado = self._cursor.executemany(sql, filas)
+        except Exception:
+            registrar_consulta(sql, time.perf_counter() - inicio, error=True, nombre=self._nombre)
+            raise
+        registrar_consulta(sql, time.perf_counter() - inicio, nombre=self._nombre)
+        return resultado
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, nombre):
+        return getattr(self._cursor, nombre)
+
+
+# --- INTEGRACIÓN CON FLASK ---
+
+def init_app(app):
+    """Registra los hooks before/after request que miden cada petición"""
+    from flask import g, request
+
+    @app.before_request
+    def _iniciar_cronometro():
+        g._inicio_peticion = time.perf_counter()
+
+    @app.after_request
+    def _registrar_peticion(response):
+        inicio = g.pop('_inicio_peticion', None)
+        if inicio is not None:
+            registrar_peticion(request.endpoint or 'sin_ruta', request.method,
+                               response.status_code, time.perf_counter() - inicio)
+        return response
+
+
+# --- LECTURA ---
+
+def obtener_resumen():
+    """Devuelve una foto de todas las métricas, para el dashboard de admin"""
+    ahora = time.time()
+    with _lock:
+        endpoints = []
+        for endpoint, histograma in _latencias.items():
+            endpoints.append({
+                'endpoint': endpoint,
+                'peticiones': histograma.total,
+                'errores': _errores.get(endpoint, 0),
+                'latencia_promedio_ms': histograma.suma * 1000 / histograma.total if histograma.total else 0,
+                'p50_ms': histograma.percentil(50) * 1000,
+                'p95_ms': histograma.percentil(95) * 1000,
+                'p99_ms': histograma.percentil(99) * 1000
+            })
+        resumen = {
+            'uptime_segundos': ahora - _inicio_proceso,
+            'peticiones_por_segundo': _ventana_peticiones.tasa(ahora),
+            'peticiones_total': sum(_peticiones.values()),
+            'errores_total': sum(_errores.values()),
+            'endpoints': sorted(endpoints, key=lambda e: e['peticiones'], reverse=True),
+            'consultas': dict(_consultas,
+                              p95_ms=_latencia_consultas.percentil(95) * 1000),
+            'consultas_por_nombre': sorted(
+                ({'consulta': nombre, **datos,
+                  'promedio_ms': datos['segundos'] * 1000 / datos['llamadas']}
+                 for nombre, datos in _por_consulta.items()),
+                key=lambda c: c['segundos'], reverse=True),
+            'conexiones': dict(_conexiones),
+            'paralelo': dict(_paralelo),
+            'consultas_lentas': list(reversed(_consultas_lentas)),
+            'tareas': {nombre: dict(datos) for nombre, datos in _tareas.items()},
+            'notificaciones': {canal: dict(datos) for canal, datos in _notificaciones.items()}
+        }
+    resumen['caches'] = {nombre: cache.estadisticas() for nombre, cache in caches_registradas().items()}
+    return resumen
+
+
+def _etiquetas(**valores):
+    partes = []
+    for clave, valor in valores.items():
+        texto = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{clave}="{texto}"')
+    return '{' + ','.join(partes) + '}'
+
+
+def _escribir_histograma(lineas, nombre, histograma, **etiquetas):
+    for limite, acumulado in histograma.acumulados():
+        lineas.append(f'{nombre}_bucket{_etiquetas(**etiquetas, le=limite)} {acumulado}')
+    sufijo = _etiquetas(**etiquetas) if etiquetas else ''
+    lineas.append(f'{nombre}_sum{sufijo} {histograma.suma}')
+    lineas.append(f'{nombre}_count{sufijo} {histograma.total}')
+
+
+def exportar_prometheus():
+    """Devuelve las métricas en el formato de texto de Prometheus"""
+    lineas = []
+    with _lock:
+        lineas.append('# HELP barberbook_http_requests_total Peticiones HTTP atendidas')
+        lineas.append('# TYPE barberbook_http_requests_total counter')
+        for (endpoint, metodo, codigo), conteo in sorted(_peticiones.items()):
+            lineas.append('barberbook_http_requests_total'
+                          f'{_etiquetas(endpoint=endpoint, method=metodo, status=codigo)} {conteo}')
+
+        lineas.append('# HELP barberbook_http_request_duration_seconds Latencia de las peticiones HTTP')
+        lineas.append('# TYPE barberbook_http_request_duration_seconds histogram')
+        for endpoint, histograma in sorted(_latencias.items()):
+            _escribir_histograma(lineas, 'barberbook_http_request_duration_seconds',
+                                 histograma, endpoint=endpoint)
+
+        lineas.append('# HELP barberbook_http_errors_total Respuestas 5xx por endpoint')
+        lineas.append('# TYPE barberbook_http_errors_total counter')
+        for endpoint, conteo in sorted(_errores.items()):
+            lineas.append(f'barberbook_http_errors_total{_etiquetas(endpoint=endpoint)} {conteo}')
+
+        lineas.append('# HELP barberbook_db_queries_total Sentencias SQL ejecutadas')
+        lineas.append('# TYPE barberbook_db_queries_total counter')
+        lineas.append(f'barberbook_db_queries_total {_consultas["total"]}')
+        lineas.append('# HELP barberbook_db_query_errors_total Sentencias SQL fallidas')
+        lineas.append('# TYPE barberbook_db_query_errors_total counter')
+        lineas.append(f'barberbook_db_query_errors_total {_consultas["errores"]}')
+        lineas.append('# HELP barberbook_db_query_duration_seconds Latencia de las sentencias SQL')
+        lineas.append('# TYPE barberbook_db_query_duration_seconds histogram')
+        _escribir_histograma(lineas, 'barberbook_db_query_duration_seconds', _latencia_consultas)
+        lineas.append('# HELP barberbook_db_statement_calls_total Ejecuciones por consulta del catálogo')
+        lineas.append('# TYPE barberbook_db_statement_calls_total counter')
+        for nombre, datos in sorted(_por_consulta.items()):
+            lineas.append(f'barberbook_db_statement_calls_total{_etiquetas(query=nombre)} {datos["llamadas"]}')
+        lineas.append('# HELP barberbook_db_statement_errors_total Ejecuciones fallidas por consulta del catálogo')
+        lineas.append('# TYPE barberbook_db_statement_errors_total counter')
+        for nombre, datos in sorted(_por_consulta.items()):
+            lineas.append(f'barberbook_db_statement_errors_total{_etiquetas(query=nombre)} {datos["errores"]}')
+        lineas.append('# HELP barberbook_db_statement_seconds_total Tiempo acumulado por consulta del catálogo')
+        lineas.append('# TYPE barberbook_db_statement_seconds_total counter')
+        for nombre, datos in sorted(_por_consulta.items()):
+            lineas.append(f'barberbook_db_statement_seconds_total{_etiquetas(query=nombre)} {datos["segundos"]}')
+
+        lineas.append('# HELP barberbook_db_connections_in_use Conexiones a la base de datos en uso')
+        lineas.append('# TYPE barberbook_db_connections_in_use gauge')
+        lineas.append(f'barberbook_db_connections_in_use {_conexiones["en_uso"]}')
+        lineas.append('# HELP barberbook_db_connections_peak Máximo de conexiones simultáneas')
+        lineas.append('# TYPE barberbook_db_connections_peak gauge')
+        lineas.append(f'barberbook_db_connections_peak {_conexiones["pico"]}')
+        lineas.append('# HELP barberbook_db_connections_created_total Conexiones físicas abiertas por el pool')
+        lineas.append('# TYPE barberbook_db_connections_created_total counter')
+        lineas.append(f'barberbook_db_connections_created_total {_conexiones["creadas"]}')
+        lineas.append('# HELP barberbook_db_connections_discarded_total Conexiones cerradas o descartadas por error')
+        lineas.append('# TYPE barberbook_db_connections_discarded_total counter')
+        lineas.append(f'barberbook_db_connections_discarded_total {_conexiones["descartadas"]}')
+        lineas.append('# HELP barberbook_db_connection_errors_total Errores al conectar')
+        lineas.append('# TYPE barberbook_db_connection_errors_total counter')
+        lineas.append(f'barberbook_db_connection_errors_total {_conexiones["errores"]}')
+        lineas.append('# HELP barberbook_db_parallel_batches_total Lotes de consultas ejecutados en paralelo')
+        lineas.append('# TYPE barberbook_db_parallel_batches_total counter')
+        lineas.append(f'barberbook_db_parallel_batches_total {_paralelo["lotes"]}')
+        lineas.append('# HELP barberbook_db_parallel_cancelled_total Lotes cancelados por plazo vencido o error')
+        lineas.append('# TYPE barberbook_db_parallel_cancelled_total counter')
+        lineas.append(f'barberbook_db_parallel_cancelled_total {_paralelo["cancelados"]}')
+
+        lineas.append('# HELP barberbook_job_runs_total Ejecuciones de tareas en segundo plano')
+        lineas.append('# TYPE barberbook_job_runs_total counter')
+        for nombre, tarea in sorted(_tareas.items()):
+            lineas.append(f'barberbook_job_runs_total{_etiquetas(job=nombre)} {tarea["ejecuciones"]}')
+        lineas.append('# HELP barberbook_job_errors_total Ejecuciones fallidas de tareas')
+        lineas.append('# TYPE barberbook_job_errors_total counter')
+        for nombre, tarea in sorted(_tareas.items()):
+            lineas.append(f'barberbook_job_errors_total{_etiquetas(job=nombre)} {tarea["errores"]}')
+        lineas.append('# HELP barberbook_job_rows_total Filas procesadas por las tareas')
+        lineas.append('# TYPE barberbook_job_rows_total counter')
+        for nombre, tarea in sorted(_tareas.items()):
+            lineas.append(f'barberbook_job_rows_total{_etiquetas(job=nombre)} {tarea["filas"]}')
+        lineas.append('# HELP barberbook_job_duration_seconds_total Tiempo acumulado de las tareas')
+        lineas.append('# TYPE barberbook_job_duration_seconds_total counter')
+        for nombre, tarea in sorted(_tareas.items()):
+            lineas.append(f'barberbook_job_duration_seconds_total{_etiquetas(job=nombre)} {tarea["segundos"]}')
+
+        lineas.append('# HELP barberbook_notifications_total Notificaciones procesadas por canal y resultado')
+        lineas.append('# TYPE barberbook_notifications_total counter')
+        for canal, datos in sorted(_notificaciones.items()):
+            for resultado in ('enviadas', 'reintentos', 'fallidas', 'descartadas'):
+                lineas.append('barberbook_notifications_total'
+                              f'{_etiquetas(channel=canal, result=resultado)} {datos[resultado]}')
+        lineas.append('# HELP barberbook_notification_batches_total Lotes entregados a cada canal')
+        lineas.append('# TYPE barberbook_notification_batches_total counter')
+        for canal, datos in sorted(_notificaciones.items()):
+            lineas.append(f'barberbook_notification_batches_total{_etiquetas(channel=canal)} {datos["lotes"]}')
+        lineas.append('# HELP barberbook_notification_seconds_total Tiempo acumulado de entrega por canal')
+        lineas.append('# TYPE barberbook_notification_seconds_total counter')
+        for canal, datos in sorted(_notificaciones.items()):
+            lineas.append(f'barberbook_notification_seconds_total{_etiquetas(channel=canal)} {datos["segundos"]}')
+
+    lineas.append('# HELP barberbook_cache_hits_total Aciertos de cache')
+    lineas.append('# TYPE barberbook_cache_hits_total counter')
+    caches = {nombre: cache.estadisticas() for nombre, cache in caches_registradas().items()}
+    for nombre, stats in sorted(caches.items()):
+        lineas.append(f'barberbook_cache_hits_total{_etiquetas(cache=nombre)} {stats["hits"]}')
+    lineas.append('# HELP barberbook_cache_misses_total Fallos de cache')
+    lineas.append('# TYPE barberbook_cache_misses_total counter')
+    for nombre, stats in sorted(caches.items()):
+        lineas.append(f'barberbook_cache_misses_total{_etiquetas(cache=nombre)} {stats["misses"]}')
+
+    lineas.append('# HELP barberbook_process_uptime_seconds Segundos desde que arrancó el proceso')
+    lineas.append('# TYPE barberbook_process_uptime_seconds gauge')
+    lineas.append(f'barberbook_process_uptime_seconds {time.time() - _inicio_proceso}')
+    return '\n'.join(lineas) + '\n'
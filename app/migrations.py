@@ -0,0 +1,553 @@
+from app.database import get_db_cursor
+
+# Migraciones versionadas del esquema.
+#
+# Cada migración es (version, nombre, sentencias) y se aplica una sola vez, en
+# orden, dentro de su propia transacción. Las versiones aplicadas se guardan
+# en Migraciones_Esquema. Las sentencias son idempotentes (comprueban antes de
+# crear) para poder aplicarse sobre bases que ya tengan parte de los objetos.
+#
+# Uso:
+#     python -m app.migrations            aplica las migraciones pendientes
+#     python -m app.migrations --estado   muestra qué versiones faltan
+
+
+def _crear_indice(nombre, tabla, definicion):
+    """Sentencia CREATE INDEX que no falla si el índice ya existe"""
+    return f"""
+        IF NOT EXISTS (SELECT 1 FROM sys.indexes
+                       WHERE name = '{nombre}' AND object_id = OBJECT_ID('{tabla}'))
+            CREATE {definicion}
+    """
+
+
+def _trigger_version(tabla, columna, incluir_lista=False):
+    """
+    Trigger que sube la versión de catálogo de las barberías afectadas por
+    un cambio en `tabla` (y la de la lista de barberías, clave 0, si se pide)
+    """
+    lista = "UNION SELECT 0" if incluir_lista else ""
+    return f"""
+        CREATE OR ALTER TRIGGER TR_{tabla}_version_catalogo ON {tabla}
+        AFTER INSERT, UPDATE, DELETE
+        AS
+        BEGIN
+            SET NOCOUNT ON;
+            MERGE Versiones_Catalogo WITH (HOLDLOCK) AS v
+            USING (SELECT {columna} FROM inserted UNION SELECT {columna} FROM deleted {lista}) AS a (barberia_id)
+            ON v.barberia_id = a.barberia_id
+            WHEN MATCHED THEN UPDATE SET version = v.version + 1
+            WHEN NOT MATCHED THEN INSERT (barberia_id, version) VALUES (a.barberia_id, 1);
+        END
+    """
+
+
+MIGRACIONES = [
+    (1, 'Índices de Citas por barbero, cliente y estado', [
+        # obtener_slots_disponibles, obtener_citas_por_barbero, obtener_estadisticas_barbero
+        _crear_indice('IX_Citas_barbero_fecha_estado', 'Citas', """
+            INDEX IX_Citas_barbero_fecha_estado ON Citas (barbero_id, fecha, estado_id)
+            INCLUDE (hora_inicio, hora_fin, cliente_id, servicio_id, precio_final)
+        """),
+        # obtener_citas_por_cliente (ORDER BY fecha DESC, hora_inicio DESC)
+        _crear_indice('IX_Citas_cliente_fecha', 'Citas', """
+            INDEX IX_Citas_cliente_fecha ON Citas (cliente_id, fecha DESC, hora_inicio DESC)
+            INCLUDE (barbero_id, servicio_id, estado_id, hora_fin)
+        """),
+        # marcar_citas_vencidas y archivar_citas_lote
+        _crear_indice('IX_Citas_estado_fecha', 'Citas', """
+            INDEX IX_Citas_estado_fecha ON Citas (estado_id, fecha)
+            INCLUDE (hora_fin)
+        """),
+    ]),
+    (2, 'Índices de catálogo: servicios, barberos y barberías', [
+        # obtener_servicios_por_barberia
+        _crear_indice('IX_Servicios_barberia_activo', 'Servicios', """
+            INDEX IX_Servicios_barberia_activo ON Servicios (barberia_id, activo)
+            INCLUDE (categoria_id, nombre, precio, duracion_minutos)
+        """),
+        # obtener_barberos_por_barberia (ORDER BY calificacion_promedio DESC)
+        _crear_indice('IX_Barberos_barberia_activo', 'Barberos', """
+            INDEX IX_Barberos_barberia_activo ON Barberos (barberia_id, activo, calificacion_promedio DESC)
+            INCLUDE (usuario_id, total_servicios)
+        """),
+        # obtener_barbero_por_usuario_id y la verificación de cambiar_estado_citas
+        _crear_indice('IX_Barberos_usuario', 'Barberos', """
+            INDEX IX_Barberos_usuario ON Barberos (usuario_id)
+            INCLUDE (barberia_id, activo)
+        """),
+        # obtener_barberias_activas (ORDER BY nombre) y obtener_barberias_por_propietario
+        _crear_indice('IX_Barberias_activo_nombre', 'Barberias', """
+            INDEX IX_Barberias_activo_nombre ON Barberias (activo, nombre)
+            INCLUDE (propietario_id, ciudad)
+        """),
+        _crear_indice('IX_Barberias_propietario', 'Barberias', """
+            INDEX IX_Barberias_propietario ON Barberias (propietario_id, activo)
+            INCLUDE (nombre, ciudad)
+        """),
+    ]),
+    (3, 'Índices de horarios y usuarios', [
+        # obtener_slots_disponibles
+        _crear_indice('IX_Horarios_barbero_dia', 'Horarios_Barberos', """
+            INDEX IX_Horarios_barbero_dia ON Horarios_Barberos (barbero_id, dia_semana, activo)
+            INCLUDE (hora_inicio, hora_fin)
+        """),
+        # obtener_usuario_por_email (login)
+        _crear_indice('IX_Usuarios_email', 'Usuarios', """
+            INDEX IX_Usuarios_email ON Usuarios (email)
+            INCLUDE (password_hash, nombre, apellido, rol_id, activo)
+        """),
+    ]),
+    (4, 'Versiones de catálogo para la cache de páginas públicas', [
+        """
+        IF OBJECT_ID('Versiones_Catalogo', 'U') IS NULL
+            CREATE TABLE Versiones_Catalogo (
+                barberia_id INT PRIMARY KEY,  -- 0 = lista de barberías
+                version BIGINT NOT NULL
+            )
+        """,
+        _trigger_version('Barberias', 'id', incluir_lista=True),
+        _trigger_version('Servicios', 'barberia_id'),
+        _trigger_version('Barberos', 'barberia_id'),
+    ]),
+    (5, 'Versiones de agenda por barbero y fecha para el ETag de disponibilidad', [
+        """
+        IF OBJECT_ID('Versiones_Agenda', 'U') IS NULL
+            CREATE TABLE Versiones_Agenda (
+                barbero_id INT NOT NULL,
+                fecha DATE NOT NULL,  -- 1900-01-01 = horario semanal del barbero
+                version BIGINT NOT NULL,
+                CONSTRAINT PK_Versiones_Agenda PRIMARY KEY (barbero_id, fecha)
+            )
+        """,
+        # Solo días de hoy en adelante: la disponibilidad pasada no se consulta
+        # y así el archivo de citas antiguas no genera versiones
+        """
+        CREATE OR ALTER TRIGGER TR_Citas_version_agenda ON Citas
+        AFTER INSERT, UPDATE, DELETE
+        AS
+        BEGIN
+            SET NOCOUNT ON;
+            MERGE Versiones_Agenda WITH (HOLDLOCK) AS v
+            USING (SELECT barbero_id, fecha FROM inserted WHERE fecha >= CAST(GETDATE() AS DATE)
+                   UNION
+                   SELECT barbero_id, fecha FROM deleted WHERE fecha >= CAST(GETDATE() AS DATE)) AS a
+            ON v.barbero_id = a.barbero_id AND v.fecha = a.fecha
+            WHEN MATCHED THEN UPDATE SET version = v.version + 1
+            WHEN NOT MATCHED THEN INSERT (barbero_id, fecha, version) VALUES (a.barbero_id, a.fecha, 1);
+        END
+        """,
+        """
+        CREATE OR ALTER TRIGGER TR_Horarios_Barberos_version_agenda ON Horarios_Barberos
+        AFTER INSERT, UPDATE, DELETE
+        AS
+        BEGIN
+            SET NOCOUNT ON;
+            MERGE Versiones_Agenda WITH (HOLDLOCK) AS v
+            USING (SELECT barbero_id FROM inserted UNION SELECT barbero_id FROM deleted) AS a
+            ON v.barbero_id = a.barbero_id AND v.fecha = '19000101'
+            WHEN MATCHED THEN UPDATE SET version = v.version + 1
+            WHEN NOT MATCHED THEN INSERT (barbero_id, fecha, version) VALUES (a.barbero_id, '19000101', 1);
+        END
+        """,
+    ]),
+    (6, 'Coordenadas de las barberías para la búsqueda por cercanía', [
+        """
+        IF COL_LENGTH('Barberias', 'latitud') IS NULL
+            ALTER TABLE Barberias ADD latitud DECIMAL(9, 6) NULL, longitud DECIMAL(9, 6) NULL
+        """,
+        """
+        IF OBJECT_ID('CK_Barberias_coordenadas', 'C') IS NULL
+            ALTER TABLE Barberias ADD CONSTRAINT CK_Barberias_coordenadas
+            CHECK ((latitud IS NULL AND longitud IS NULL)
+                   OR (latitud BETWEEN -90 AND 90 AND longitud BETWEEN -180 AND 180))
+        """,
+    ]),
+    (7, 'Excepciones de horario y calendario materializado de los barberos', [
+        # barbero_id NULL = toda la barbería (festivos). tipo: 'cerrado' (no se
+        # trabaja), 'horario' (sustituye al horario semanal ese día) o 'pausa'
+        # (se descuenta del horario)
+        """
+        IF OBJECT_ID('Excepciones_Horario', 'U') IS NULL
+            CREATE TABLE Excepciones_Horario (
+                id INT IDENTITY(1,1) PRIMARY KEY,
+                barberia_id INT NOT NULL REFERENCES Barberias(id),
+                barbero_id INT NULL REFERENCES Barberos(id),
+                fecha_desde DATE NOT NULL,
+                fecha_hasta DATE NOT NULL,
+                tipo VARCHAR(10) NOT NULL CHECK (tipo IN ('cerrado', 'horario', 'pausa')),
+                hora_inicio TIME NULL,
+                hora_fin TIME NULL,
+                motivo NVARCHAR(200) NULL,
+                fecha_creacion DATETIME NOT NULL DEFAULT GETDATE(),
+                CONSTRAINT CK_Excepciones_fechas CHECK (fecha_hasta >= fecha_desde),
+                CONSTRAINT CK_Excepciones_horas CHECK (
+                    tipo = 'cerrado' OR (hora_inicio IS NOT NULL AND hora_fin > hora_inicio))
+            )
+        """,
+        _crear_indice('IX_Excepciones_barberia_fechas', 'Excepciones_Horario', """
+            INDEX IX_Excepciones_barberia_fechas ON Excepciones_Horario (barberia_id, fecha_hasta)
+            INCLUDE (barbero_id, fecha_desde, tipo, hora_inicio, hora_fin)
+        """),
+        # Tramos de trabajo de cada barbero por día, para las próximas
+        # CALENDARIO_SEMANAS semanas (ver app/calendario.py)
+        """
+        IF OBJECT_ID('Calendario_Barberos', 'U') IS NULL
+            CREATE TABLE Calendario_Barberos (
+                barbero_id INT NOT NULL,
+                fecha DATE NOT NULL,
+                hora_inicio TIME NOT NULL,
+                hora_fin TIME NOT NULL,
+                CONSTRAINT PK_Calendario_Barberos PRIMARY KEY (barbero_id, fecha, hora_inicio)
+            )
+        """,
+        # Hasta qué día está generado el calendario de cada barbero
+        """
+        IF OBJECT_ID('Calendario_Generado', 'U') IS NULL
+            CREATE TABLE Calendario_Generado (
+                barbero_id INT PRIMARY KEY,
+                hasta DATE NOT NULL
+            )
+        """,
+        # Barberos cuyo calendario hay que regenerar desde una fecha; `marca`
+        # cambia con cada aviso para no borrar uno llegado durante la regeneración
+        """
+        IF OBJECT_ID('Calendario_Pendientes', 'U') IS NULL
+            CREATE TABLE Calendario_Pendientes (
+                barbero_id INT PRIMARY KEY,
+                desde DATE NOT NULL,
+                marca INT NOT NULL
+            )
+        """,
+        """
+        CREATE OR ALTER TRIGGER TR_Horarios_Barberos_calendario ON Horarios_Barberos
+        AFTER INSERT, UPDATE, DELETE
+        AS
+        BEGIN
+            SET NOCOUNT ON;
+            MERGE Calendario_Pendientes AS p
+            USING (SELECT barbero_id FROM inserted UNION SELECT barbero_id FROM deleted) AS a
+            ON p.barbero_id = a.barbero_id
+            WHEN MATCHED THEN UPDATE SET desde = CAST(GETDATE() AS DATE), marca = p.marca + 1
+            WHEN NOT MATCHED THEN INSERT (barbero_id, desde, marca)
+                VALUES (a.barbero_id, CAST(GETDATE() AS DATE), 1);
+        END
+        """,
+        """
+        CREATE OR ALTER TRIGGER TR_Excepciones_Horario_calendario ON Excepciones_Horario
+        AFTER INSERT, UPDATE, DELETE
+        AS
+        BEGIN
+            SET NOCOUNT ON;
+            MERGE Calendario_Pendientes AS p
+            USING (
+                SELECT b.id AS barbero_id, MIN(e.fecha_desde) AS desde
+                FROM (SELECT barberia_id, barbero_id, fecha_desde FROM inserted
+                      UNION ALL
+                      SELECT barberia_id, barbero_id, fecha_desde FROM deleted) AS e
+                INNER JOIN Barberos b
+                    ON b.id = e.barbero_id OR (e.barbero_id IS NULL AND b.barberia_id = e.barberia_id)
+                GROUP BY b.id
+            ) AS a
+            ON p.barbero_id = a.barbero_id
+            WHEN MATCHED THEN UPDATE SET desde = CASE WHEN a.desde < p.desde THEN a.desde ELSE p.desde END,
+                                         marca = p.marca + 1
+            WHEN NOT MATCHED THEN INSERT (barbero_id, desde, marca) VALUES (a.barbero_id, a.desde, 1);
+        END
+        """,
+    ]),
+    (8, 'Reservas temporales de huecos durante la reserva', [
+        # Una retención por cliente (ver app/reservas.py); `expira` en hora del servidor
+        """
+        IF OBJECT_ID('Reservas_Temporales', 'U') IS NULL
+            CREATE TABLE Reservas_Temporales (
+                token CHAR(32) NOT NULL CONSTRAINT PK_Reservas_Temporales PRIMARY KEY NONCLUSTERED,
+                cliente_id INT NOT NULL,
+                barbero_id INT NOT NULL,
+                fecha DATE NOT NULL,
+                hora_inicio TIME NOT NULL,
+                hora_fin TIME NOT NULL,
+                expira DATETIME2 NOT NULL,
+                CONSTRAINT CK_Reservas_Temporales_horas CHECK (hora_fin > hora_inicio)
+            )
+        """,
+        # Comprobación de solapes y disponibilidad
+        _crear_indice('IX_Reservas_Temporales_barbero_fecha', 'Reservas_Temporales', """
+            CLUSTERED INDEX IX_Reservas_Temporales_barbero_fecha
+            ON Reservas_Temporales (barbero_id, fecha, hora_inicio)
+        """),
+        # Purga de vencidas sin recorrer la tabla
+        _crear_indice('IX_Reservas_Temporales_expira', 'Reservas_Temporales', """
+            INDEX IX_Reservas_Temporales_expira ON Reservas_Temporales (expira)
+        """),
+        _crear_indice('IX_Reservas_Temporales_cliente', 'Reservas_Temporales', """
+            INDEX IX_Reservas_Temporales_cliente ON Reservas_Temporales (cliente_id)
+        """),
+        # Una retención cambia la disponibilidad igual que una cita
+        """
+        CREATE OR ALTER TRIGGER TR_Reservas_Temporales_version_agenda ON Reservas_Temporales
+        AFTER INSERT, UPDATE, DELETE
+        AS
+        BEGIN
+            SET NOCOUNT ON;
+            MERGE Versiones_Agenda WITH (HOLDLOCK) AS v
+            USING (SELECT barbero_id, fecha FROM inserted
+                   UNION
+                   SELECT barbero_id, fecha FROM deleted) AS a
+            ON v.barbero_id = a.barbero_id AND v.fecha = a.fecha
+            WHEN MATCHED THEN UPDATE SET version = v.version + 1
+            WHEN NOT MATCHED THEN INSERT (barbero_id, fecha, version) VALUES (a.barbero_id, a.fecha, 1);
+        END
+        """,
+    ]),
+    (9, 'Series de citas recurrentes', [
+        # Las citas de la serie se crean hasta SERIES_HORIZONTE_SEMANAS vista y
+        # la tarea materializar_series va creando las siguientes (ver app/series.py)
+        """
+        IF OBJECT_ID('Series_Citas', 'U') IS NULL
+            CREATE TABLE Series_Citas (
+                id INT IDENTITY(1,1) PRIMARY KEY,
+                cliente_id INT NOT NULL REFERENCES Usuarios(id),
+                barbero_id INT NOT NULL REFERENCES Barberos(id),
+                servicio_id INT NOT NULL REFERENCES Servicios(id),
+                fecha_inicio DATE NOT NULL,
+                fecha_fin DATE NOT NULL,  -- última ocurrencia
+                cada_semanas TINYINT NOT NULL CHECK (cada_semanas BETWEEN 1 AND 12),
+                hora_inicio TIME NOT NULL,
+                hora_fin TIME NOT NULL,
+                precio_final DECIMAL(10, 2) NOT NULL,
+                notas_cliente NVARCHAR(500) NULL,
+                generada_hasta DATE NOT NULL,
+                creadas INT NOT NULL DEFAULT 0,
+                omitidas INT NOT NULL DEFAULT 0,  -- ocupadas o fuera de horario al materializar
+                activa BIT NOT NULL DEFAULT 1,
+                fecha_creacion DATETIME NOT NULL DEFAULT GETDATE(),
+                CONSTRAINT CK_Series_Citas_fechas CHECK (fecha_fin >= fecha_inicio)
+            )
+        """,
+        _crear_indice('IX_Series_Citas_generada', 'Series_Citas', """
+            INDEX IX_Series_Citas_generada ON Series_Citas (activa, generada_hasta)
+        """),
+        _crear_indice('IX_Series_Citas_cliente', 'Series_Citas', """
+            INDEX IX_Series_Citas_cliente ON Series_Citas (cliente_id, activa)
+        """),
+    ]),
+    (10, 'Lista de espera de huecos', [
+        # barbero_id NULL = cualquier barbero de la barbería. Al liberarse un
+        # hueco se ofrece (estado 'ofrecida') reteniéndolo a nombre del cliente
+        # hasta oferta_expira (ver app/lista_espera.py)
+        """
+        IF OBJECT_ID('Lista_Espera', 'U') IS NULL
+            CREATE TABLE Lista_Espera (
+                id INT IDENTITY(1,1) PRIMARY KEY,
+                cliente_id INT NOT NULL REFERENCES Usuarios(id),
+                barberia_id INT NOT NULL REFERENCES Barberias(id),
+                barbero_id INT NULL REFERENCES Barberos(id),
+                servicio_id INT NOT NULL REFERENCES Servicios(id),
+                fecha_desde DATE NOT NULL,
+                fecha_hasta DATE NOT NULL,
+                estado VARCHAR(10) NOT NULL DEFAULT 'activa'
+                    CHECK (estado IN ('activa', 'ofrecida', 'atendida', 'cancelada', 'vencida')),
+                oferta_barbero_id INT NULL,
+                oferta_fecha DATE NULL,
+                oferta_hora_inicio TIME NULL,
+                oferta_hora_fin TIME NULL,
+                oferta_token CHAR(32) NULL,
+                oferta_expira DATETIME2 NULL,
+                fecha_creacion DATETIME NOT NULL DEFAULT GETDATE(),
+                CONSTRAINT CK_Lista_Espera_fechas CHECK (fecha_hasta >= fecha_desde)
+            )
+        """,
+        _crear_indice('IX_Lista_Espera_cliente', 'Lista_Espera', """
+            INDEX IX_Lista_Espera_cliente ON Lista_Espera (cliente_id, estado)
+        """),
+        _crear_indice('IX_Lista_Espera_ofertas', 'Lista_Espera', """
+            INDEX IX_Lista_Espera_ofertas ON Lista_Espera (estado, oferta_expira)
+        """),
+        _crear_indice('IX_Lista_Espera_vencimiento', 'Lista_Espera', """
+            INDEX IX_Lista_Espera_vencimiento ON Lista_Espera (estado, fecha_hasta)
+        """),
+        # Un día por fila: los candidatos para un hueco salen de una búsqueda
+        # por (barbería, fecha) en la clave, en orden de llegada
+        """
+        IF OBJECT_ID('Lista_Espera_Dias', 'U') IS NULL
+            CREATE TABLE Lista_Espera_Dias (
+                barberia_id INT NOT NULL,
+                fecha DATE NOT NULL,
+                espera_id INT NOT NULL,
+                CONSTRAINT PK_Lista_Espera_Dias PRIMARY KEY (barberia_id, fecha, espera_id)
+            )
+        """,
+        _crear_indice('IX_Lista_Espera_Dias_fecha', 'Lista_Espera_Dias', """
+            INDEX IX_Lista_Espera_Dias_fecha ON Lista_Espera_Dias (fecha)
+        """),
+    ]),
+    (11, 'Bandeja de salida de notificaciones', [
+        # Se escribe en la misma transacción que la cita y la vacía la tarea
+        # despachar_notificaciones (ver app/notificaciones.py). Sin claves
+        # foráneas: es un registro de envíos, no debe frenar borrados
+        """
+        IF OBJECT_ID('Notificaciones_Salida', 'U') IS NULL
+            CREATE TABLE Notificaciones_Salida (
+                id BIGINT IDENTITY(1,1) PRIMARY KEY,
+                clave VARCHAR(100) NOT NULL,
+                canal VARCHAR(20) NOT NULL,
+                usuario_id INT NOT NULL,
+                rol VARCHAR(10) NOT NULL,
+                tipo VARCHAR(20) NOT NULL,
+                cita_id INT NULL,
+                estado_id INT NULL,
+                estado VARCHAR(10) NOT NULL DEFAULT 'pendiente'
+                    CHECK (estado IN ('pendiente', 'enviada', 'fallida', 'descartada')),
+                intentos INT NOT NULL DEFAULT 0,
+                proximo_intento DATETIME2 NOT NULL DEFAULT SYSDATETIME(),
+                ultimo_error NVARCHAR(400) NULL,
+                creada DATETIME2 NOT NULL DEFAULT SYSDATETIME(),
+                enviada DATETIME2 NULL
+            )
+        """,
+        # Deduplicación: volver a encolar la misma notificación no inserta nada
+        _crear_indice('UX_Notificaciones_Salida_clave', 'Notificaciones_Salida', """
+            UNIQUE INDEX UX_Notificaciones_Salida_clave ON Notificaciones_Salida (clave)
+                WITH (IGNORE_DUP_KEY = ON)
+        """),
+        _crear_indice('IX_Notificaciones_Salida_pendientes', 'Notificaciones_Salida', """
+            INDEX IX_Notificaciones_Salida_pendientes ON Notificaciones_Salida (proximo_intento)
+                WHERE estado = 'pendiente'
+        """),
+        _crear_indice('IX_Notificaciones_Salida_cerradas', 'Notificaciones_Salida', """
+            INDEX IX_Notificaciones_Salida_cerradas ON Notificaciones_Salida (creada)
+                WHERE estado IN ('enviada', 'fallida', 'descartada')
+        """),
+    ]),
+    (12, 'Recordatorios de citas en la bandeja de salida', [
+        # Inicio de la cita para el que se programó un recordatorio: si la
+        # cita cambia de hora o se cancela, el recordatorio se descarta al salir
+        """
+        IF COL_LENGTH('Notificaciones_Salida', 'programada') IS NULL
+            ALTER TABLE Notificaciones_Salida ADD programada DATETIME2 NULL
+        """,
+    ]),
+    (13, 'Reseñas de citas y calificación acumulada por barbero', [
+        # Sin clave foránea a Citas: el archivo histórico borra las citas antiguas
+        """
+        IF OBJECT_ID('Resenas', 'U') IS NULL
+            CREATE TABLE Resenas (
+                id INT IDENTITY(1,1) PRIMARY KEY,
+                cita_id INT NULL,
+                cliente_id INT NOT NULL REFERENCES Usuarios(id),
+                barbero_id INT NOT NULL REFERENCES Barberos(id),
+                barberia_id INT NULL,
+                calificacion TINYINT NOT NULL CHECK (calificacion BETWEEN 1 AND 5),
+                comentario NVARCHAR(1000) NULL,
+                fecha_creacion DATETIME NOT NULL DEFAULT GETDATE()
+            )
+        """,
+        # Si la tabla ya existía, le faltan las columnas que usa la aplicación
+        """
+        IF COL_LENGTH('Resenas', 'cita_id') IS NULL
+            ALTER TABLE Resenas ADD cita_id INT NULL
+        """,
+        """
+        IF COL_LENGTH('Resenas', 'barberia_id') IS NULL
+            ALTER TABLE Resenas ADD barberia_id INT NULL
+        """,
+        """
+        UPDATE r SET r.barberia_id = b.barberia_id
+        FROM Resenas r
+        INNER JOIN Barberos b ON r.barbero_id = b.id
+        WHERE r.barberia_id IS NULL
+        """,
+        # Una reseña por cita
+        _crear_indice('UX_Resenas_cita', 'Resenas', """
+            UNIQUE INDEX UX_Resenas_cita ON Resenas (cita_id) WHERE cita_id IS NOT NULL
+        """),
+        # Listados paginados por id (más recientes primero) y reconciliación
+        _crear_indice('IX_Resenas_barbero', 'Resenas', """
+            INDEX IX_Resenas_barbero ON Resenas (barbero_id, id DESC) INCLUDE (calificacion)
+        """),
+        _crear_indice('IX_Resenas_barberia', 'Resenas', """
+            INDEX IX_Resenas_barberia ON Resenas (barberia_id, id DESC)
+        """),
+        # Suma y número de calificaciones de cada barbero: cada reseña las
+        # actualiza y recalcula Barberos.calificacion_promedio sin leer las demás
+        """
+        IF OBJECT_ID('Calificaciones_Barberos', 'U') IS NULL
+            CREATE TABLE Calificaciones_Barberos (
+                barbero_id INT PRIMARY KEY,
+                suma INT NOT NULL,
+                total INT NOT NULL
+            )
+        """,
+        """
+        INSERT INTO Calificaciones_Barberos (barbero_id, suma, total)
+        SELECT r.barbero_id, SUM(r.calificacion), COUNT(*)
+        FROM Resenas r
+        WHERE NOT EXISTS (SELECT 1 FROM Calificaciones_Barberos a WHERE a.barbero_id = r.barbero_id)
+        GROUP BY r.barbero_id
+        """,
+    ]),
+    (14, 'Tipo de las retenciones temporales: reserva u oferta de la lista de espera', [
+        # Cada cliente tiene una sola retención de tipo 'reserva' (elegir otra
+        # hora la suelta); las ofertas de la lista de espera van aparte
+        """
+        IF COL_LENGTH('Reservas_Temporales', 'tipo') IS NULL
+            ALTER TABLE Reservas_Temporales ADD tipo VARCHAR(10) NOT NULL
+                CONSTRAINT DF_Reservas_Temporales_tipo DEFAULT 'reserva'
+        """,
+    ]),
+]
+
+
+def _asegurar_tabla_migraciones(cursor):
+    cursor.execute("""
+        IF OBJECT_ID('Migraciones_Esquema', 'U') IS NULL
+            CREATE TABLE Migraciones_Esquema (
+                version INT PRIMARY KEY,
+                nombre NVARCHAR(200) NOT NULL,
+                fecha_aplicacion DATETIME NOT NULL DEFAULT GETDATE()
+            )
+    """)
+
+
+def obtener_versiones_aplicadas():
+    """Devuelve el conjunto de versiones ya aplicadas"""
+    with get_db_cursor(commit=True) as cursor:
+        _asegurar_tabla_migraciones(cursor)
+        cursor.execute("SELECT version FROM Migraciones_Esquema")
+        return {row[0] for row in cursor.fetchall()}
+
+
+def migraciones_pendientes():
+    """Devuelve las migraciones que faltan por aplicar, en orden"""
+    aplicadas = obtener_versiones_aplicadas()
+    return [m for m in sorted(MIGRACIONES, key=lambda m: m[0]) if m[0] not in aplicadas]
+
+
+def aplicar_migraciones():
+    """Aplica las migraciones pendientes. Devuelve la lista de versiones aplicadas."""
+    aplicadas = []
+    for version, nombre, sentencias in migraciones_pendientes():
+        with get_db_cursor(commit=True) as cursor:
+            for sentencia in sentencias:
+                cursor.execute(sentencia)
+            cursor.execute("INSERT INTO Migraciones_Esquema (version, nombre) VALUES (?, ?)",
+                           (version, nombre))
+        print(f"  ✓ Migración {version}: {nombre}")
+        aplicadas.append(version)
+    return aplicadas
+
+
+if __name__ == '__main__':
+    import sys
+
+    if '--estado' in sys.argv:
+        pendientes = migraciones_pendientes()
+        if not pendientes:
+            print("✅ El esquema está al día")
+        for version, nombre, _ in pendientes:
+            print(f"  • Pendiente {version}: {nombre}")
+    else:
+        print("🔄 Aplicando migraciones...")
+        aplicadas = aplicar_migraciones()
+        print(f"\n✅ {len(aplicadas)} migración(es) aplicada(s)\n")
@@ -0,0 +1,150 @@
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from datetime import datetime, timedelta
+from config import Config
+from app import metrics
+from app.database import (cerrar_notificaciones, notificaciones_disponible, purgar_notificaciones,
+                          reintentar_notificaciones, tomar_notificaciones)
+
+# Envío de las notificaciones de la bandeja de salida (Notificaciones_Salida).
+#
+# crear_cita, cambiar_estado_cita y cancelar_cita_cliente encolan sus avisos
+# en la misma transacción que la cita, así que no se pierde ninguno ni se
+# avisa de una cita que no llegó a guardarse, y la petición no espera a
+# ningún proveedor. La tarea despachar() toma lotes de NOTIFICACIONES_LOTE,
+# los agrupa por canal y entrega cada grupo de una vez. Los que fallan se
+# reintentan con espera exponencial hasta NOTIFICACIONES_INTENTOS_MAX; los
+# que no tienen destinatario (sin teléfono para un SMS) o cuya cita ya no
+# existe se descartan.
+#
+# Los recordatorios (RECORDATORIOS_HORAS antes de cada cita) se encolan al
+# crear la cita con proximo_intento en su hora de salida: el índice de
+# pendientes hace de cola de prioridad, así que no se recorre Citas ni se
+# guardan en memoria. Una cancelación o un cambio de hora no los toca; al
+# salir se comprueba que la cita sigue en pie a esa hora y si no se descartan.
+#
+# Los canales son intercambiables (registrar_canal). Los de serie, 'email' y
+# 'sms', escriben en NOTIFICACIONES_DIR en lugar de llamar a un proveedor.
+
+Mensaje = namedtuple('Mensaje', 'id destino asunto texto')
+
+
+class Canal(ABC):
+    """Interfaz de los canales de entrega"""
+
+    campo = 'email'  # columna del usuario con la dirección de destino
+
+    @abstractmethod
+    def enviar(self, mensajes):
+        """Entrega un lote de Mensaje. Devuelve {id: error} de los que fallaron."""
+
+
+class CanalArchivo(Canal):
+    """Sustituto local de un proveedor: una línea JSON por mensaje en <NOTIFICACIONES_DIR>/<nombre>.log"""
+
+    def __init__(self, nombre, campo):
+        self.nombre = nombre
+        self.campo = campo
+        self._lock = threading.Lock()
+
+    def enviar(self, mensajes):
+        os.makedirs(Config.NOTIFICACIONES_DIR, exist_ok=True)
+        ahora = datetime.now().isoformat(timespec='seconds')
+        lineas = ''.join(json.dumps({'fecha': ahora, **m._asdict()}, ensure_ascii=False, default=str) + '\n'
+                         for m in mensajes)
+        with self._lock, open(os.path.join(Config.NOTIFICACIONES_DIR, f'{self.nombre}.log'), 'a',
+                              encoding='utf-8') as archivo:
+            archivo.write(lineas)
+        return {}
+
+
+_canales = {
+    'email': CanalArchivo('email', 'email'),
+    'sms': CanalArchivo('sms', 'telefono'),
+}
+
+
+def registrar_canal(nombre, canal):
+    """Registra (o reemplaza) el canal `nombre`; se usa si está en NOTIFICACIONES_CANALES"""
+    _canales[nombre] = canal
+
+
+def redactar(fila):
+    """(asunto, texto) de una notificación tomada de la bandeja"""
+    cuando = f"el {fila['fecha'].strftime('%d/%m/%Y')} a las {fila['hora_inicio'].strftime('%H:%M')}"
+    if fila['tipo'] == 'recordatorio':
+        return ('Recordatorio de tu cita',
+                f"Hola {fila['nombre']}, te recordamos tu cita de {fila['servicio']} con {fila['barbero']} "
+                f"en {fila['barberia']} {cuando}.")
+    if fila['tipo'] == 'cita_creada' and fila['rol'] == 'cliente':
+        return ('Cita reservada',
+                f"Hola {fila['nombre']}, tu cita de {fila['servicio']} con {fila['barbero']} "
+                f"en {fila['barberia']} es {cuando}.")
+    if fila['tipo'] == 'cita_creada':
+        return 'Nueva cita', f"{fila['cliente']} ha reservado {fila['servicio']} {cuando}."
+    if fila['rol'] == 'cliente':
+        return (f"Tu cita está {fila['estado'].lower()}",
+                f"Hola {fila['nombre']}, tu cita de {fila['servicio']} en {fila['barberia']} {cuando} "
+                f"ha pasado a {fila['estado']}.")
+    return (f"Cita {fila['estado'].lower()}",
+            f"La cita de {fila['cliente']} ({fila['servicio']}) {cuando} ha pasado a {fila['estado']}.")
+
+
+def _entregar(canal_nombre, filas):
+    """Entrega las filas de un canal. Devuelve (enviadas, descartadas, reintentos)."""
+    canal = _canales.get(canal_nombre)
+    if canal is None:
+        return [], [f['id'] for f in filas], []
+    mensajes, descartadas = [], []
+    for fila in filas:
+        if fila['fecha'] is None or not fila['vigente'] or not fila[canal.campo]:
+            # La cita ya no existe, el recordatorio ya no vale o no hay a dónde enviarlo
+            descartadas.append(fila['id'])
+        else:
+            mensajes.append(Mensaje(fila['id'], fila[canal.campo], *redactar(fila)))
+    try:
+        errores = canal.enviar(mensajes) if mensajes else {}
+    except Exception as e:
+        errores = {m.id: str(e) for m in mensajes}
+    enviadas = [m.id for m in mensajes if m.id not in errores]
+    intentos = {f['id']: f['intentos'] for f in filas}
+    reintentos = [('fallida' if intentos[i] >= Config.NOTIFICACIONES_INTENTOS_MAX else 'pendiente',
+                   Config.NOTIFICACIONES_REINTENTO_SEGUNDOS * 2 ** (intentos[i] - 1), error[:400], i)
+                  for i, error in errores.items()]
+    return enviadas, descartadas, reintentos
+
+
+def despachar():
+    """Tarea periódica: vacía la bandeja de salida por lotes. Devuelve cuántas se procesaron."""
+    if not notificaciones_disponible():
+        return 0
+    total = 0
+    while True:
+        filas = tomar_notificaciones(Config.NOTIFICACIONES_LOTE, Config.NOTIFICACIONES_PLAZO_SEGUNDOS)
+        por_canal = {}
+        for fila in filas:
+            por_canal.setdefault(fila['canal'], []).append(fila)
+        for canal, grupo in por_canal.items():
+            inicio = time.perf_counter()
+            enviadas, descartadas, reintentos = _entregar(canal, grupo)
+            cerrar_notificaciones(enviadas, 'enviada')
+            cerrar_notificaciones(descartadas, 'descartada')
+            reintentar_notificaciones(reintentos)
+            fallidas = sum(1 for r in reintentos if r[0] == 'fallida')
+            metrics.registrar_envio(canal, time.perf_counter() - inicio, enviadas=len(enviadas),
+                                    reintentos=len(reintentos) - fallidas, fallidas=fallidas,
+                                    descartadas=len(descartadas))
+        total += len(filas)
+        if len(filas) < Config.NOTIFICACIONES_LOTE:
+            return total
+
+
+def purgar():
+    """Borra las notificaciones cerradas de más de NOTIFICACIONES_RETENCION_DIAS días"""
+    if not notificaciones_disponible():
+        return 0
+    return purgar_notificaciones(datetime.now() - timedelta(days=Config.NOTIFICACIONES_RETENCION_DIAS))
@@ -0,0 +1,80 @@
+import hashlib
+import threading
+import time
+from flask import make_response, request, session
+from config import Config
+from app.cache import CacheTTL
+from app.database import obtener_versiones_catalogo
+
+# Cache de páginas públicas renderizadas (inicio y página de cada barbería).
+#
+# Solo se cachea el HTML de visitantes anónimos: el de usuarios con sesión
+# incluye su nombre y su menú. La clave es (página, barberia_id, versión de
+# catálogo, estado de sesión). La versión la suben los triggers de la
+# migración 4 cada vez que cambian barberías, servicios o barberos, y este
+# proceso la relee como mucho cada PAGINAS_VERSION_SEGUNDOS, así que una
+# visita anónima con la página en cache no toca la base ni Jinja.
+
+_cache_paginas = CacheTTL(ttl=Config.PAGINAS_CACHE_TTL, max_entradas=512, nombre='paginas')
+
+_versiones = {'valores': {}, 'leidas': 0.0}
+_lock_versiones = threading.Lock()
+
+
+def versiones_catalogo():
+    """{barberia_id: versión}, releído como mucho cada PAGINAS_VERSION_SEGUNDOS"""
+    if time.monotonic() - _versiones['leidas'] >= Config.PAGINAS_VERSION_SEGUNDOS:
+        # Un solo hilo relee; el resto sigue con los valores anteriores
+        if _lock_versiones.acquire(blocking=False):
+            try:
+                _versiones['valores'] = obtener_versiones_catalogo()
+                _versiones['leidas'] = time.monotonic()
+            finally:
+                _lock_versiones.release()
+    return _versiones['valores']
+
+
+def version_catalogo(barberia_id):
+    """Versión actual de los datos de una barbería (0 = lista de barberías)"""
+    return versiones_catalogo().get(barberia_id, 0)
+
+
+def invalidar(barberia_id=None):
+    """Descarta las páginas cacheadas de una barbería (y la de inicio), o todas"""
+    _versiones['leidas'] = 0.0
+    if barberia_id is None:
+        _cache_paginas.invalidar()
+    else:
+        _cache_paginas.invalidar(lambda clave: clave[1] in (0, barberia_id))
+
+
+def _es_anonimo():
+    # Con mensajes flash pendientes la página no es la misma para todos
+    return 'user_id' not in session and '_flashes' not in session
+
+
+def servir(pagina, barberia_id, generar):
+    """
+    Devuelve la página desde la cache con su ETag (304 si el navegador ya
+    la tiene). `generar` renderiza el HTML; si devuelve otra cosa (p. ej. una
+    redirección) se responde tal cual sin cachear.
+    """
+    if not _es_anonimo():
+        return generar()
+
+    clave = (pagina, barberia_id, version_catalogo(barberia_id), 'anonimo')
+    entrada = _cache_paginas.obtener(clave)
+    if entrada is None:
+        html = generar()
+        if not isinstance(html, str):
+            return html
+        etag = hashlib.sha1(html.encode('utf-8')).hexdigest()[:20]
+        entrada = (etag, html)
+        _cache_paginas.guardar(clave, entrada)
+
+    etag, html = entrada
+    response = make_response(html)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'  # revalidar siempre con If-None-Match
+    response.vary.add('Cookie')
+    return response.make_conditional(request)
@@ -0,0 +1,1101 @@
+# Catálogo central de sentencias SQL.
+#
+# Cada sentencia se registra una sola vez con un nombre, la forma fija de sus
+# parámetros y las columnas que devuelve. El texto nunca se arma por
+# concatenación según los filtros, así que SQL Server reutiliza un único plan
+# por sentencia; cada conexión del pool la prepara una vez y la reutiliza (ver
+# get_db_connection en app/database.py), y las métricas se agrupan por nombre.
+#
+# Las sentencias sobre citas que pueden necesitar el histórico archivado se
+# registran dos veces con registrar_con_historico(): `nombre` lee solo de
+# Citas y `nombre_historico` de Citas UNION ALL Citas_Historico.
+
+TABLA_HISTORICO = 'Citas_Historico'
+CITAS_CON_HISTORICO = f'(SELECT * FROM Citas UNION ALL SELECT * FROM {TABLA_HISTORICO})'
+
+
+class Consulta:
+    """Sentencia registrada en el catálogo"""
+
+    def __init__(self, nombre, sql, parametros=(), columnas=()):
+        self.nombre = nombre
+        self.sql = sql
+        self.parametros = tuple(parametros)
+        self.columnas = tuple(columnas)
+
+    @property
+    def es_lectura(self):
+        return self.sql.lstrip().upper().startswith(('SELECT', 'WITH'))
+
+    def validar_parametros(self, valores):
+        if len(valores) != len(self.parametros):
+            raise ValueError(f"La consulta '{self.nombre}' espera {len(self.parametros)} "
+                             f"parámetros {self.parametros}, recibió {len(valores)}")
+
+    def fila_a_dict(self, row):
+        return dict(zip(self.columnas, row)) if row is not None else None
+
+
+_catalogo = {}
+
+
+def registrar(nombre, sql, parametros=(), columnas=()):
+    """Registra una sentencia. Registrar el mismo nombre con otro SQL es un error."""
+    existente = _catalogo.get(nombre)
+    if existente is not None:
+        if existente.sql != sql:
+            raise ValueError(f"La consulta '{nombre}' ya está registrada con otro SQL")
+        return existente
+    consulta = _catalogo[nombre] = Consulta(nombre, sql, parametros, columnas)
+    return consulta
+
+
+def registrar_con_historico(nombre, plantilla, parametros=(), columnas=()):
+    """Registra `nombre` (solo Citas) y `nombre_historico` (con el histórico); usar {citas} en la plantilla"""
+    registrar(nombre, plantilla.format(citas='Citas'), parametros, columnas)
+    registrar(f'{nombre}_historico', plantilla.format(citas=CITAS_CON_HISTORICO), parametros, columnas)
+
+
+def obtener(nombre):
+    """Devuelve la consulta registrada con ese nombre"""
+    try:
+        return _catalogo[nombre]
+    except KeyError:
+        raise KeyError(f"La consulta '{nombre}' no está registrada en el catálogo") from None
+
+
+def catalogo():
+    """Devuelve todas las consultas registradas, por nombre"""
+    return dict(_catalogo)
+
+
+# --- GENERALES ---
+
+# Los INSERT que necesitan el id generado lo devuelven ellos mismos con
+# OUTPUT ... INTO: @@IDENTITY devolvería el de una inserción hecha por un
+# trigger, y SCOPE_IDENTITY() en otra sentencia ya está fuera de su ámbito
+
+registrar('existe_tabla', "SELECT OBJECT_ID(?, 'U')", ('tabla',), ('object_id',))
+
+registrar('existe_columna', "SELECT COL_LENGTH(?, ?)", ('tabla', 'columna'), ('longitud',))
+
+
+# --- USUARIOS ---
+
+_COLUMNAS_USUARIO = ('id', 'email', 'password_hash', 'nombre', 'apellido', 'telefono',
+                     'foto_perfil', 'rol_id', 'activo', 'fecha_registro', 'ultimo_acceso',
+                     'rol_nombre')
+
+registrar('usuario_crear', """
+    SET NOCOUNT ON;
+    DECLARE @creado TABLE (id INT);
+    INSERT INTO Usuarios (email, password_hash, nombre, apellido, telefono, rol_id)
+    OUTPUT inserted.id INTO @creado
+    VALUES (?, ?, ?, ?, ?, ?);
+    SELECT id FROM @creado;
+""", ('email', 'password_hash', 'nombre', 'apellido', 'telefono', 'rol_id'), ('id',))
+
+registrar('usuario_por_email', """
+    SELECT u.id, u.email, u.password_hash, u.nombre, u.apellido,
+           u.telefono, u.foto_perfil, u.rol_id, u.activo,
+           u.fecha_registro, u.ultimo_acceso, r.nombre as rol_nombre
+    FROM Usuarios u
+    INNER JOIN Roles r ON u.rol_id = r.id
+    WHERE u.email = ?
+""", ('email',), _COLUMNAS_USUARIO)
+
+registrar('usuario_por_id', """
+    SELECT u.id, u.email, u.password_hash, u.nombre, u.apellido,
+           u.telefono, u.foto_perfil, u.rol_id, u.activo,
+           u.fecha_registro, u.ultimo_acceso, r.nombre as rol_nombre
+    FROM Usuarios u
+    INNER JOIN Roles r ON u.rol_id = r.id
+    WHERE u.id = ?
+""", ('usuario_id',), _COLUMNAS_USUARIO)
+
+registrar('usuario_actualizar_acceso',
+          "UPDATE Usuarios SET ultimo_acceso = GETDATE() WHERE id = ?",
+          ('usuario_id',))
+
+
+# --- ROLES ---
+
+registrar('rol_por_nombre',
+          "SELECT id, nombre, descripcion FROM Roles WHERE nombre = ?",
+          ('nombre_rol',), ('id', 'nombre', 'descripcion'))
+
+
+# --- BARBERÍAS ---
+
+registrar('barberias_activas', """
+    SELECT b.id, b.nombre, b.direccion, b.ciudad, b.telefono,
+           b.email, b.logo, b.descripcion, b.hora_apertura, b.hora_cierre,
+           u.nombre + ' ' + u.apellido as propietario
+    FROM Barberias b
+    INNER JOIN Usuarios u ON b.propietario_id = u.id
+    WHERE b.activo = 1
+    ORDER BY b.nombre
+""", (), ('id', 'nombre', 'direccion', 'ciudad', 'telefono', 'email', 'logo',
+          'descripcion', 'hora_apertura', 'hora_cierre', 'propietario'))
+
+registrar('barberia_por_id', """
+    SELECT b.id, b.nombre, b.direccion, b.ciudad, b.telefono,
+           b.email, b.logo, b.descripcion, b.hora_apertura, b.hora_cierre,
+           b.propietario_id
+    FROM Barberias b
+    WHERE b.id = ? AND b.activo = 1
+""", ('barberia_id',), ('id', 'nombre', 'direccion', 'ciudad', 'telefono', 'email', 'logo',
+                        'descripcion', 'hora_apertura', 'hora_cierre', 'propietario_id'))
+
+registrar('barberias_por_propietario', """
+    SELECT b.id, b.nombre, b.ciudad
+    FROM Barberias b
+    WHERE b.propietario_id = ? AND b.activo = 1
+    ORDER BY b.nombre
+""", ('propietario_id',), ('id', 'nombre', 'ciudad'))
+
+# Una fila por servicio activo (o una sola sin servicio) de cada barbería
+# activa, todas o las de la lista de ids; alimenta el índice de app/busqueda.py.
+# La variante sin ubicación sirve mientras no se aplique la migración 6.
+_BUSQUEDA_DOCUMENTOS = """
+    SELECT b.id, b.nombre, b.direccion, b.ciudad, b.telefono, b.descripcion,
+           b.hora_apertura, b.hora_cierre, {ubicacion},
+           s.nombre as servicio, s.precio, c.nombre as categoria
+    FROM Barberias b
+    LEFT JOIN Servicios s ON s.barberia_id = b.id AND s.activo = 1
+    LEFT JOIN Categorias_Servicios c ON s.categoria_id = c.id
+    WHERE b.activo = 1
+      AND (? IS NULL OR b.id IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(?, ',')))
+    ORDER BY b.id
+"""
+_COLUMNAS_BUSQUEDA = ('id', 'nombre', 'direccion', 'ciudad', 'telefono', 'descripcion', 'hora_apertura',
+                      'hora_cierre', 'latitud', 'longitud', 'servicio', 'precio', 'categoria')
+registrar('busqueda_documentos', _BUSQUEDA_DOCUMENTOS.format(ubicacion='b.latitud, b.longitud'),
+          ('barberia_ids', 'barberia_ids'), _COLUMNAS_BUSQUEDA)
+registrar('busqueda_documentos_sin_ubicacion',
+          _BUSQUEDA_DOCUMENTOS.format(ubicacion='NULL as latitud, NULL as longitud'),
+          ('barberia_ids', 'barberia_ids'), _COLUMNAS_BUSQUEDA)
+
+registrar('barberia_ubicacion', """
+    SELECT latitud, longitud FROM Barberias WHERE id = ?
+""", ('barberia_id',), ('latitud', 'longitud'))
+
+registrar('barberia_ubicacion_actualizar', """
+    UPDATE Barberias SET latitud = ?, longitud = ? WHERE id = ?
+""", ('latitud', 'longitud', 'barberia_id'))
+
+
+# --- SERVICIOS ---
+
+registrar('servicios_por_barberia', """
+    SELECT s.id, s.nombre, s.descripcion, s.precio, s.duracion_minutos,
+           s.imagen, c.nombre as categoria, c.icono
+    FROM Servicios s
+    INNER JOIN Categorias_Servicios c ON s.categoria_id = c.id
+    WHERE s.barberia_id = ? AND s.activo = 1
+    ORDER BY c.orden, s.nombre
+""", ('barberia_id',), ('id', 'nombre', 'descripcion', 'precio', 'duracion_minutos',
+                        'imagen', 'categoria', 'icono'))
+
+registrar('servicio_por_id', """
+    SELECT s.id, s.barberia_id, s.nombre, s.descripcion, s.precio,
+           s.duracion_minutos, s.imagen
+    FROM Servicios s
+    WHERE s.id = ? AND s.activo = 1
+""", ('servicio_id',), ('id', 'barberia_id', 'nombre', 'descripcion', 'precio',
+                        'duracion_minutos', 'imagen'))
+
+
+# --- BARBEROS ---
+
+registrar('barberos_por_barberia', """
+    SELECT b.id, u.nombre, u.apellido, u.foto_perfil,
+           b.especialidad, b.años_experiencia, b.calificacion_promedio,
+           b.total_servicios
+    FROM Barberos b
+    INNER JOIN Usuarios u ON b.usuario_id = u.id
+    WHERE b.barberia_id = ? AND b.activo = 1
+    ORDER BY b.calificacion_promedio DESC
+""", ('barberia_id',), ('id', 'nombre', 'apellido', 'foto_perfil', 'especialidad',
+                        'años_experiencia', 'calificacion_promedio', 'total_servicios'))
+
+registrar('barberia_de_barbero',
+          "SELECT barberia_id FROM Barberos WHERE id = ?",
+          ('barbero_id',), ('barberia_id',))
+
+registrar('barbero_por_usuario', """
+    SELECT b.id, b.usuario_id, b.barberia_id, b.especialidad,
+           b.años_experiencia, b.calificacion_promedio, b.total_servicios,
+           bar.nombre as barberia_nombre
+    FROM Barberos b
+    INNER JOIN Barberias bar ON b.barberia_id = bar.id
+    WHERE b.usuario_id = ? AND b.activo = 1
+""", ('usuario_id',), ('id', 'usuario_id', 'barberia_id', 'especialidad', 'años_experiencia',
+                       'calificacion_promedio', 'total_servicios', 'barberia_nombre'))
+
+
+# --- CITAS ---
+
+# Solapes con un hueco [hora_inicio, hora_fin) de un barbero. UPDLOCK y
+# HOLDLOCK bloquean el rango aunque esté vacío: dos reservas del mismo hueco
+# se serializan y la segunda ya ve la primera.
+_CITA_SOLAPADA = """
+    SELECT 1 FROM Citas WITH (UPDLOCK, HOLDLOCK)
+    WHERE barbero_id = ? AND fecha = ? AND estado_id IN (1, 2)
+      AND hora_inicio < ? AND hora_fin > ?
+"""
+_RESERVA_SOLAPADA = """
+    SELECT 1 FROM Reservas_Temporales WITH (UPDLOCK, HOLDLOCK)
+    WHERE barbero_id = ? AND fecha = ? AND cliente_id <> ? AND expira > SYSDATETIME()
+      AND hora_inicio < ? AND hora_fin > ?
+"""
+_PARAMS_CITA_SOLAPADA = ('barbero_id', 'fecha', 'hora_fin', 'hora_inicio')
+_PARAMS_RESERVA_SOLAPADA = ('barbero_id', 'fecha', 'cliente_id', 'hora_fin', 'hora_inicio')
+
+_SQL_CITA_CREAR = """
+    SET NOCOUNT ON;
+    DECLARE @creada TABLE (id INT);
+    INSERT INTO Citas (cliente_id, barbero_id, servicio_id, fecha,
+                      hora_inicio, hora_fin, estado_id, precio_final, notas_cliente)
+    OUTPUT inserted.id INTO @creada
+    SELECT ?, ?, ?, ?, ?, ?, 1, ?, ?
+    WHERE NOT EXISTS ({citas}){reservas};
+    SELECT id FROM @creada;
+"""
+_PARAMS_CITA_CREAR = ('cliente_id', 'barbero_id', 'servicio_id', 'fecha', 'hora_inicio', 'hora_fin',
+                      'precio_final', 'notas_cliente')
+
+# Devuelve el id de la cita creada; sin filas = el hueco ya no está libre
+registrar('cita_crear', _SQL_CITA_CREAR.format(
+    citas=_CITA_SOLAPADA, reservas=f"\n      AND NOT EXISTS ({_RESERVA_SOLAPADA})"),
+    _PARAMS_CITA_CREAR + _PARAMS_CITA_SOLAPADA + _PARAMS_RESERVA_SOLAPADA, ('id',))
+registrar('cita_crear_sin_reservas', _SQL_CITA_CREAR.format(citas=_CITA_SOLAPADA, reservas=''),
+          _PARAMS_CITA_CREAR + _PARAMS_CITA_SOLAPADA, ('id',))
+
+# Varias fechas a la misma hora (series): se insertan las que están libres y
+# se devuelven las creadas
+_SQL_CITAS_CREAR_FECHAS = """
+    SET NOCOUNT ON;
+    DECLARE @creadas TABLE (id INT, fecha DATE);
+    INSERT INTO Citas (cliente_id, barbero_id, servicio_id, fecha,
+                      hora_inicio, hora_fin, estado_id, precio_final, notas_cliente)
+    OUTPUT inserted.id, inserted.fecha INTO @creadas
+    SELECT ?, ?, ?, f.fecha, ?, ?, 1, ?, ?
+    FROM (SELECT CAST(value AS DATE) AS fecha FROM STRING_SPLIT(?, ',')) f
+    WHERE NOT EXISTS (
+        SELECT 1 FROM Citas c WITH (UPDLOCK, HOLDLOCK)
+        WHERE c.barbero_id = ? AND c.fecha = f.fecha AND c.estado_id IN (1, 2)
+          AND c.hora_inicio < ? AND c.hora_fin > ?){reservas};
+    SELECT id, fecha FROM @creadas;
+"""
+_PARAMS_CITAS_CREAR_FECHAS = ('cliente_id', 'barbero_id', 'servicio_id', 'hora_inicio', 'hora_fin',
+                              'precio_final', 'notas_cliente', 'fechas', 'barbero_id', 'hora_fin', 'hora_inicio')
+
+registrar('citas_crear_fechas', _SQL_CITAS_CREAR_FECHAS.format(reservas="""
+      AND NOT EXISTS (
+        SELECT 1 FROM Reservas_Temporales r WITH (UPDLOCK, HOLDLOCK)
+        WHERE r.barbero_id = ? AND r.fecha = f.fecha AND r.cliente_id <> ? AND r.expira > SYSDATETIME()
+          AND r.hora_inicio < ? AND r.hora_fin > ?)"""),
+    _PARAMS_CITAS_CREAR_FECHAS + ('barbero_id', 'cliente_id', 'hora_fin', 'hora_inicio'), ('id', 'fecha'))
+registrar('citas_crear_fechas_sin_reservas', _SQL_CITAS_CREAR_FECHAS.format(reservas=''),
+          _PARAMS_CITAS_CREAR_FECHAS, ('id', 'fecha'))
+
+registrar('cita_solapada', """
+    SELECT TOP (1) 1 FROM Citas
+    WHERE barbero_id = ? AND fecha = ? AND estado_id IN (1, 2)
+      AND hora_inicio < ? AND hora_fin > ?
+""", _PARAMS_CITA_SOLAPADA, ('solapada',))
+
+registrar_con_historico('citas_por_cliente', """
+    SELECT c.id, c.fecha, c.hora_inicio, c.hora_fin,
+           s.nombre as servicio, s.precio,
+           u.nombre + ' ' + u.apellido as barbero,
+           bar.nombre as barberia,
+           e.nombre as estado, e.color as estado_color
+    FROM {citas} c
+    INNER JOIN Servicios s ON c.servicio_id = s.id
+    INNER JOIN Barberos b ON c.barbero_id = b.id
+    INNER JOIN Usuarios u ON b.usuario_id = u.id
+    INNER JOIN Barberias bar ON s.barberia_id = bar.id
+    INNER JOIN Estados_Citas e ON c.estado_id = e.id
+    WHERE c.cliente_id = ? AND c.fecha >= ?
+    ORDER BY c.fecha DESC, c.hora_inicio DESC
+""", ('cliente_id', 'desde'), ('id', 'fecha', 'hora_inicio', 'hora_fin', 'servicio', 'precio',
+                               'barbero', 'barberia', 'estado', 'estado_color'))
+
+registrar('dia_semana', "SELECT DATEPART(WEEKDAY, ?)", ('fecha',), ('dia_semana',))
+
+registrar('citas_ocupadas', """
+    SELECT hora_inicio, hora_fin
+    FROM Citas
+    WHERE barbero_id = ? AND fecha = ? AND estado_id IN (1, 2)
+    ORDER BY hora_inicio
+""", ('barbero_id', 'fecha'), ('hora_inicio', 'hora_fin'))
+
+registrar('citas_ocupadas_barberia_rango', """
+    SELECT c.barbero_id, c.fecha, c.hora_inicio, c.hora_fin
+    FROM Citas c
+    INNER JOIN Barberos b ON c.barbero_id = b.id
+    WHERE b.barberia_id = ? AND c.fecha BETWEEN ? AND ? AND c.estado_id IN (1, 2)
+""", ('barberia_id', 'desde', 'hasta'), ('barbero_id', 'fecha', 'hora_inicio', 'hora_fin'))
+
+registrar('citas_ocupadas_barberias_dia', """
+    SELECT c.barbero_id, c.hora_inicio, c.hora_fin
+    FROM Citas c
+    INNER JOIN Barberos b ON c.barbero_id = b.id
+    WHERE c.fecha = ? AND c.estado_id IN (1, 2)
+      AND b.barberia_id IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(?, ','))
+    ORDER BY c.barbero_id, c.hora_inicio
+""", ('fecha', 'barberia_ids'), ('barbero_id', 'hora_inicio', 'hora_fin'))
+
+# --- HORARIOS Y CALENDARIO ---
+#
+# Todas filtran por una lista de barberos o por una lista de barberías (ids
+# separados por comas; la que no se use va en NULL y STRING_SPLIT no devuelve
+# nada). De una barbería solo cuentan sus barberos activos.
+
+_FILTRO_BARBEROS = """(b.id IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(?, ','))
+           OR (b.activo = 1 AND b.barberia_id IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(?, ','))))"""
+
+registrar('horarios_semana', f"""
+    SELECT b.barberia_id, hb.barbero_id, hb.dia_semana, hb.hora_inicio, hb.hora_fin
+    FROM Horarios_Barberos hb
+    INNER JOIN Barberos b ON hb.barbero_id = b.id
+    WHERE hb.activo = 1 AND {_FILTRO_BARBEROS}
+""", ('barbero_ids', 'barberia_ids'), ('barberia_id', 'barbero_id', 'dia_semana', 'hora_inicio', 'hora_fin'))
+
+# Una fila por barbero afectado (las de toda la barbería se repiten por cada uno)
+registrar('excepciones_rango', f"""
+    SELECT b.barberia_id, b.id as barbero_id, e.tipo, e.fecha_desde, e.fecha_hasta, e.hora_inicio, e.hora_fin
+    FROM Excepciones_Horario e
+    INNER JOIN Barberos b ON b.id = e.barbero_id OR (e.barbero_id IS NULL AND b.barberia_id = e.barberia_id)
+    WHERE e.fecha_desde <= ? AND e.fecha_hasta >= ? AND {_FILTRO_BARBEROS}
+    ORDER BY e.id
+""", ('hasta', 'desde', 'barbero_ids', 'barberia_ids'),
+    ('barberia_id', 'barbero_id', 'tipo', 'fecha_desde', 'fecha_hasta', 'hora_inicio', 'hora_fin'))
+
+# Tramos materializados y hasta dónde está generado el calendario de cada
+# barbero (hasta = NULL: nunca se generó), para saber si hay que recurrir
+# a las reglas semanales
+registrar('calendario_rango', f"""
+    SELECT b.barberia_id, b.id as barbero_id, g.hasta, c.fecha, c.hora_inicio, c.hora_fin
+    FROM Barberos b
+    LEFT JOIN Calendario_Generado g ON g.barbero_id = b.id
+    LEFT JOIN Calendario_Barberos c ON c.barbero_id = b.id AND c.fecha BETWEEN ? AND ?
+    WHERE {_FILTRO_BARBEROS}
+""", ('desde', 'hasta', 'barbero_ids', 'barberia_ids'),
+    ('barberia_id', 'barbero_id', 'hasta', 'fecha', 'hora_inicio', 'hora_fin'))
+
+# HOLDLOCK bloquea el rango aunque esté vacío: una segunda regeneración de los
+# mismos barberos espera al commit de la primera y borra lo que esta insertó
+registrar('calendario_borrar_rango', """
+    DELETE FROM Calendario_Barberos WITH (HOLDLOCK)
+    WHERE fecha BETWEEN ? AND ?
+      AND barbero_id IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(?, ','))
+""", ('desde', 'hasta', 'barbero_ids'))
+
+registrar('calendario_insertar', """
+    INSERT INTO Calendario_Barberos (barbero_id, fecha, hora_inicio, hora_fin)
+    VALUES (?, ?, ?, ?)
+""", ('barbero_id', 'fecha', 'hora_inicio', 'hora_fin'))
+
+registrar('calendario_marcar_generado', """
+    MERGE Calendario_Generado WITH (HOLDLOCK) AS g
+    USING (SELECT CAST(value AS INT) AS barbero_id FROM STRING_SPLIT(?, ',')) AS a
+    ON g.barbero_id = a.barbero_id
+    WHEN MATCHED AND g.hasta < ? THEN UPDATE SET hasta = ?
+    WHEN NOT MATCHED THEN INSERT (barbero_id, hasta) VALUES (a.barbero_id, ?);
+""", ('barbero_ids', 'hasta', 'hasta', 'hasta'))
+
+# El calendario nuevo cambia la disponibilidad de todos sus días: se sube la
+# versión del horario semanal (fila 1900-01-01), que entra en todos los ETag
+registrar('versiones_agenda_subir_horario', """
+    MERGE Versiones_Agenda WITH (HOLDLOCK) AS v
+    USING (SELECT CAST(value AS INT) AS barbero_id FROM STRING_SPLIT(?, ',')) AS a
+    ON v.barbero_id = a.barbero_id AND v.fecha = '19000101'
+    WHEN MATCHED THEN UPDATE SET version = v.version + 1
+    WHEN NOT MATCHED THEN INSERT (barbero_id, fecha, version) VALUES (a.barbero_id, '19000101', 1);
+""", ('barbero_ids',))
+
+registrar('calendario_pendientes', """
+    SELECT barbero_id, desde, marca FROM Calendario_Pendientes
+""", (), ('barbero_id', 'desde', 'marca'))
+
+registrar('calendario_pendiente_borrar', """
+    DELETE FROM Calendario_Pendientes WHERE barbero_id = ? AND marca = ?
+""", ('barbero_id', 'marca'))
+
+# Barberos activos cuyo calendario no llega hasta el horizonte
+registrar('calendario_atrasados', """
+    SELECT TOP (?) b.id as barbero_id, g.hasta
+    FROM Barberos b
+    LEFT JOIN Calendario_Generado g ON g.barbero_id = b.id
+    WHERE b.activo = 1 AND (g.hasta IS NULL OR g.hasta < ?)
+    ORDER BY b.id
+""", ('lote', 'horizonte'), ('barbero_id', 'hasta'))
+
+registrar('calendario_purgar', """
+    DELETE TOP (?) FROM Calendario_Barberos WHERE fecha < ?
+""", ('lote', 'hasta'))
+
+registrar('excepciones_por_barberia', """
+    SELECT e.id, e.barbero_id, u.nombre + ' ' + u.apellido as barbero, e.tipo,
+           e.fecha_desde, e.fecha_hasta, e.hora_inicio, e.hora_fin, e.motivo
+    FROM Excepciones_Horario e
+    LEFT JOIN Barberos b ON e.barbero_id = b.id
+    LEFT JOIN Usuarios u ON b.usuario_id = u.id
+    WHERE e.barberia_id = ? AND e.fecha_hasta >= ?
+    ORDER BY e.fecha_desde, e.id
+""", ('barberia_id', 'desde'), ('id', 'barbero_id', 'barbero', 'tipo', 'fecha_desde', 'fecha_hasta',
+                                'hora_inicio', 'hora_fin', 'motivo'))
+
+registrar('excepcion_crear', """
+    INSERT INTO Excepciones_Horario (barberia_id, barbero_id, fecha_desde, fecha_hasta, tipo,
+                                     hora_inicio, hora_fin, motivo)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+""", ('barberia_id', 'barbero_id', 'fecha_desde', 'fecha_hasta', 'tipo', 'hora_inicio', 'hora_fin', 'motivo'))
+
+registrar('excepcion_eliminar', """
+    DELETE FROM Excepciones_Horario WHERE id = ? AND barberia_id = ?
+""", ('excepcion_id', 'barberia_id'))
+
+# --- RESERVAS TEMPORALES ---
+#
+# Retenciones de un hueco mientras el cliente confirma (migración 8). Las
+# vencidas se ignoran hasta que reservas_temporales_purgar las borra.
+
+# Retiene el hueco si nadie lo ocupa; devuelve los (barbero, fecha) que
+# cambiaron, retenida = 1 el nuevo. Las de tipo 'reserva' sueltan antes la
+# retención anterior del cliente; las ofertas de la lista de espera no
+# (migración 14; sin ella todas son del primer tipo).
+_SQL_RESERVA_TEMPORAL_CREAR = f"""
+    SET NOCOUNT ON;
+    DECLARE @cambios TABLE (barbero_id INT, fecha DATE, retenida BIT);{{soltar}}
+    INSERT INTO Reservas_Temporales (token, cliente_id, barbero_id, fecha, hora_inicio, hora_fin, expira{{tipo}})
+    OUTPUT inserted.barbero_id, inserted.fecha, 1 INTO @cambios
+    SELECT ?, ?, ?, ?, ?, ?, DATEADD(SECOND, ?, SYSDATETIME()){{valor_tipo}}
+    WHERE NOT EXISTS ({_CITA_SOLAPADA})
+      AND NOT EXISTS ({_RESERVA_SOLAPADA});
+    SELECT barbero_id, fecha, retenida FROM @cambios;
+"""
+_SOLTAR_RESERVA_CLIENTE = """
+    DELETE FROM Reservas_Temporales
+    OUTPUT deleted.barbero_id, deleted.fecha, 0 INTO @cambios
+    WHERE cliente_id = ?{tipo};"""
+_PARAMS_RESERVA_TEMPORAL_CREAR = (('token', 'cliente_id', 'barbero_id', 'fecha', 'hora_inicio', 'hora_fin',
+                                   'ttl_segundos') + _PARAMS_CITA_SOLAPADA + _PARAMS_RESERVA_SOLAPADA)
+
+registrar('reserva_temporal_crear', _SQL_RESERVA_TEMPORAL_CREAR.format(
+    soltar=_SOLTAR_RESERVA_CLIENTE.format(tipo=" AND tipo = 'reserva'"), tipo='', valor_tipo=''),
+    ('cliente_id',) + _PARAMS_RESERVA_TEMPORAL_CREAR, ('barbero_id', 'fecha', 'retenida'))
+registrar('reserva_temporal_crear_sin_tipo', _SQL_RESERVA_TEMPORAL_CREAR.format(
+    soltar=_SOLTAR_RESERVA_CLIENTE.format(tipo=''), tipo='', valor_tipo=''),
+    ('cliente_id',) + _PARAMS_RESERVA_TEMPORAL_CREAR, ('barbero_id', 'fecha', 'retenida'))
+registrar('reserva_temporal_ofrecer', _SQL_RESERVA_TEMPORAL_CREAR.format(
+    soltar='', tipo=', tipo', valor_tipo=", 'oferta'"),
+    _PARAMS_RESERVA_TEMPORAL_CREAR, ('barbero_id', 'fecha', 'retenida'))
+
+registrar('reserva_temporal_de_cliente', """
+    SELECT TOP 1 token FROM Reservas_Temporales
+    WHERE cliente_id = ? AND tipo = 'reserva' AND expira > SYSDATETIME()
+""", ('cliente_id',), ('token',))
+
+registrar('reserva_temporal_consumir', """
+    DELETE FROM Reservas_Temporales WHERE token = ? AND cliente_id = ?
+""", ('token', 'cliente_id'))
+
+registrar('reserva_temporal_soltar', """
+    SET NOCOUNT ON;
+    DECLARE @soltadas TABLE (barbero_id INT, fecha DATE);
+    DELETE FROM Reservas_Temporales
+    OUTPUT deleted.barbero_id, deleted.fecha INTO @soltadas
+    WHERE token = ? AND cliente_id = ?;
+    SELECT barbero_id, fecha FROM @soltadas;
+""", ('token', 'cliente_id'), ('barbero_id', 'fecha'))
+
+registrar('reservas_temporales_rango', f"""
+    SELECT r.barbero_id, r.fecha, r.hora_inicio, r.hora_fin
+    FROM Reservas_Temporales r
+    INNER JOIN Barberos b ON r.barbero_id = b.id
+    WHERE r.fecha BETWEEN ? AND ? AND r.expira > SYSDATETIME() AND r.cliente_id <> ?
+      AND {_FILTRO_BARBEROS}
+""", ('desde', 'hasta', 'excepto_cliente', 'barbero_ids', 'barberia_ids'),
+    ('barbero_id', 'fecha', 'hora_inicio', 'hora_fin'))
+
+# Por el índice de `expira`: solo toca las vencidas
+registrar('reservas_temporales_purgar', """
+    SET NOCOUNT ON;
+    DECLARE @borradas TABLE (barbero_id INT, fecha DATE);
+    DELETE TOP (?) FROM Reservas_Temporales
+    OUTPUT deleted.barbero_id, deleted.fecha INTO @borradas
+    WHERE expira <= SYSDATETIME();
+    SELECT barbero_id, fecha, COUNT(*) FROM @borradas GROUP BY barbero_id, fecha;
+""", ('lote',), ('barbero_id', 'fecha', 'borradas'))
+
+# --- SERIES DE CITAS ---
+
+registrar('serie_crear', """
+    SET NOCOUNT ON;
+    DECLARE @creada TABLE (id INT);
+    INSERT INTO Series_Citas (cliente_id, barbero_id, servicio_id, fecha_inicio, fecha_fin, cada_semanas,
+                              hora_inicio, hora_fin, precio_final, notas_cliente, generada_hasta, creadas, activa)
+    OUTPUT inserted.id INTO @creada
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?);
+    SELECT id FROM @creada;
+""", ('cliente_id', 'barbero_id', 'servicio_id', 'fecha_inicio', 'fecha_fin', 'cada_semanas',
+      'hora_inicio', 'hora_fin', 'precio_final', 'notas_cliente', 'generada_hasta', 'creadas', 'activa'), ('id',))
+
+_COLUMNAS_SERIE = ('id', 'cliente_id', 'barbero_id', 'servicio_id', 'fecha_inicio', 'fecha_fin', 'cada_semanas',
+                   'hora_inicio', 'hora_fin', 'precio_final', 'notas_cliente', 'generada_hasta')
+
+registrar('series_pendientes', """
+    SELECT TOP (?) id, cliente_id, barbero_id, servicio_id, fecha_inicio, fecha_fin, cada_semanas,
+           hora_inicio, hora_fin, precio_final, notas_cliente, generada_hasta
+    FROM Series_Citas
+    WHERE activa = 1 AND generada_hasta < ?
+    ORDER BY generada_hasta
+""", ('lote', 'horizonte'), _COLUMNAS_SERIE)
+
+registrar('serie_avanzar', """
+    UPDATE Series_Citas
+    SET generada_hasta = ?, creadas = creadas + ?, omitidas = omitidas + ?, activa = ?
+    WHERE id = ? AND activa = 1
+""", ('generada_hasta', 'creadas', 'omitidas', 'activa', 'serie_id'))
+
+registrar('series_por_cliente', """
+    SELECT s.id, s.fecha_inicio, s.fecha_fin, s.cada_semanas, s.hora_inicio, s.generada_hasta,
+           s.creadas, s.omitidas, u.nombre + ' ' + u.apellido as barbero, sv.nombre as servicio,
+           bb.nombre as barberia
+    FROM Series_Citas s
+    INNER JOIN Barberos b ON s.barbero_id = b.id
+    INNER JOIN Usuarios u ON b.usuario_id = u.id
+    INNER JOIN Servicios sv ON s.servicio_id = sv.id
+    INNER JOIN Barberias bb ON b.barberia_id = bb.id
+    WHERE s.cliente_id = ? AND s.activa = 1
+    ORDER BY s.fecha_inicio
+""", ('cliente_id',), ('id', 'fecha_inicio', 'fecha_fin', 'cada_semanas', 'hora_inicio', 'generada_hasta',
+                       'creadas', 'omitidas', 'barbero', 'servicio', 'barberia'))
+
+registrar('serie_detener', """
+    UPDATE Series_Citas SET activa = 0 WHERE id = ? AND cliente_id = ? AND activa = 1
+""", ('serie_id', 'cliente_id'))
+
+# --- LISTA DE ESPERA ---
+
+registrar('espera_crear', """
+    SET NOCOUNT ON;
+    DECLARE @creada TABLE (id INT);
+    INSERT INTO Lista_Espera (cliente_id, barberia_id, barbero_id, servicio_id, fecha_desde, fecha_hasta)
+    OUTPUT inserted.id INTO @creada
+    VALUES (?, ?, ?, ?, ?, ?);
+    SELECT id FROM @creada;
+""", ('cliente_id', 'barberia_id', 'barbero_id', 'servicio_id', 'fecha_desde', 'fecha_hasta'), ('id',))
+
+registrar('espera_dia_insertar', """
+    INSERT INTO Lista_Espera_Dias (barberia_id, fecha, espera_id) VALUES (?, ?, ?)
+""", ('barberia_id', 'fecha', 'espera_id'))
+
+# Búsqueda en la clave de Lista_Espera_Dias; el id da el orden de llegada
+registrar('espera_candidatos', """
+    SELECT TOP (?) e.id, e.cliente_id, e.servicio_id, s.duracion_minutos, s.precio
+    FROM Lista_Espera_Dias d
+    INNER JOIN Lista_Espera e ON e.id = d.espera_id
+    INNER JOIN Servicios s ON s.id = e.servicio_id
+    WHERE d.barberia_id = ? AND d.fecha = ? AND e.estado = 'activa'
+      AND (e.barbero_id IS NULL OR e.barbero_id = ?)
+      AND s.duracion_minutos <= ?
+      AND e.id NOT IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(?, ','))
+      -- Una retención por cliente: quien ya tiene un hueco ofrecido espera a decidir
+      AND NOT EXISTS (SELECT 1 FROM Lista_Espera o WHERE o.cliente_id = e.cliente_id AND o.estado = 'ofrecida')
+    ORDER BY d.espera_id
+""", ('limite', 'barberia_id', 'fecha', 'barbero_id', 'duracion_minutos', 'excluir'),
+    ('id', 'cliente_id', 'servicio_id', 'duracion_minutos', 'precio'))
+
+registrar('espera_ofrecer', """
+    UPDATE Lista_Espera
+    SET estado = 'ofrecida', oferta_barbero_id = ?, oferta_fecha = ?, oferta_hora_inicio = ?,
+        oferta_hora_fin = ?, oferta_token = ?, oferta_expira = DATEADD(SECOND, ?, SYSDATETIME())
+    WHERE id = ? AND estado = 'activa'
+""", ('barbero_id', 'fecha', 'hora_inicio', 'hora_fin', 'token', 'ttl_segundos', 'espera_id'))
+
+_COLUMNAS_OFERTA = ('id', 'oferta_barbero_id', 'oferta_fecha', 'oferta_hora_inicio', 'oferta_hora_fin')
+
+registrar('esperas_ofertas_vencidas', """
+    SELECT TOP (?) id, oferta_barbero_id, oferta_fecha, oferta_hora_inicio, oferta_hora_fin
+    FROM Lista_Espera
+    WHERE estado = 'ofrecida' AND oferta_expira <= SYSDATETIME()
+""", ('lote',), _COLUMNAS_OFERTA)
+
+# Vuelve a la cola; la condición evita pisar una aceptación simultánea
+registrar('espera_reactivar', """
+    UPDATE Lista_Espera
+    SET estado = 'activa', oferta_token = NULL, oferta_expira = NULL
+    WHERE id = ? AND estado = 'ofrecida' AND oferta_expira <= SYSDATETIME()
+""", ('espera_id',))
+
+# Sin triggers en Lista_Espera, así que OUTPUT puede ir sin INTO
+registrar('espera_cerrar', """
+    UPDATE Lista_Espera
+    SET estado = ?
+    OUTPUT deleted.id, deleted.oferta_barbero_id, deleted.oferta_fecha, deleted.oferta_hora_inicio,
+           deleted.oferta_hora_fin, deleted.oferta_token, deleted.estado
+    WHERE id = ? AND cliente_id = ? AND estado IN ('activa', 'ofrecida')
+""", ('estado', 'espera_id', 'cliente_id'), _COLUMNAS_OFERTA + ('oferta_token', 'estado'))
+
+# Al aceptar una oferta, en la transacción de la cita: solo si sigue ofrecida con ese token
+registrar('espera_atender', """
+    UPDATE Lista_Espera
+    SET estado = 'atendida'
+    WHERE id = ? AND cliente_id = ? AND estado = 'ofrecida' AND oferta_token = ?
+""", ('espera_id', 'cliente_id', 'oferta_token'))
+
+registrar('espera_de_cliente', """
+    SELECT e.id, e.barberia_id, e.servicio_id, s.precio, e.estado, e.oferta_barbero_id, e.oferta_fecha,
+           e.oferta_hora_inicio, e.oferta_hora_fin, e.oferta_token
+    FROM Lista_Espera e
+    INNER JOIN Servicios s ON s.id = e.servicio_id
+    WHERE e.id = ? AND e.cliente_id = ?
+""", ('espera_id', 'cliente_id'), ('id', 'barberia_id', 'servicio_id', 'precio', 'estado', 'oferta_barbero_id',
+                                   'oferta_fecha', 'oferta_hora_inicio', 'oferta_hora_fin', 'oferta_token'))
+
+registrar('esperas_por_cliente', """
+    SELECT e.id, bb.nombre as barberia, s.nombre as servicio, u.nombre + ' ' + u.apellido as barbero,
+           e.fecha_desde, e.fecha_hasta, e.estado, e.oferta_fecha, e.oferta_hora_inicio,
+           uo.nombre + ' ' + uo.apellido as oferta_barbero, e.oferta_expira
+    FROM Lista_Espera e
+    INNER JOIN Barberias bb ON e.barberia_id = bb.id
+    INNER JOIN Servicios s ON e.servicio_id = s.id
+    LEFT JOIN Barberos b ON e.barbero_id = b.id
+    LEFT JOIN Usuarios u ON b.usuario_id = u.id
+    LEFT JOIN Barberos bo ON e.oferta_barbero_id = bo.id
+    LEFT JOIN Usuarios uo ON bo.usuario_id = uo.id
+    WHERE e.cliente_id = ? AND e.estado IN ('activa', 'ofrecida')
+    ORDER BY e.fecha_desde
+""", ('cliente_id',), ('id', 'barberia', 'servicio', 'barbero', 'fecha_desde', 'fecha_hasta', 'estado',
+                       'oferta_fecha', 'oferta_hora_inicio', 'oferta_barbero', 'oferta_expira'))
+
+registrar('esperas_vencer', """
+    UPDATE TOP (?) Lista_Espera SET estado = 'vencida'
+    WHERE estado IN ('activa', 'ofrecida') AND fecha_hasta < ?
+""", ('lote', 'hoy'))
+
+registrar('esperas_dias_purgar', """
+    DELETE TOP (?) FROM Lista_Espera_Dias WHERE fecha < ?
+""", ('lote', 'hoy'))
+
+
+# --- NOTIFICACIONES ---
+
+# Una fila por cita, destinatario (rol 'cliente' o 'barbero') y canal. La
+# clave incluye el estado de la cita: repetir el mismo cambio no duplica el
+# aviso (el índice único ignora las claves repetidas, migración 11)
+registrar('notificaciones_encolar', """
+    INSERT INTO Notificaciones_Salida (clave, canal, usuario_id, rol, tipo, cita_id, estado_id)
+    SELECT CONCAT(?, ':', c.id, ':', c.estado_id, ':', d.rol, ':', k.value),
+           k.value, d.usuario_id, d.rol, ?, c.id, c.estado_id
+    FROM Citas c
+    INNER JOIN Barberos b ON c.barbero_id = b.id
+    CROSS APPLY (VALUES ('cliente', c.cliente_id), ('barbero', b.usuario_id)) d(rol, usuario_id)
+    CROSS JOIN STRING_SPLIT(?, ',') k
+    WHERE c.id IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(?, ','))
+      AND d.rol IN (SELECT value FROM STRING_SPLIT(?, ','))
+""", ('tipo', 'tipo', 'canales', 'cita_ids', 'roles'))
+
+# Recordatorios: uno por cita, antelación (horas) y canal, que sale a su hora
+# por el mismo índice de proximo_intento que el resto de la bandeja. Los que
+# ya habrían tenido que salir no se crean
+_INICIO_CITA = "DATEADD(SECOND, DATEDIFF(SECOND, CAST('00:00' AS TIME), c.hora_inicio), CAST(c.fecha AS DATETIME2))"
+
+registrar('recordatorios_encolar', f"""
+    INSERT INTO Notificaciones_Salida (clave, canal, usuario_id, rol, tipo, cita_id, estado_id,
+                                       programada, proximo_intento)
+    SELECT CONCAT('recordatorio:', c.id, ':', CONVERT(VARCHAR(16), i.inicio, 126), ':', h.value, ':', k.value),
+           k.value, c.cliente_id, 'cliente', 'recordatorio', c.id, c.estado_id,
+           i.inicio, DATEADD(HOUR, -CAST(h.value AS INT), i.inicio)
+    FROM Citas c
+    CROSS APPLY (SELECT {_INICIO_CITA} AS inicio) i
+    CROSS JOIN STRING_SPLIT(?, ',') h
+    CROSS JOIN STRING_SPLIT(?, ',') k
+    WHERE c.id IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(?, ','))
+      AND c.estado_id IN (1, 2)
+      AND DATEADD(HOUR, -CAST(h.value AS INT), i.inicio) > SYSDATETIME()
+""", ('horas', 'canales', 'cita_ids'))
+
+# Toma un lote de pendientes por el índice filtrado. READPAST salta las que
+# otro despachador tiene bloqueadas; mover proximo_intento `plazo` segundos
+# las aparta mientras se envían, y si el proceso muere vuelven solas.
+# `vigente` = 0 si es un recordatorio de una cita cancelada, cambiada de hora
+# o que ya empezó
+registrar('notificaciones_tomar', f"""
+    SET NOCOUNT ON;
+    DECLARE @lote TABLE (id BIGINT);
+    WITH pendientes AS (
+        SELECT TOP (?) id, intentos, proximo_intento
+        FROM Notificaciones_Salida WITH (ROWLOCK, UPDLOCK, READPAST)
+        WHERE estado = 'pendiente' AND proximo_intento <= SYSDATETIME()
+        ORDER BY proximo_intento
+    )
+    UPDATE pendientes
+    SET intentos = intentos + 1, proximo_intento = DATEADD(SECOND, ?, SYSDATETIME())
+    OUTPUT inserted.id INTO @lote;
+    SELECT n.id, n.canal, n.rol, n.tipo, n.intentos, u.nombre, u.email, u.telefono,
+           c.fecha, c.hora_inicio, e.nombre as estado, s.nombre as servicio, bb.nombre as barberia,
+           ub.nombre + ' ' + ub.apellido as barbero, uc.nombre + ' ' + uc.apellido as cliente,
+           CASE WHEN n.tipo <> 'recordatorio' THEN 1
+                WHEN c.estado_id IN (1, 2) AND n.programada > SYSDATETIME()
+                     AND n.programada = {_INICIO_CITA} THEN 1
+                ELSE 0 END as vigente
+    FROM @lote l
+    INNER JOIN Notificaciones_Salida n ON n.id = l.id
+    INNER JOIN Usuarios u ON n.usuario_id = u.id
+    LEFT JOIN Citas c ON n.cita_id = c.id
+    LEFT JOIN Estados_Citas e ON n.estado_id = e.id
+    LEFT JOIN Servicios s ON c.servicio_id = s.id
+    LEFT JOIN Barberos b ON c.barbero_id = b.id
+    LEFT JOIN Barberias bb ON b.barberia_id = bb.id
+    LEFT JOIN Usuarios ub ON b.usuario_id = ub.id
+    LEFT JOIN Usuarios uc ON c.cliente_id = uc.id
+""", ('lote', 'plazo_segundos'),
+    ('id', 'canal', 'rol', 'tipo', 'intentos', 'nombre', 'email', 'telefono', 'fecha', 'hora_inicio',
+     'estado', 'servicio', 'barberia', 'barbero', 'cliente', 'vigente'))
+
+registrar('notificaciones_cerrar', """
+    UPDATE Notificaciones_Salida
+    SET estado = ?, enviada = SYSDATETIME()
+    WHERE id IN (SELECT CAST(value AS BIGINT) FROM STRING_SPLIT(?, ','))
+""", ('estado', 'ids'))
+
+registrar('notificacion_reintentar', """
+    UPDATE Notificaciones_Salida
+    SET estado = ?, proximo_intento = DATEADD(SECOND, ?, SYSDATETIME()), ultimo_error = ?
+    WHERE id = ?
+""", ('estado', 'espera_segundos', 'error', 'id'))
+
+registrar('notificaciones_purgar', """
+    DELETE TOP (?) FROM Notificaciones_Salida
+    WHERE estado IN ('enviada', 'fallida', 'descartada') AND creada < ?
+""", ('lote', 'limite'))
+
+
+# --- RESEÑAS ---
+
+_PROMEDIO = "CAST(a.suma AS DECIMAL(10, 2)) / a.total"
+
+# Solo de citas completadas (estado 3) del propio cliente y una por cita. La
+# reseña suma su calificación al acumulado del barbero y recalcula el
+# promedio, que se lee de Barberos sin agregar reseñas
+registrar('resena_crear', f"""
+    SET NOCOUNT ON;
+    DECLARE @nueva TABLE (barbero_id INT, calificacion INT);
+    INSERT INTO Resenas (cita_id, cliente_id, barbero_id, barberia_id, calificacion, comentario)
+    OUTPUT inserted.barbero_id, inserted.calificacion INTO @nueva
+    SELECT c.id, c.cliente_id, c.barbero_id, b.barberia_id, ?, ?
+    FROM Citas c
+    INNER JOIN Barberos b ON c.barbero_id = b.id
+    WHERE c.id = ? AND c.cliente_id = ? AND c.estado_id = 3
+      AND NOT EXISTS (SELECT 1 FROM Resenas r WITH (UPDLOCK, HOLDLOCK) WHERE r.cita_id = c.id);
+    MERGE Calificaciones_Barberos WITH (HOLDLOCK) AS a
+    USING @nueva AS n ON a.barbero_id = n.barbero_id
+    WHEN MATCHED THEN UPDATE SET suma = a.suma + n.calificacion, total = a.total + 1
+    WHEN NOT MATCHED THEN INSERT (barbero_id, suma, total) VALUES (n.barbero_id, n.calificacion, 1);
+    UPDATE b SET calificacion_promedio = {_PROMEDIO}
+    FROM Barberos b
+    INNER JOIN Calificaciones_Barberos a ON a.barbero_id = b.id
+    WHERE b.id IN (SELECT barbero_id FROM @nueva);
+    SELECT COUNT(*) FROM @nueva;
+""", ('calificacion', 'comentario', 'cita_id', 'cliente_id'), ('creada',))
+
+# Paginación por id: la página siguiente empieza después del último id visto,
+# una búsqueda en el índice sin contar ni saltar filas
+registrar('resenas_barberia', """
+    SELECT TOP (?) r.id, r.calificacion, r.comentario, r.fecha_creacion,
+           uc.nombre as cliente, ub.nombre + ' ' + ub.apellido as barbero
+    FROM Resenas r
+    INNER JOIN Usuarios uc ON r.cliente_id = uc.id
+    INNER JOIN Barberos b ON r.barbero_id = b.id
+    INNER JOIN Usuarios ub ON b.usuario_id = ub.id
+    WHERE r.barberia_id = ? AND r.id < ?
+    ORDER BY r.id DESC
+""", ('limite', 'barberia_id', 'antes_id'),
+    ('id', 'calificacion', 'comentario', 'fecha_creacion', 'cliente', 'barbero'))
+
+registrar('resenas_barbero', """
+    SELECT TOP (?) r.id, r.calificacion, r.comentario, r.fecha_creacion, uc.nombre as cliente
+    FROM Resenas r
+    INNER JOIN Usuarios uc ON r.cliente_id = uc.id
+    WHERE r.barbero_id = ? AND r.id < ?
+    ORDER BY r.id DESC
+""", ('limite', 'barbero_id', 'antes_id'), ('id', 'calificacion', 'comentario', 'fecha_creacion', 'cliente'))
+
+registrar('citas_con_resena', """
+    SELECT cita_id FROM Resenas
+    WHERE cita_id IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(?, ','))
+""", ('cita_ids',), ('cita_id',))
+
+# Recalcula el acumulado de un lote de barberos (los siguientes a `despues_de`)
+# y corrige solo lo que se haya desviado, para no tocar la versión de catálogo
+registrar('calificaciones_reconciliar', f"""
+    SET NOCOUNT ON;
+    DECLARE @lote TABLE (barbero_id INT PRIMARY KEY);
+    DECLARE @corregidos INT;
+    INSERT INTO @lote SELECT TOP (?) id FROM Barberos WHERE id > ? ORDER BY id;
+    MERGE Calificaciones_Barberos WITH (HOLDLOCK) AS a
+    USING (
+        SELECT l.barbero_id, COALESCE(SUM(r.calificacion), 0) AS suma, COUNT(r.id) AS total
+        FROM @lote l
+        LEFT JOIN Resenas r ON r.barbero_id = l.barbero_id
+        GROUP BY l.barbero_id
+    ) AS n ON a.barbero_id = n.barbero_id
+    WHEN MATCHED AND (a.suma <> n.suma OR a.total <> n.total) THEN UPDATE SET suma = n.suma, total = n.total
+    WHEN NOT MATCHED AND n.total > 0 THEN INSERT (barbero_id, suma, total) VALUES (n.barbero_id, n.suma, n.total);
+    SET @corregidos = @@ROWCOUNT;
+    UPDATE b SET calificacion_promedio = {_PROMEDIO}
+    FROM Barberos b
+    INNER JOIN Calificaciones_Barberos a ON a.barbero_id = b.id
+    WHERE b.id IN (SELECT barbero_id FROM @lote) AND a.total > 0
+      AND (b.calificacion_promedio IS NULL OR b.calificacion_promedio <> ROUND({_PROMEDIO}, 2));
+    SELECT (SELECT MAX(barbero_id) FROM @lote), @corregidos + @@ROWCOUNT;
+""", ('lote', 'despues_de'), ('ultimo', 'corregidos'))
+
+registrar_con_historico('estadisticas_barbero', """
+    SELECT
+        COUNT(*) as total_citas,
+        SUM(CASE WHEN estado_id = 3 THEN 1 ELSE 0 END) as completadas,
+        AVG(CASE WHEN estado_id = 3 THEN precio_final ELSE NULL END) as ingreso_promedio
+    FROM {citas} c
+    WHERE barbero_id = ?
+""", ('barbero_id',), ('total_citas', 'completadas', 'ingreso_promedio'))
+
+# Fecha exacta = rango [fecha, fecha], sin fecha = rango abierto. El filtro
+# de estado va en su propia variante: con (? IS NULL OR ...) el plan que se
+# cachea para el primer valor sirve mal al otro caso
+_SQL_CITAS_POR_BARBERO = """
+    SELECT c.id, c.fecha, c.hora_inicio, c.hora_fin,
+           u.nombre + ' ' + u.apellido as cliente_nombre,
+           u.telefono as cliente_telefono,
+           s.nombre as servicio_nombre,
+           s.precio as servicio_precio,
+           c.precio_final,
+           e.nombre as estado_nombre,
+           e.color as estado_color,
+           e.id as estado_id,
+           c.notas_cliente,
+           c.notas_barbero
+    FROM {citas} c
+    INNER JOIN Usuarios u ON c.cliente_id = u.id
+    INNER JOIN Servicios s ON c.servicio_id = s.id
+    INNER JOIN Estados_Citas e ON c.estado_id = e.id
+    WHERE c.barbero_id = ? AND c.fecha BETWEEN ? AND ?{estado}
+    ORDER BY c.fecha DESC, c.hora_inicio DESC
+"""
+_COLUMNAS_CITAS_POR_BARBERO = ('id', 'fecha', 'hora_inicio', 'hora_fin', 'cliente_nombre', 'cliente_telefono',
+                               'servicio_nombre', 'servicio_precio', 'precio_final', 'estado_nombre',
+                               'estado_color', 'estado_id', 'notas_cliente', 'notas_barbero')
+
+registrar_con_historico('citas_por_barbero', _SQL_CITAS_POR_BARBERO.replace('{estado}', ''),
+                        ('barbero_id', 'desde', 'hasta'), _COLUMNAS_CITAS_POR_BARBERO)
+registrar_con_historico('citas_por_barbero_estado',
+                        _SQL_CITAS_POR_BARBERO.replace('{estado}', '\n      AND e.nombre = ?'),
+                        ('barbero_id', 'desde', 'hasta', 'estado'), _COLUMNAS_CITAS_POR_BARBERO)
+
+_SQL_CITA_POR_ID = """
+    SELECT c.id, c.cliente_id, c.barbero_id, c.servicio_id,
+           c.fecha, c.hora_inicio, c.hora_fin, c.estado_id,
+           c.notas_cliente, c.notas_barbero, c.precio_final,
+           u.nombre + ' ' + u.apellido as cliente_nombre,
+           s.nombre as servicio_nombre,
+           e.nombre as estado_nombre
+    FROM {tabla} c
+    INNER JOIN Usuarios u ON c.cliente_id = u.id
+    INNER JOIN Servicios s ON c.servicio_id = s.id
+    INNER JOIN Estados_Citas e ON c.estado_id = e.id
+    WHERE c.id = ?
+"""
+_COLUMNAS_CITA = ('id', 'cliente_id', 'barbero_id', 'servicio_id', 'fecha', 'hora_inicio',
+                  'hora_fin', 'estado_id', 'notas_cliente', 'notas_barbero', 'precio_final',
+                  'cliente_nombre', 'servicio_nombre', 'estado_nombre')
+
+registrar('cita_por_id', _SQL_CITA_POR_ID.format(tabla='Citas'), ('cita_id',), _COLUMNAS_CITA)
+registrar('cita_por_id_archivada', _SQL_CITA_POR_ID.format(tabla=TABLA_HISTORICO), ('cita_id',), _COLUMNAS_CITA)
+
+# Citas tiene triggers (migración 5), y SQL Server no admite OUTPUT sin INTO
+# sobre tablas con triggers: las filas cambiadas pasan por una variable de tabla
+registrar('cita_cambiar_estado', """
+    SET NOCOUNT ON;
+    DECLARE @cambiada TABLE (barbero_id INT, fecha DATE);
+    UPDATE Citas
+    SET estado_id = ?,
+        notas_barbero = ?,
+        fecha_modificacion = GETDATE()
+    OUTPUT inserted.barbero_id, inserted.fecha INTO @cambiada
+    WHERE id = ?;
+    SELECT barbero_id, fecha FROM @cambiada;
+""", ('estado_id', 'notas_barbero', 'cita_id'), ('barbero_id', 'fecha'))
+
+registrar('citas_cambiar_estado_lote', """
+    SET NOCOUNT ON;
+    DECLARE @cambiadas TABLE (id INT, barbero_id INT, fecha DATE);
+    UPDATE c
+    SET c.estado_id = e.id,
+        c.notas_barbero = COALESCE(?, c.notas_barbero),
+        c.fecha_modificacion = GETDATE()
+    OUTPUT inserted.id, inserted.barbero_id, inserted.fecha INTO @cambiadas
+    FROM Citas c
+    INNER JOIN Barberos b ON c.barbero_id = b.id
+    INNER JOIN Estados_Citas e ON e.nombre = ?
+    WHERE b.usuario_id = ? AND b.activo = 1
+      AND c.id IN (SELECT CAST(value AS INT) FROM STRING_SPLIT(?, ','));
+    SELECT id, barbero_id, fecha FROM @cambiadas;
+""", ('notas_barbero', 'nombre_estado', 'usuario_id', 'cita_ids'), ('id', 'barbero_id', 'fecha'))
+
+registrar('citas_marcar_vencidas', """
+    UPDATE TOP (?) c
+    SET c.estado_id = e.id,
+        c.fecha_modificacion = GETDATE()
+    FROM Citas c
+    INNER JOIN Estados_Citas e ON e.nombre = ?
+    WHERE c.estado_id IN (1, 2)
+      AND (c.fecha < ? OR (c.fecha = ? AND c.hora_fin <= ?))
+""", ('lote', 'nombre_estado', 'fecha', 'fecha', 'hora'))
+
+registrar('cita_de_cliente', """
+    SELECT c.id, c.cliente_id, c.barbero_id, c.fecha, c.hora_inicio, c.hora_fin, c.estado_id,
+           e.nombre as estado_nombre
+    FROM Citas c
+    INNER JOIN Estados_Citas e ON c.estado_id = e.id
+    WHERE c.id = ? AND c.cliente_id = ?
+""", ('cita_id', 'cliente_id'), ('id', 'cliente_id', 'barbero_id', 'fecha', 'hora_inicio', 'hora_fin',
+                                 'estado_id', 'estado_nombre'))
+
+registrar('estado_cita_por_nombre',
+          "SELECT id, nombre, color FROM Estados_Citas WHERE nombre = ?",
+          ('nombre_estado',), ('id', 'nombre', 'color'))
+
+
+# --- VERSIONES DE AGENDA ---
+
+# La fila con fecha 1900-01-01 es la versión del horario semanal del barbero;
+# la suma de dos contadores que solo crecen tampoco se repite
+registrar('version_agenda', """
+    SELECT COALESCE(SUM(version), 0) as version
+    FROM Versiones_Agenda
+    WHERE barbero_id = ? AND fecha IN (?, ?)
+""", ('barbero_id', 'fecha', 'fecha_horario'), ('version',))
+
+registrar('versiones_agenda_purgar',
+          "DELETE FROM Versiones_Agenda WHERE fecha < ? AND fecha <> ?",
+          ('hasta', 'fecha_horario'))
+
+
+# --- VERSIONES DE CATÁLOGO ---
+
+registrar('versiones_catalogo',
+          "SELECT barberia_id, version FROM Versiones_Catalogo",
+          (), ('barberia_id', 'version'))
+
+
+# --- ARCHIVO HISTÓRICO ---
+
+registrar('referencias_a_citas', """
+    SELECT OBJECT_NAME(fkc.parent_object_id) as tabla,
+           COL_NAME(fkc.parent_object_id, fkc.parent_column_id) as columna
+    FROM sys.foreign_key_columns fkc
+    WHERE fkc.referenced_object_id = OBJECT_ID('Citas')
+""", (), ('tabla', 'columna'))
+
+# 'archivar_citas_lote' se registra en tiempo de ejecución (ver
+# app/database.py), porque excluye las tablas que referencian a Citas.
+
+
+# --- ANALÍTICA (dashboard de propietario) ---
+
+registrar_con_historico('analytics_ingresos', """
+    SELECT c.fecha,
+           COUNT(*) as total_citas,
+           SUM(CASE WHEN c.estado_id = ? THEN 1 ELSE 0 END) as completadas,
+           SUM(CASE WHEN c.estado_id = ? THEN c.precio_final ELSE 0 END) as ingresos
+    FROM {citas} c
+    INNER JOIN Barberos b ON c.barbero_id = b.id
+    WHERE b.barberia_id = ? AND c.fecha BETWEEN ? AND ?
+    GROUP BY c.fecha
+    ORDER BY c.fecha
+""", ('estado_completada', 'estado_completada', 'barberia_id', 'desde', 'hasta'),
+    ('fecha', 'total_citas', 'completadas', 'ingresos'))
+
+registrar('analytics_horarios', """
+    SELECT hb.barbero_id, hb.dia_semana,
+           SUM(DATEDIFF(MINUTE, hb.hora_inicio, hb.hora_fin)) as minutos
+    FROM Horarios_Barberos hb
+    INNER JOIN Barberos b ON hb.barbero_id = b.id
+    WHERE b.barberia_id = ? AND b.activo = 1 AND hb.activo = 1
+    GROUP BY hb.barbero_id, hb.dia_semana
+""", ('barberia_id',), ('barbero_id', 'dia_semana', 'minutos'))
+
+registrar_con_historico('analytics_reservas', """
+    SELECT b.id, u.nombre + ' ' + u.apellido as barbero,
+           COUNT(c.id) as citas,
+           COALESCE(SUM(DATEDIFF(MINUTE, c.hora_inicio, c.hora_fin)), 0) as minutos
+    FROM Barberos b
+    INNER JOIN Usuarios u ON b.usuario_id = u.id
+    LEFT JOIN {citas} c ON c.barbero_id = b.id
+                     AND c.fecha BETWEEN ? AND ?
+                     AND c.estado_id IN (?, ?, ?)
+    WHERE b.barberia_id = ? AND b.activo = 1
+    GROUP BY b.id, u.nombre, u.apellido
+""", ('desde', 'hasta', 'estado', 'estado', 'estado', 'barberia_id'),
+    ('barbero_id', 'barbero', 'citas', 'minutos'))
+
+registrar_con_historico('analytics_mapa_calor', """
+    SELECT DATEPART(WEEKDAY, c.fecha) as dia_semana,
+           DATEPART(HOUR, c.hora_inicio) as hora,
+           COUNT(*) as citas
+    FROM {citas} c
+    INNER JOIN Barberos b ON c.barbero_id = b.id
+    WHERE b.barberia_id = ? AND c.fecha BETWEEN ? AND ?
+          AND c.estado_id IN (?, ?, ?)
+    GROUP BY DATEPART(WEEKDAY, c.fecha), DATEPART(HOUR, c.hora_inicio)
+""", ('barberia_id', 'desde', 'hasta', 'estado', 'estado', 'estado'),
+    ('dia_semana', 'hora', 'citas'))
+
+registrar_con_historico('analytics_servicios', """
+    SELECT s.id, s.nombre, cat.nombre as categoria,
+           COUNT(*) as citas,
+           SUM(CASE WHEN c.estado_id = ? THEN c.precio_final ELSE 0 END) as ingresos
+    FROM {citas} c
+    INNER JOIN Servicios s ON c.servicio_id = s.id
+    INNER JOIN Categorias_Servicios cat ON s.categoria_id = cat.id
+    WHERE s.barberia_id = ? AND c.fecha BETWEEN ? AND ?
+    GROUP BY s.id, s.nombre, cat.nombre
+    ORDER BY COUNT(*) DESC
+""", ('estado_completada', 'barberia_id', 'desde', 'hasta'),
+    ('servicio_id', 'servicio', 'categoria', 'citas', 'ingresos'))
+
+
+# --- EXPORTACIÓN DE HISTORIAL ---
+
+_SQL_EXPORTAR_CITAS = """
+    SELECT c.id, c.fecha, c.hora_inicio, c.hora_fin,
+           ub.nombre + ' ' + ub.apellido as barbero,
+           uc.nombre + ' ' + uc.apellido as cliente,
+           s.nombre as servicio,
+           e.nombre as estado,
+           COALESCE(c.precio_final, s.precio) as precio,
+           c.notas_cliente, c.notas_barbero
+    FROM {citas} c
+    INNER JOIN Barberos b ON c.barbero_id = b.id
+    INNER JOIN Usuarios ub ON b.usuario_id = ub.id
+    INNER JOIN Usuarios uc ON c.cliente_id = uc.id
+    INNER JOIN Servicios s ON c.servicio_id = s.id
+    INNER JOIN Estados_Citas e ON c.estado_id = e.id
+    WHERE {filtro} AND c.fecha BETWEEN ? AND ?
+    ORDER BY c.fecha, c.hora_inicio, c.id
+"""
+COLUMNAS_EXPORTACION = ('id', 'fecha', 'hora_inicio', 'hora_fin', 'barbero', 'cliente', 'servicio',
+                        'estado', 'precio', 'notas_cliente', 'notas_barbero')
+
+registrar_con_historico('exportar_citas_barbero',
+                        _SQL_EXPORTAR_CITAS.replace('{filtro}', 'c.barbero_id = ?'),
+                        ('barbero_id', 'desde', 'hasta'), COLUMNAS_EXPORTACION)
+registrar_con_historico('exportar_citas_barberia',
+                        _SQL_EXPORTAR_CITAS.replace('{filtro}', 'b.barberia_id = ?'),
+                        ('barberia_id', 'desde', 'hasta'), COLUMNAS_EXPORTACION)
@@ -0,0 +1,319 @@
+import heapq
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import namedtuple
+from config import Config
+from app import eventos
+from app.database import (HorarioNoDisponible, crear_cita, crear_reserva_temporal, hay_cita_solapada,
+                          obtener_barberia_de_barbero, obtener_reserva_temporal_cliente, obtener_reservas_ocupadas,
+                          purgar_reservas_temporales, reservas_temporales_disponible, soltar_reserva_temporal)
+
+# Retención temporal de un hueco mientras el cliente termina de reservar.
+#
+# Al elegir hora, el hueco queda retenido RESERVA_TTL_SEGUNDOS: deja de
+# ofrecerse a los demás clientes (no al que lo retiene) y, al confirmar, la
+# cita se crea consumiendo la retención; si otro cliente se adelantó, la
+# creación falla con HorarioNoDisponible. Cada cliente retiene un solo hueco:
+# elegir otro suelta el anterior. Las ofertas de la lista de espera
+# (oferta=True) quedan fuera de esa regla: no sueltan la retención que el
+# cliente tenga en curso ni se sueltan al elegir otro hueco.
+#
+# BackendSQL guarda las retenciones en Reservas_Temporales (migración 8),
+# compartidas por todos los workers; la retención y la conversión en cita son
+# sentencias condicionales con bloqueo de rango, y la tarea purgar_vencidas
+# borra las vencidas por el índice de `expira`. BackendMemoria las guarda en
+# el proceso, con un heap de vencimientos para purgar sin recorrerlas; sirve
+# con un solo worker (RESERVAS_BACKEND='memoria') y es el respaldo mientras
+# la migración 8 no esté aplicada: en cuanto aparece la tabla se pasa a BackendSQL.
+
+_SIN_CONSULTAR = object()  # barbería aún no consultada, en BackendMemoria._apartar
+
+Reserva = namedtuple('Reserva', 'token cliente_id barberia_id barbero_id fecha hora_inicio hora_fin expira oferta',
+                     defaults=(False,))
+
+
+class BackendReservas(ABC):
+    """Interfaz de los backends"""
+
+    @abstractmethod
+    def retener(self, cliente_id, barbero_id, fecha, hora_inicio, hora_fin, ttl, oferta=False):
+        """Token de la retención, o None si el hueco ya no está libre"""
+
+    @abstractmethod
+    def reteniendo(self, cliente_id):
+        """Si el cliente tiene en curso una retención que no es una oferta"""
+
+    @abstractmethod
+    def ocupadas(self, desde, hasta, barbero_ids=None, barberia_ids=None, excepto_cliente=None):
+        """Huecos retenidos por otros clientes: {(barbero_id, fecha): [(inicio, fin)]}"""
+
+    @abstractmethod
+    def confirmar(self, token, **cita):
+        """Crea la cita consumiendo la retención `token` del cliente. Devuelve su id."""
+
+    @abstractmethod
+    def soltar(self, token, cliente_id):
+        """Suelta la retención `token` del cliente, si sigue en pie"""
+
+    @abstractmethod
+    def purgar(self):
+        """Borra las retenciones vencidas. Devuelve cuántas."""
+
+    def marca(self, barbero_id, fecha):
+        """Para el ETag de disponibilidad, si las retenciones no suben la versión de agenda"""
+        return None
+
+
+class BackendSQL(BackendReservas):
+
+    LOTE_PURGA = 1000
+
+    def retener(self, cliente_id, barbero_id, fecha, hora_inicio, hora_fin, ttl, oferta=False):
+        token = uuid.uuid4().hex
+        if crear_reserva_temporal(token, cliente_id, barbero_id, fecha, hora_inicio, hora_fin, ttl, oferta):
+            return token
+        return None
+
+    def reteniendo(self, cliente_id):
+        return obtener_reserva_temporal_cliente(cliente_id) is not None
+
+    def ocupadas(self, desde, hasta, barbero_ids=None, barberia_ids=None, excepto_cliente=None):
+        return obtener_reservas_ocupadas(desde, hasta, barbero_ids, barberia_ids, excepto_cliente)
+
+    def confirmar(self, token, **cita):
+        return crear_cita(reserva_token=token, **cita)
+
+    def soltar(self, token, cliente_id):
+        soltar_reserva_temporal(token, cliente_id)
+
+    def purgar(self):
+        total = 0
+        while True:
+            borradas = purgar_reservas_temporales(self.LOTE_PURGA)
+            total += borradas
+            if borradas < self.LOTE_PURGA:
+                return total
+
+
+class BackendMemoria(BackendReservas):
+    """Retenciones en el proceso. Seguro entre hilos."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reservas = {}      # token -> Reserva
+        self._por_cliente = {}   # cliente_id -> token
+        self._por_agenda = {}    # (barbero_id, fecha) -> {token}
+        self._marcas = {}        # (barbero_id, fecha) -> generación del último cambio, mientras haya retenciones
+        self._vencimientos = []  # heap de (expira, token); los ya liberados se saltan al salir
+        self._generacion = 0
+
+    def _cambio(self, clave):
+        self._generacion += 1
+        if clave in self._por_agenda:
+            self._marcas[clave] = self._generacion
+        else:
+            # Sin retenciones la disponibilidad vuelve a ser la de la base de datos
+            self._marcas.pop(clave, None)
+
+    def _quitar(self, token):
+        reserva = self._reservas.pop(token)
+        if self._por_cliente.get(reserva.cliente_id) == token:
+            del self._por_cliente[reserva.cliente_id]
+        clave = (reserva.barbero_id, reserva.fecha)
+        tokens = self._por_agenda[clave]
+        tokens.discard(token)
+        if not tokens:
+            del self._por_agenda[clave]
+        self._cambio(clave)
+        return clave
+
+    def _agregar(self, reserva):
+        self._reservas[reserva.token] = reserva
+        self._por_agenda.setdefault((reserva.barbero_id, reserva.fecha), set()).add(reserva.token)
+        heapq.heappush(self._vencimientos, (reserva.expira, reserva.token))
+        self._cambio((reserva.barbero_id, reserva.fecha))
+
+    def _purgar(self, ahora):
+        cambios = set()
+        while self._vencimientos and self._vencimientos[0][0] <= ahora:
+            _, token = heapq.heappop(self._vencimientos)
+            if token in self._reservas:
+                cambios.add(self._quitar(token))
+        return cambios
+
+    def _retenido_por_otro(self, cliente_id, barbero_id, fecha, hora_inicio, hora_fin):
+        for token in self._por_agenda.get((barbero_id, fecha), ()):
+            reserva = self._reservas[token]
+            if reserva.cliente_id != cliente_id and reserva.hora_inicio < hora_fin and hora_inicio < reserva.hora_fin:
+                return True
+        return False
+
+    def retener(self, cliente_id, barbero_id, fecha, hora_inicio, hora_fin, ttl, oferta=False):
+        if hay_cita_solapada(barbero_id, fecha, hora_inicio, hora_fin):
+            return None
+        barberia_id = obtener_barberia_de_barbero(barbero_id)
+        token = None
+        with self._lock:
+            ahora = time.monotonic()
+            cambios = self._purgar(ahora)
+            anterior = None if oferta else self._por_cliente.get(cliente_id)
+            if anterior is not None:
+                cambios.add(self._quitar(anterior))
+            if not self._retenido_por_otro(cliente_id, barbero_id, fecha, hora_inicio, hora_fin):
+                token = uuid.uuid4().hex
+                self._agregar(Reserva(token, cliente_id, barberia_id, barbero_id, fecha,
+                                      hora_inicio, hora_fin, ahora + ttl, oferta))
+                if not oferta:
+                    self._por_cliente[cliente_id] = token
+                cambios.add((barbero_id, fecha))
+        eventos.publicar_cambios_agenda(cambios)
+        return token
+
+    def reteniendo(self, cliente_id):
+        with self._lock:
+            reserva = self._reservas.get(self._por_cliente.get(cliente_id))
+        return reserva is not None and reserva.expira > time.monotonic()
+
+    def ocupadas(self, desde, hasta, barbero_ids=None, barberia_ids=None, excepto_cliente=None):
+        barbero_ids = set(barbero_ids or ())
+        barberia_ids = set(barberia_ids or ())
+        ahora = time.monotonic()
+        with self._lock:
+            reservas = list(self._reservas.values())
+        ocupadas = {}
+        for r in reservas:
+            if (r.expira > ahora and desde <= r.fecha <= hasta and r.cliente_id != excepto_cliente
+                    and (r.barbero_id in barbero_ids or r.barberia_id in barberia_ids)):
+                ocupadas.setdefault((r.barbero_id, r.fecha), []).append((r.hora_inicio, r.hora_fin))
+        return ocupadas
+
+    def _apartar(self, token, cliente_id, hueco, cambios, barberia_id=_SIN_CONSULTAR):
+        """
+        Añade la retención provisional de confirmar() y devuelve su token. La
+        barbería sale de la retención `token` si es la del cliente para ese
+        hueco; si no, hace falta `barberia_id` y sin él devuelve None.
+        """
+        with self._lock:
+            ahora = time.monotonic()
+            cambios.update(self._purgar(ahora))
+            if self._retenido_por_otro(cliente_id, *hueco):
+                raise HorarioNoDisponible('Ese horario ya no está disponible, elige otro')
+            reserva = self._reservas.get(token)
+            if (reserva is not None and reserva.cliente_id == cliente_id
+                    and (reserva.barbero_id, reserva.fecha, reserva.hora_inicio, reserva.hora_fin) == hueco):
+                barberia_id = reserva.barberia_id
+            elif barberia_id is _SIN_CONSULTAR:
+                return None
+            provisional = uuid.uuid4().hex
+            self._agregar(Reserva(provisional, cliente_id, barberia_id, *hueco, ahora + Config.RESERVA_TTL_SEGUNDOS))
+            return provisional
+
+    def confirmar(self, token, **cita):
+        cliente_id, clave = cita['cliente_id'], (cita['barbero_id'], cita['fecha'])
+        hueco = clave + (cita['hora_inicio'], cita['hora_fin'])
+        cambios = set()
+        # El INSERT va fuera del lock: mientras tanto una retención provisional
+        # a nombre del cliente impide que otro retenga o confirme el hueco
+        provisional = self._apartar(token, cliente_id, hueco, cambios)
+        if provisional is None:
+            # Sin retención propia la barbería se consulta, también fuera del lock
+            provisional = self._apartar(token, cliente_id, hueco, cambios,
+                                        obtener_barberia_de_barbero(cita['barbero_id']))
+        try:
+            cita_id = crear_cita(**cita)
+        except BaseException:
+            with self._lock:
+                cambios.add(self._quitar(provisional))
+            eventos.publicar_cambios_agenda(cambios - {clave})
+            raise
+        with self._lock:
+            cambios.add(self._quitar(provisional))
+            reserva = self._reservas.get(token)
+            if reserva is not None and reserva.cliente_id == cliente_id:
+                cambios.add(self._quitar(token))
+        # crear_cita ya avisó del cambio en `clave`
+        eventos.publicar_cambios_agenda(cambios - {clave})
+        return cita_id
+
+    def soltar(self, token, cliente_id):
+        with self._lock:
+            cambios = self._purgar(time.monotonic())
+            reserva = self._reservas.get(token)
+            if reserva is not None and reserva.cliente_id == cliente_id:
+                cambios.add(self._quitar(token))
+        eventos.publicar_cambios_agenda(cambios)
+
+    def purgar(self):
+        with self._lock:
+            antes = len(self._reservas)
+            cambios = self._purgar(time.monotonic())
+            borradas = antes - len(self._reservas)
+        eventos.publicar_cambios_agenda(cambios)
+        return borradas
+
+    def marca(self, barbero_id, fecha):
+        if self._vencimientos and self._vencimientos[0][0] <= time.monotonic():
+            self.purgar()
+        return self._marcas.get((barbero_id, fecha), 0)
+
+
+# --- API DEL MÓDULO ---
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def backend():
+    """
+    El backend de RESERVAS_BACKEND. Si se pidió 'sql' y falta la migración 8
+    se usa el de memoria, y se vuelve a comprobar la tabla (cada 60 s, ver
+    tabla_existe) hasta que aparece: el respaldo no se queda fijo en el worker.
+    """
+    global _backend
+    if not isinstance(_backend, BackendSQL) and (_backend is None or Config.RESERVAS_BACKEND == 'sql'):
+        with _backend_lock:
+            if Config.RESERVAS_BACKEND == 'sql' and reservas_temporales_disponible():
+                if not isinstance(_backend, BackendSQL):
+                    _backend = BackendSQL()
+            elif _backend is None:
+                _backend = BackendMemoria()
+    return _backend
+
+
+def retener(cliente_id, barbero_id, fecha, hora_inicio, hora_fin, ttl=None, oferta=False):
+    """
+    Retiene el hueco para el cliente `ttl` segundos (RESERVA_TTL_SEGUNDOS si
+    no se indica). Devuelve el token, o None si el hueco no está libre.
+    Con oferta=True es una oferta de la lista de espera y no toca la
+    retención que el cliente tenga en curso.
+    """
+    return backend().retener(cliente_id, barbero_id, fecha, hora_inicio, hora_fin,
+                             ttl or Config.RESERVA_TTL_SEGUNDOS, oferta)
+
+
+def reteniendo(cliente_id):
+    """Si el cliente está a mitad de una reserva (tiene una retención que no es una oferta)"""
+    return backend().reteniendo(cliente_id)
+
+
+def ocupadas(desde, hasta, barbero_ids=None, barberia_ids=None, excepto_cliente=None):
+    return backend().ocupadas(desde, hasta, barbero_ids, barberia_ids, excepto_cliente)
+
+
+def confirmar(token, **cita):
+    """Crea la cita (argumentos de crear_cita) consumiendo la retención, si la hay"""
+    return backend().confirmar(token, **cita)
+
+
+def soltar(token, cliente_id):
+    backend().soltar(token, cliente_id)
+
+
+def marca(barbero_id, fecha):
+    return backend().marca(barbero_id, fecha)
+
+
+def purgar_vencidas():
+    return backend().purgar()
@@ -1,8 +1,12 @@
-from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app
+from flask import Blueprint, render_template, request, redirect, url_for, flash, session, current_app, Response, abort, stream_with_context, jsonify
 from app.database import *
 from app.auth import *
+from app import agenda as agenda_mod
+from app import analytics, busqueda, calendario, eventos, exportar, lista_espera, metrics, paginas, reservas, series
 from datetime import datetime, timedelta, date
+import hmac
 import os
+import time
 
 # === BLUEPRINTS ===
 
@@ -10,6 +14,8 @@ main_bp = Blueprint('main', __name__)
 auth_bp = Blueprint('auth', __name__)
 cliente_bp = Blueprint('cliente', __name__)
 barbero_bp = Blueprint('barbero', __name__)
+propietario_bp = Blueprint('propietario', __name__)
+admin_bp = Blueprint('admin', __name__)
 
 
 # ============================================
@@ -19,20 +25,65 @@ barbero_bp = Blueprint('barbero', __name__)
 @main_bp.route('/')
 def index():
     """Página principal - Landing page"""
+    return paginas.servir('index', 0, _renderizar_index)
+
+
+def _renderizar_index():
     barberias = obtener_barberias_activas()
-    return render_template('index.html', barberias=barberias)
+    return render_template('index.html', barberias=barberias, facetas=busqueda.facetas())
+
+
+@main_bp.route('/buscar')
+def buscar():
+    """Búsqueda de barberías (JSON) por texto, ciudad, categoría y rango de precio, paginada"""
+    try:
+        precio_min = float(request.args['precio_min']) if request.args.get('precio_min') else None
+        precio_max = float(request.args['precio_max']) if request.args.get('precio_max') else None
+        pagina = max(1, int(request.args.get('pagina') or 1))
+    except ValueError:
+        return {'error': 'Parámetros inválidos'}, 400
+
+    inicio = time.perf_counter()
+    resultado = busqueda.buscar(request.args.get('q', ''), request.args.get('ciudad'),
+                                request.args.get('categoria'), precio_min, precio_max, pagina)
+    resultado['tiempo_ms'] = round((time.perf_counter() - inicio) * 1000, 3)
+    return jsonify(resultado)
+
+
+@main_bp.route('/cercanas')
+def cercanas():
+    """Barberías más cercanas a un punto (JSON), opcionalmente solo las que tienen huecos hoy"""
+    try:
+        lat = float(request.args['lat'])
+        lon = float(request.args['lon'])
+        k = int(request.args.get('k') or 10)
+        radio_km = float(request.args['radio_km']) if request.args.get('radio_km') else None
+    except (KeyError, ValueError):
+        return {'error': 'Parámetros inválidos'}, 400
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180) or (radio_km is not None and radio_km <= 0):
+        return {'error': 'Parámetros inválidos'}, 400
+
+    inicio = time.perf_counter()
+    resultados = busqueda.cercanas(lat, lon, k, radio_km, request.args.get('disponible_hoy') == '1')
+    return jsonify({'resultados': resultados,
+                    'tiempo_ms': round((time.perf_counter() - inicio) * 1000, 3)})
 
 
 @main_bp.route('/barberia/<int:barberia_id>')
 def ver_barberia(barberia_id):
-    barberia = obtener_barberia_por_id(barberia_id)
+    return paginas.servir('barberia', barberia_id, lambda: _renderizar_barberia(barberia_id))
+
+
+def _renderizar_barberia(barberia_id):
+    barberia, servicios, barberos, (resenas, siguiente) = en_paralelo(
+        (obtener_barberia_por_id, barberia_id),
+        (obtener_servicios_por_barberia, barberia_id),
+        (obtener_barberos_por_barberia, barberia_id),
+        (obtener_resenas_barberia, barberia_id, None, current_app.config['RESENAS_POR_PAGINA']))
     if not barberia:
         flash('Barbería no encontrada', 'danger')
         return redirect(url_for('main.index'))
 
-    servicios = obtener_servicios_por_barberia(barberia_id)
-    barberos = obtener_barberos_por_barberia(barberia_id)
-
     # === IMÁGENES ===
     img_folder = os.path.join(current_app.static_folder, "img")
     prefix = f"Barberia{barberia_id}_IMG-"
@@ -51,10 +102,32 @@ def ver_barberia(barberia_id):
         servicios=servicios,
         barberos=barberos,
         images=images,          
-        total_images=total_images  
+        total_images=total_images,
+        resenas=resenas,
+        resenas_siguiente=siguiente
     )
 
 
+@main_bp.route('/barberia/<int:barberia_id>/resenas')
+def resenas_barberia(barberia_id):
+    """Página siguiente de reseñas de una barbería (JSON), a partir del id `antes`"""
+    resenas, siguiente = obtener_resenas_barberia(barberia_id, request.args.get('antes', type=int),
+                                                  current_app.config['RESENAS_POR_PAGINA'])
+    return jsonify({'resenas': [dict(r, fecha_creacion=r['fecha_creacion'].strftime('%d/%m/%Y')) for r in resenas],
+                    'siguiente': siguiente})
+
+
+@main_bp.route('/metrics')
+def metrics_prometheus():
+    """Métricas operativas en formato de texto de Prometheus (METRICS_TOKEN o sesión de administrador)"""
+    token = current_app.config.get('METRICS_TOKEN')
+    enviado = request.args.get('token') or request.headers.get('Authorization', '').replace('Bearer ', '', 1)
+    autorizado = bool(token) and hmac.compare_digest(enviado.encode(), token.encode())
+    if not autorizado and session.get('user_rol') != 'Admin':
+        abort(403)
+    return Response(metrics.exportar_prometheus(), mimetype='text/plain; version=0.0.4')
+
+
 # ============================================
 # RUTAS DE AUTENTICACIÓN (Auth Blueprint)
 # ============================================
@@ -81,13 +154,13 @@ def login():
             
             # Redirigir según el rol
             if user['rol_nombre'] == 'Admin':
-                return redirect(url_for('main.index'))  # TODO: crear dashboard admin
+                return redirect(url_for('admin.dashboard'))
             elif user['rol_nombre'] == 'Cliente':
                 return redirect(url_for('cliente.dashboard'))
             elif user['rol_nombre'] == 'Barbero':
                 return redirect(url_for('barbero.dashboard'))
             elif user['rol_nombre'] == 'Propietario':
-                return redirect(url_for('main.index'))  # TODO: crear dashboard propietario
+                return redirect(url_for('propietario.dashboard'))
             else:
                 return redirect(url_for('main.index'))
         else:
@@ -156,7 +229,11 @@ def logout():
 def dashboard():
     """Dashboard del cliente - Ver sus citas"""
     user = get_current_user()
-    citas = obtener_citas_por_cliente(user['id'])
+    
+    # Por defecto solo citas recientes; el historial completo incluye el archivo
+    ver_historial = bool(request.args.get('historial'))
+    desde = None if ver_historial else horizonte_archivo()
+    citas = obtener_citas_por_cliente(user['id'], desde=desde)
     
     # Separar citas próximas y pasadas
     hoy = date.today()
@@ -165,27 +242,33 @@ def dashboard():
     
     return render_template('cliente/dashboard.html', 
                          citas_proximas=citas_proximas,
-                         citas_pasadas=citas_pasadas)
+                         citas_pasadas=citas_pasadas,
+                         series=obtener_series_cliente(user['id']),
+                         esperas=obtener_esperas_cliente(user['id']),
+                         resenadas=obtener_citas_con_resena([c['id'] for c in citas_pasadas
+                                                             if c['estado'] == 'Completada']),
+                         resenas_disponible=resenas_disponible(),
+                         ver_historial=ver_historial)
 
 
 @cliente_bp.route('/reservar/<int:barberia_id>', methods=['GET', 'POST'])
 @login_required
 def reservar(barberia_id):
     """Página para hacer una reserva"""
-    barberia = obtener_barberia_por_id(barberia_id)
+    barberia, servicios, barberos = en_paralelo((obtener_barberia_por_id, barberia_id),
+                                                (obtener_servicios_por_barberia, barberia_id),
+                                                (obtener_barberos_por_barberia, barberia_id))
     if not barberia:
         flash('Barbería no encontrada', 'danger')
         return redirect(url_for('main.index'))
     
-    servicios = obtener_servicios_por_barberia(barberia_id)
-    barberos = obtener_barberos_por_barberia(barberia_id)
-    
     if request.method == 'POST':
         servicio_id = request.form.get('servicio_id')
         barbero_id = request.form.get('barbero_id')
         fecha_str = request.form.get('fecha')
         hora_str = request.form.get('hora')
         notas = request.form.get('notas', '')
+        reserva_token = request.form.get('reserva_token') or None
         
         try:
             # Parsear fecha y hora
@@ -200,9 +283,21 @@ def reservar(barberia_id):
             hora_fin_dt = hora_inicio_dt + timedelta(minutes=servicio['duracion_minutos'])
             hora_fin = hora_fin_dt.time()
             
-            # Crear la cita
             user = get_current_user()
-            cita_id = crear_cita(
+            if request.form.get('repetir') and series_disponible():
+                cada_semanas, hasta, repeticiones = _leer_repeticion(request.form, fecha)
+                _, creadas, fecha_fin = series.crear_serie(user['id'], int(barbero_id), servicio, fecha, hora_inicio,
+                                                           cada_semanas, hasta, repeticiones, notas or None,
+                                                           reserva_token)
+                mensaje = f'¡Citas recurrentes reservadas hasta el {fecha_fin.strftime("%d/%m/%Y")}!'
+                if creadas < (fecha_fin - fecha).days // (7 * cada_semanas) + 1:
+                    mensaje += f' Ya tienes {creadas}; las siguientes se reservarán automáticamente.'
+                flash(mensaje, 'success')
+                return redirect(url_for('cliente.dashboard'))
+
+            # Crear la cita, consumiendo la retención del hueco si la hay
+            cita_id = reservas.confirmar(
+                reserva_token,
                 cliente_id=user['id'],
                 barbero_id=int(barbero_id),
                 servicio_id=int(servicio_id),
@@ -216,6 +311,9 @@ def reservar(barberia_id):
             flash('¡Cita reservada exitosamente!', 'success')
             return redirect(url_for('cliente.dashboard'))
             
+        except HorarioNoDisponible as e:
+            flash(str(e), 'warning')
+            return redirect(url_for('cliente.reservar', barberia_id=barberia_id))
         except Exception as e:
             flash(f'Error al crear la cita: {str(e)}', 'danger')
             return redirect(url_for('cliente.reservar', barberia_id=barberia_id))
@@ -223,7 +321,23 @@ def reservar(barberia_id):
     return render_template('cliente/reservar.html',
                          barberia=barberia,
                          servicios=servicios,
-                         barberos=barberos)
+                         barberos=barberos,
+                         series_disponible=series_disponible(),
+                         lista_espera_disponible=lista_espera_disponible())
+
+
+def _leer_repeticion(form, fecha):
+    """(cada_semanas, hasta, repeticiones) del formulario de reserva; ValueError si no son válidos"""
+    cada_semanas = int(form.get('cada_semanas') or 2)
+    hasta = datetime.strptime(form['repetir_hasta'], '%Y-%m-%d').date() if form.get('repetir_hasta') else None
+    repeticiones = int(form['repeticiones']) if form.get('repeticiones') else None
+    if not 1 <= cada_semanas <= 12:
+        raise ValueError('La frecuencia debe ser de 1 a 12 semanas')
+    if hasta is None and repeticiones is None:
+        raise ValueError('Indica hasta qué fecha o cuántas veces repetir la cita')
+    if (hasta is not None and hasta <= fecha) or (repeticiones is not None and repeticiones < 2):
+        raise ValueError('La repetición debe incluir al menos dos citas')
+    return cada_semanas, hasta, repeticiones
 
 
 @cliente_bp.route('/horarios-disponibles')
@@ -238,37 +352,194 @@ def horarios_disponibles():
     
     try:
         fecha = datetime.strptime(fecha_str, '%Y-%m-%d').date()
-        slots_info = obtener_slots_disponibles(barbero_id, fecha)
         
-        if not slots_info:
-            return {'disponibles': []}
+        # La versión se lee antes de calcular: si cambia después, el
+        # siguiente sondeo verá otro ETag y recibirá la lista nueva
+        version = obtener_version_agenda(barbero_id, fecha)
+        etag = f'{barbero_id}-{fecha.isoformat()}-{version}' if version is not None else None
+        marca = reservas.marca(barbero_id, fecha)
+        if etag and marca:
+            etag += f'-{marca}'
+        if etag and request.if_none_match.contains(etag):
+            return _respuesta_disponibilidad(Response(status=304), etag)
         
-        # Generar slots cada 30 minutos
-        slots_disponibles = []
-        hora_actual = datetime.combine(fecha, slots_info['horario_inicio'])
-        hora_fin = datetime.combine(fecha, slots_info['horario_fin'])
-        
-        while hora_actual < hora_fin:
-            hora_slot = hora_actual.time()
-            
-            # Verificar si está ocupado
-            esta_ocupado = False
-            for ocupado_inicio, ocupado_fin in slots_info['citas_ocupadas']:
-                if ocupado_inicio <= hora_slot < ocupado_fin:
-                    esta_ocupado = True
-                    break
-            
-            if not esta_ocupado:
-                slots_disponibles.append(hora_slot.strftime('%H:%M'))
-            
-            hora_actual += timedelta(minutes=30)
+        user = get_current_user()
+        slots_disponibles = [slot.strftime('%H:%M')
+                             for slot in agenda_mod.horarios_libres(barbero_id, fecha, cliente_id=user['id'])]
         
-        return {'disponibles': slots_disponibles}
+        return _respuesta_disponibilidad(jsonify({'disponibles': slots_disponibles}), etag)
         
     except Exception as e:
         return {'error': str(e)}, 500
 
 
+@cliente_bp.route('/primeros-huecos')
+@login_required
+def primeros_huecos():
+    """API: los primeros huecos libres de una barbería para un servicio, con cualquier barbero"""
+    barberia_id = request.args.get('barberia_id', type=int)
+    servicio_id = request.args.get('servicio_id', type=int)
+    cantidad = min(max(request.args.get('n', 5, type=int), 1), current_app.config['HUECOS_MAX'])
+
+    if not barberia_id or not servicio_id:
+        return {'error': 'Faltan parámetros'}, 400
+
+    servicio, barberos = en_paralelo((obtener_servicio_por_id, servicio_id),
+                                     (obtener_barberos_por_barberia, barberia_id))
+    if not servicio or servicio['barberia_id'] != barberia_id:
+        return {'error': 'Servicio no encontrado'}, 404
+
+    nombres = {b['id']: f"{b['nombre']} {b['apellido']}" for b in barberos}
+    huecos = agenda_mod.primeros_huecos(barberia_id, servicio['duracion_minutos'], cantidad,
+                                        cliente_id=get_current_user()['id'])
+    return jsonify({'huecos': [{'fecha': fecha.isoformat(), 'hora': hora.strftime('%H:%M'),
+                                'barbero_id': barbero_id, 'barbero': nombres.get(barbero_id)}
+                               for fecha, hora, barbero_id in huecos]})
+
+
+@cliente_bp.route('/retener', methods=['POST'])
+@login_required
+def retener_hueco():
+    """API: retiene el hueco elegido mientras el cliente confirma la reserva"""
+    barbero_id = request.form.get('barbero_id', type=int)
+    servicio_id = request.form.get('servicio_id', type=int)
+    try:
+        fecha = datetime.strptime(request.form.get('fecha', ''), '%Y-%m-%d').date()
+        hora_inicio = datetime.strptime(request.form.get('hora', ''), '%H:%M').time()
+    except ValueError:
+        fecha = hora_inicio = None
+
+    if not barbero_id or not servicio_id or not fecha or fecha < date.today():
+        return {'error': 'Faltan parámetros'}, 400
+
+    servicio = obtener_servicio_por_id(servicio_id)
+    if not servicio or obtener_barberia_de_barbero(barbero_id) != servicio['barberia_id']:
+        return {'error': 'Servicio no encontrado'}, 404
+
+    fin = datetime.combine(fecha, hora_inicio) + timedelta(minutes=servicio['duracion_minutos'])
+    if fin.date() != fecha:
+        return {'error': 'El servicio no cabe en ese día'}, 400
+    token = reservas.retener(get_current_user()['id'], barbero_id, fecha, hora_inicio, fin.time())
+    if token is None:
+        return {'error': 'Ese horario ya no está disponible'}, 409
+    return jsonify({'token': token, 'expira_segundos': current_app.config['RESERVA_TTL_SEGUNDOS']})
+
+
+@cliente_bp.route('/disponibilidad/stream')
+@login_required
+def disponibilidad_stream():
+    """Server-Sent Events: avisa cuando cambia la disponibilidad de una barbería en una fecha"""
+    barberia_id = request.args.get('barberia_id', type=int)
+    try:
+        fecha = datetime.strptime(request.args.get('fecha', ''), '%Y-%m-%d').date()
+    except ValueError:
+        fecha = None
+    
+    if not barberia_id or not fecha:
+        return {'error': 'Faltan parámetros'}, 400
+    
+    flujo = (eventos.canal_disponibilidad(barberia_id, fecha),
+             current_app.config['SSE_LATIDO_SEGUNDOS'], current_app.config['SSE_MAX_SEGUNDOS'])
+    cabeceras = {'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    
+    if eventos.STREAM_ASGI in request.environ:
+        # Modo ASGI: el adaptador recorre el stream en el bucle de eventos, sin ocupar un hilo
+        request.environ[eventos.STREAM_ASGI] = flujo
+        return Response(mimetype='text/event-stream', headers=cabeceras)
+    
+    if not eventos.ocupar_stream(current_app.config['SSE_MAX_CONEXIONES']):
+        # Sin plaza: EventSource no reintenta un 503 y la página pasa a sondear
+        return Response(status=503, headers={'Retry-After': str(current_app.config['SSE_SONDEO_SEGUNDOS'])})
+    
+    response = Response(eventos.flujo_sse(*flujo), mimetype='text/event-stream', headers=cabeceras)
+    # Al cerrar la respuesta, aunque el generador no llegue a arrancar
+    response.call_on_close(eventos.liberar_stream)
+    return response
+
+
+def _respuesta_disponibilidad(response, etag):
+    """Añade el ETag de la agenda; el navegador revalida en cada sondeo"""
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+@cliente_bp.route('/serie/<int:serie_id>/detener', methods=['POST'])
+@cliente_required
+def detener_serie_citas(serie_id):
+    """Deja de reservar nuevas citas de una serie"""
+    if detener_serie(serie_id, get_current_user()['id']):
+        flash('No se reservarán más citas de esta serie. Las ya reservadas siguen en pie.', 'success')
+    else:
+        flash('Serie no encontrada', 'danger')
+    return redirect(url_for('cliente.dashboard'))
+
+
+@cliente_bp.route('/espera/<int:barberia_id>', methods=['POST'])
+@cliente_required
+def apuntarse_espera(barberia_id):
+    """Apuntarse a la lista de espera de una barbería desde el formulario de reserva"""
+    servicios = {s['id']: s for s in obtener_servicios_por_barberia(barberia_id)}
+    barberos = {b['id'] for b in obtener_barberos_por_barberia(barberia_id)}
+    try:
+        servicio_id = int(request.form.get('servicio_id'))
+        barbero_id = int(request.form['barbero_id']) if request.form.get('barbero_id') else None
+        fecha = datetime.strptime(request.form.get('fecha'), '%Y-%m-%d').date()
+        if servicio_id not in servicios or (barbero_id is not None and barbero_id not in barberos):
+            raise ValueError('Servicio o barbero no válido')
+        if fecha < date.today():
+            raise ValueError('La fecha ya pasó')
+        lista_espera.apuntar(get_current_user()['id'], barberia_id, barbero_id, servicio_id, fecha)
+    except Exception as e:
+        flash(f'No se pudo apuntar a la lista de espera: {str(e)}', 'danger')
+        return redirect(url_for('cliente.reservar', barberia_id=barberia_id))
+    flash('Te avisaremos en tu panel si se libera un hueco.', 'success')
+    return redirect(url_for('cliente.dashboard'))
+
+
+@cliente_bp.route('/espera/<int:espera_id>/aceptar', methods=['POST'])
+@cliente_required
+def aceptar_espera(espera_id):
+    """Reservar el hueco ofrecido por la lista de espera"""
+    try:
+        cita_id = lista_espera.aceptar(espera_id, get_current_user()['id'])
+    except HorarioNoDisponible as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('cliente.dashboard'))
+    if cita_id is None:
+        flash('La oferta ya no está disponible', 'warning')
+    else:
+        flash('¡Cita reservada exitosamente!', 'success')
+    return redirect(url_for('cliente.dashboard'))
+
+
+@cliente_bp.route('/espera/<int:espera_id>/retirar', methods=['POST'])
+@cliente_required
+def retirar_espera(espera_id):
+    """Salir de la lista de espera"""
+    if lista_espera.retirar(espera_id, get_current_user()['id']):
+        flash('Has salido de la lista de espera', 'success')
+    else:
+        flash('Entrada de la lista de espera no encontrada', 'danger')
+    return redirect(url_for('cliente.dashboard'))
+
+
+@cliente_bp.route('/cita/<int:cita_id>/resena', methods=['POST'])
+@cliente_required
+def resenar_cita(cita_id):
+    """Valorar una cita completada"""
+    calificacion = request.form.get('calificacion', type=int)
+    comentario = (request.form.get('comentario') or '').strip()[:1000] or None
+    if calificacion is None or not 1 <= calificacion <= 5:
+        flash('Elige una calificación de 1 a 5 estrellas', 'danger')
+    elif crear_resena(cita_id, get_current_user()['id'], calificacion, comentario):
+        flash('¡Gracias por tu reseña!', 'success')
+    else:
+        flash('Solo puedes reseñar una vez cada cita completada', 'warning')
+    return redirect(url_for('cliente.dashboard'))
+
+
 @cliente_bp.route('/perfil')
 @cliente_required
 def perfil():
@@ -309,25 +580,22 @@ def dashboard():
         flash('No se encontró tu perfil de barbero', 'danger')
         return redirect(url_for('main.index'))
     
-    # Obtener citas de hoy
+    # Citas de hoy, de los 7 días siguientes y estadísticas, todo a la vez
     hoy = date.today()
-    citas_hoy = obtener_citas_por_barbero(barbero['id'], fecha=hoy)
+    citas_hoy, proximas, estadisticas = en_paralelo(
+        (obtener_citas_por_barbero, barbero['id'], hoy),
+        (obtener_citas_por_barbero, barbero['id'], None, None, hoy + timedelta(days=1), hoy + timedelta(days=7)),
+        (obtener_estadisticas_barbero, barbero['id']))
     
     # Filtrar citas por estado
     citas_pendientes = [c for c in citas_hoy if c['estado_nombre'] == 'Pendiente']
     citas_confirmadas = [c for c in citas_hoy if c['estado_nombre'] == 'Confirmada']
     citas_completadas_hoy = [c for c in citas_hoy if c['estado_nombre'] == 'Completada']
     
-    # Obtener próximas citas (siguientes 7 días)
-    proximas_citas = []
-    for i in range(1, 8):
-        fecha_futura = hoy + timedelta(days=i)
-        citas_fecha = obtener_citas_por_barbero(barbero['id'], fecha=fecha_futura)
-        citas_activas = [c for c in citas_fecha if c['estado_nombre'] in ['Pendiente', 'Confirmada']]
-        proximas_citas.extend(citas_activas)
+    # Próximas citas activas (siguientes 7 días), día a día
+    proximas_citas = [c for c in sorted(proximas, key=lambda c: c['fecha'])
+                      if c['estado_nombre'] in ['Pendiente', 'Confirmada']]
     
-    # Obtener estadísticas
-    estadisticas = obtener_estadisticas_barbero(barbero['id'])
     if not estadisticas:
         estadisticas = {
             'total_citas': 0,
@@ -368,14 +636,18 @@ def agenda():
     else:
         fecha = None
     
-    # Obtener todas las citas
-    citas = obtener_citas_por_barbero(barbero['id'], fecha=fecha, estado=estado_filtro)
+    # Sin filtro de fecha se muestran solo las citas recientes, salvo que se pida el historial
+    ver_historial = bool(request.args.get('historial'))
+    desde = None if (fecha or ver_historial) else horizonte_archivo()
+    
+    citas = obtener_citas_por_barbero(barbero['id'], fecha=fecha, estado=estado_filtro, desde=desde)
     
     return render_template('barbero/agenda.html',
                          barbero=barbero,
                          citas=citas,
                          fecha_filtro=fecha_filtro,
-                         estado_filtro=estado_filtro)
+                         estado_filtro=estado_filtro,
+                         ver_historial=ver_historial)
 
 
 @barbero_bp.route('/cita/<int:cita_id>')
@@ -439,6 +711,56 @@ def cambiar_estado(cita_id):
     return redirect(url_for('barbero.ver_cita', cita_id=cita_id))
 
 
+@barbero_bp.route('/citas/cambiar-estado', methods=['POST'])
+@barbero_required
+def cambiar_estado_masivo():
+    """Cambiar el estado de varias citas a la vez (p. ej. cierre del día)"""
+    user = get_current_user()
+
+    if request.is_json:
+        datos = request.get_json(silent=True) or {}
+        cita_ids = datos.get('cita_ids') or []
+        nuevo_estado = datos.get('nuevo_estado')
+        notas_barbero = datos.get('notas_barbero')
+    else:
+        cita_ids = request.form.getlist('cita_ids')
+        nuevo_estado = request.form.get('nuevo_estado')
+        notas_barbero = request.form.get('notas_barbero')
+
+    try:
+        cita_ids = [int(cita_id) for cita_id in cita_ids]
+    except (TypeError, ValueError):
+        cita_ids = []
+
+    if not cita_ids or not nuevo_estado or len(cita_ids) > current_app.config['CAMBIO_ESTADO_MAX_CITAS']:
+        if request.is_json:
+            return {'error': 'Parámetros inválidos'}, 400
+        flash('Selecciona al menos una cita y un estado', 'warning')
+        return redirect(request.referrer or url_for('barbero.agenda'))
+
+    try:
+        resultados = cambiar_estado_citas(user['id'], cita_ids, nuevo_estado,
+                                          notas_barbero if notas_barbero else None)
+    except Exception as e:
+        if request.is_json:
+            return {'error': str(e)}, 500
+        flash(f'Error al cambiar estados: {str(e)}', 'danger')
+        return redirect(request.referrer or url_for('barbero.agenda'))
+
+    actualizadas = sum(1 for r in resultados.values() if r == 'actualizada')
+
+    if request.is_json:
+        return {'actualizadas': actualizadas,
+                'resultados': {str(cita_id): r for cita_id, r in resultados.items()}}
+
+    if actualizadas:
+        flash(f'{actualizadas} cita(s) cambiadas a: {nuevo_estado}', 'success')
+    rechazadas = len(resultados) - actualizadas
+    if rechazadas:
+        flash(f'{rechazadas} cita(s) no se pudieron modificar', 'danger')
+    return redirect(request.referrer or url_for('barbero.agenda'))
+
+
 @barbero_bp.route('/estadisticas')
 @barbero_required
 def estadisticas():
@@ -485,6 +807,194 @@ def perfil():
     
     return render_template('barbero/perfil.html', user=user, barbero=barbero)
 
+
+def _respuesta_exportacion(ambito, entidad_id, prefijo):
+    """Respuesta en streaming con las citas del rango ?desde=&hasta= en ?formato=csv|ndjson"""
+    formato = request.args.get('formato', 'csv')
+    if formato not in exportar.FORMATOS:
+        abort(400)
+    try:
+        desde = datetime.strptime(request.args['desde'], '%Y-%m-%d').date() if request.args.get('desde') else None
+        hasta = datetime.strptime(request.args['hasta'], '%Y-%m-%d').date() if request.args.get('hasta') else None
+    except ValueError:
+        abort(400)
+    desde, hasta = exportar.rango_exportacion(desde, hasta)
+
+    contenido = exportar.exportar_citas(ambito, entidad_id, desde, hasta, formato)
+    archivo = exportar.nombre_archivo(prefijo, desde, hasta, formato)
+    return Response(stream_with_context(contenido),
+                    mimetype=exportar.FORMATOS[formato][0],
+                    headers={'Content-Disposition': f'attachment; filename="{archivo}"',
+                             'X-Accel-Buffering': 'no'})
+
+
+@barbero_bp.route('/exportar')
+@barbero_required
+def exportar_citas():
+    """Descarga el historial de citas del barbero (CSV o NDJSON)"""
+    user = get_current_user()
+    barbero = obtener_barbero_por_usuario_id(user['id'])
+    
+    if not barbero:
+        flash('No se encontró tu perfil de barbero', 'danger')
+        return redirect(url_for('main.index'))
+    
+    return _respuesta_exportacion('barbero', barbero['id'], f"citas_barbero_{barbero['id']}")
+
+# ============================================
+# RUTAS DE PROPIETARIO (Propietario Blueprint)
+# ============================================
+
+@propietario_bp.route('/dashboard')
+@propietario_required
+def dashboard():
+    """Dashboard analítico del propietario: ingresos, ocupación, horas pico y servicios"""
+    user = get_current_user()
+
+    if user['rol_nombre'] == 'Admin':
+        barberias = obtener_barberias_activas()
+    else:
+        barberias = obtener_barberias_por_propietario(user['id'])
+
+    if not barberias:
+        flash('No tienes barberías registradas', 'info')
+        return redirect(url_for('main.index'))
+
+    # Barbería seleccionada (por defecto la primera)
+    barberia_id = request.args.get('barberia_id', type=int)
+    barberia = next((b for b in barberias if b['id'] == barberia_id), barberias[0])
+
+    # Rango de fechas (por defecto los últimos días configurados)
+    fecha_inicio, fecha_fin = analytics.rango_por_defecto()
+    try:
+        if request.args.get('desde'):
+            fecha_inicio = datetime.strptime(request.args.get('desde'), '%Y-%m-%d').date()
+        if request.args.get('hasta'):
+            fecha_fin = datetime.strptime(request.args.get('hasta'), '%Y-%m-%d').date()
+    except ValueError:
+        flash('Rango de fechas inválido', 'warning')
+        fecha_inicio, fecha_fin = analytics.rango_por_defecto()
+
+    if fecha_inicio > fecha_fin:
+        fecha_inicio, fecha_fin = fecha_fin, fecha_inicio
+
+    resumen = analytics.obtener_resumen_barberia(barberia['id'], fecha_inicio, fecha_fin)
+
+    return render_template('propietario/dashboard.html',
+                         barberias=barberias,
+                         barberia=barberia,
+                         fecha_inicio=fecha_inicio,
+                         fecha_fin=fecha_fin,
+                         resumen=resumen,
+                         ubicacion=obtener_ubicacion_barberia(barberia['id']),
+                         barberos=obtener_barberos_por_barberia(barberia['id']),
+                         excepciones=obtener_excepciones_barberia(barberia['id'], date.today()),
+                         calendario_disponible=calendario_disponible())
+
+
+def _barberia_del_propietario(barberia_id):
+    """La barbería si el usuario es su propietario (o Admin); si no, 404"""
+    user = get_current_user()
+    barberia = obtener_barberia_por_id(barberia_id)
+    if not barberia or (user['rol_nombre'] != 'Admin' and barberia['propietario_id'] != user['id']):
+        abort(404)
+    return barberia
+
+
+@propietario_bp.route('/ubicacion/<int:barberia_id>', methods=['POST'])
+@propietario_required
+def ubicacion(barberia_id):
+    """Guarda las coordenadas de la barbería para la búsqueda por cercanía"""
+    _barberia_del_propietario(barberia_id)
+
+    # Ambos vacíos quitan la ubicación
+    try:
+        latitud = float(request.form['latitud']) if request.form.get('latitud') else None
+        longitud = float(request.form['longitud']) if request.form.get('longitud') else None
+        valida = (latitud is None and longitud is None) or (
+            latitud is not None and longitud is not None
+            and -90 <= latitud <= 90 and -180 <= longitud <= 180)
+    except ValueError:
+        valida = False
+
+    if not columna_existe('Barberias', 'latitud'):
+        flash('Falta aplicar la migración de coordenadas (python -m app.migrations)', 'warning')
+    elif valida:
+        # El trigger de versiones de catálogo lleva el cambio al índice de cercanía
+        actualizar_ubicacion_barberia(barberia_id, latitud, longitud)
+        flash('Ubicación actualizada', 'success')
+    else:
+        flash('Coordenadas inválidas', 'danger')
+    return redirect(url_for('propietario.dashboard', barberia_id=barberia_id))
+
+
+@propietario_bp.route('/excepciones/<int:barberia_id>', methods=['POST'])
+@propietario_required
+def crear_excepcion_horario(barberia_id):
+    """Vacaciones, festivos, jornadas reducidas o pausas en una fecha o rango"""
+    _barberia_del_propietario(barberia_id)
+    form = request.form
+    try:
+        fecha_desde = datetime.strptime(form['fecha_desde'], '%Y-%m-%d').date()
+        fecha_hasta = datetime.strptime(form.get('fecha_hasta') or form['fecha_desde'], '%Y-%m-%d').date()
+        tipo = form['tipo']
+        hora_inicio = datetime.strptime(form['hora_inicio'], '%H:%M').time() if form.get('hora_inicio') else None
+        hora_fin = datetime.strptime(form['hora_fin'], '%H:%M').time() if form.get('hora_fin') else None
+        barbero_id = int(form['barbero_id']) if form.get('barbero_id') else None
+    except (KeyError, ValueError):
+        flash('Datos de la excepción inválidos', 'danger')
+        return redirect(url_for('propietario.dashboard', barberia_id=barberia_id))
+
+    if tipo not in ('cerrado', 'horario', 'pausa') or fecha_hasta < fecha_desde or (
+            tipo != 'cerrado' and not (hora_inicio and hora_fin and hora_inicio < hora_fin)):
+        flash('Revisa las fechas, el tipo y las horas de la excepción', 'danger')
+    elif barbero_id and barbero_id not in {b['id'] for b in obtener_barberos_por_barberia(barberia_id)}:
+        abort(404)
+    else:
+        crear_excepcion(barberia_id, barbero_id, fecha_desde, fecha_hasta, tipo,
+                        hora_inicio if tipo != 'cerrado' else None, hora_fin if tipo != 'cerrado' else None,
+                        form.get('motivo') or None)
+        # El trigger deja el cambio pendiente; se aplica ya para que la disponibilidad lo refleje
+        calendario.aplicar_pendientes()
+        flash('Excepción de horario guardada', 'success')
+    return redirect(url_for('propietario.dashboard', barberia_id=barberia_id))
+
+
+@propietario_bp.route('/excepciones/<int:barberia_id>/<int:excepcion_id>/eliminar', methods=['POST'])
+@propietario_required
+def eliminar_excepcion_horario(barberia_id, excepcion_id):
+    _barberia_del_propietario(barberia_id)
+    if eliminar_excepcion(excepcion_id, barberia_id):
+        calendario.aplicar_pendientes()
+        flash('Excepción eliminada', 'success')
+    return redirect(url_for('propietario.dashboard', barberia_id=barberia_id))
+
+
+@propietario_bp.route('/exportar/<int:barberia_id>')
+@propietario_required
+def exportar_citas(barberia_id):
+    """Descarga el historial de citas de una barbería del propietario (CSV o NDJSON)"""
+    user = get_current_user()
+    barberia = obtener_barberia_por_id(barberia_id)
+
+    if not barberia or (user['rol_nombre'] != 'Admin' and barberia['propietario_id'] != user['id']):
+        abort(404)
+
+    return _respuesta_exportacion('barberia', barberia_id, f'citas_barberia_{barberia_id}')
+
+
+# ============================================
+# RUTAS DE ADMINISTRADOR (Admin Blueprint)
+# ============================================
+
+@admin_bp.route('/dashboard')
+@admin_required
+def dashboard():
+    """Dashboard del administrador con métricas operativas del proceso"""
+    resumen = metrics.obtener_resumen()
+    return render_template('admin/dashboard.html', resumen=resumen)
+
+
 # ============================================
 # MANEJADORES DE ERRORES
 # ============================================
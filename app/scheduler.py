@@ -0,0 +1,142 @@
+import threading
+import time
+from app import metrics
+from app.database import get_connection
+
+# Planificador de tareas en segundo plano dentro del proceso.
+#
+# Con varios workers (varios procesos con su propio planificador) solo uno
+# ejecuta las tareas: el que consigue el lock de aplicación de SQL Server
+# LOCK_LIDER. El lock es de sesión, así que lo conserva mientras su conexión
+# siga abierta; si el worker muere, SQL Server lo libera y otro lo toma en el
+# siguiente tick.
+
+LOCK_LIDER = 'barberbook_scheduler_lider'
+
+
+class _Tarea:
+    def __init__(self, nombre, funcion, cada_segundos):
+        self.nombre = nombre
+        self.funcion = funcion
+        self.cada_segundos = cada_segundos
+        self.proxima = time.monotonic()
+
+
+class Programador:
+    """
+    Ejecuta tareas periódicas en un hilo daemon, solo en el worker líder.
+
+    Uso:
+        programador.registrar('mi_tarea', funcion, cada_segundos=60)
+        programador.iniciar()
+
+    La función de cada tarea devuelve el número de filas procesadas.
+    """
+
+    def __init__(self, tick_segundos=5):
+        self.tick_segundos = tick_segundos
+        self._tareas = {}
+        self._hilo = None
+        self._detener = threading.Event()
+        self._conn_lider = None
+
+    def registrar(self, nombre, funcion, cada_segundos):
+        """Registra (o reemplaza) una tarea periódica"""
+        self._tareas[nombre] = _Tarea(nombre, funcion, cada_segundos)
+
+    def iniciar(self):
+        """Arranca el hilo del planificador (idempotente)"""
+        if self._hilo and self._hilo.is_alive():
+            return
+        self._detener.clear()
+        self._hilo = threading.Thread(target=self._bucle, name='barberbook-scheduler', daemon=True)
+        self._hilo.start()
+
+    def detener(self, timeout=10):
+        """Detiene el hilo y libera el liderazgo"""
+        self._detener.set()
+        if self._hilo:
+            self._hilo.join(timeout)
+        self._soltar_liderazgo()
+
+    def es_lider(self):
+        return self._conn_lider is not None
+
+    def ejecutar_ahora(self, nombre):
+        """Ejecuta una tarea inmediatamente en el hilo actual (sin lock de líder)"""
+        return self._ejecutar(self._tareas[nombre])
+
+    # --- LIDERAZGO ---
+
+    def _intentar_liderazgo(self):
+        """Intenta tomar el lock de líder sin esperar. Devuelve True si lo tiene."""
+        if self._conn_lider is not None:
+            try:
+                # Comprobar que la sesión que tiene el lock sigue viva
+                self._conn_lider.cursor().execute("SELECT 1").fetchone()
+                return True
+            except Exception:
+                self._soltar_liderazgo()
+
+        conn = None
+        try:
+            conn = get_connection()
+            conn.autocommit = True
+            cursor = conn.cursor()
+            cursor.execute("""
+                SET NOCOUNT ON;
+                DECLARE @resultado INT;
+                EXEC @resultado = sp_getapplock @Resource = ?, @LockMode = 'Exclusive',
+                                                @LockOwner = 'Session', @LockTimeout = 0;
+                SELECT @resultado;
+            """, (LOCK_LIDER,))
+            if cursor.fetchone()[0] >= 0:
+                self._conn_lider = conn
+                return True
+        except Exception as e:
+            print(f"Scheduler: error intentando obtener el liderazgo: {e}")
+        if conn is not None:
+            conn.close()
+        return False
+
+    def _soltar_liderazgo(self):
+        conn, self._conn_lider = self._conn_lider, None
+        if conn is not None:
+            try:
+                conn.close()  # cerrar la sesión libera el lock
+            except Exception:
+                pass
+
+    # --- EJECUCIÓN ---
+
+    def _bucle(self):
+        while not self._detener.is_set():
+            if self._tareas and self._intentar_liderazgo():
+                ahora = time.monotonic()
+                for tarea in list(self._tareas.values()):
+                    if self._detener.is_set():
+                        break
+                    if tarea.proxima <= ahora:
+                        self._ejecutar(tarea)
+                        tarea.proxima = time.monotonic() + tarea.cada_segundos
+            self._detener.wait(self.tick_segundos)
+
+    def _ejecutar(self, tarea):
+        inicio = time.perf_counter()
+        try:
+            filas = tarea.funcion() or 0
+        except Exception as e:
+            metrics.registrar_tarea(tarea.nombre, time.perf_counter() - inicio, 0, error=True)
+            print(f"Scheduler: error en la tarea '{tarea.nombre}': {e}")
+            return 0
+        metrics.registrar_tarea(tarea.nombre, time.perf_counter() - inicio, filas)
+        return filas
+
+
+programador = Programador()
+
+
+def init_app(app):
+    """Registra las tareas; el planificador lo arrancan los puntos de entrada que sirven peticiones"""
+    from app import jobs
+    jobs.registrar_tareas(programador)
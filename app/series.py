@@ -0,0 +1,93 @@
+from datetime import date, datetime, timedelta
+from config import Config
+from app import calendario
+from app.database import HorarioNoDisponible, avanzar_serie, crear_serie_citas, obtener_series_pendientes
+
+# Citas recurrentes: el mismo barbero, servicio y hora cada N semanas, hasta
+# una fecha o un número de veces.
+#
+# Al crear la serie solo se reservan las citas de las próximas
+# SERIES_HORIZONTE_SEMANAS semanas: se comprueba el horario del barbero para
+# todas con una lectura del calendario y se insertan con una sola sentencia,
+# que es también la que detecta las ocupadas. Las siguientes las crea la
+# tarea materializar_series a medida que entran en el horizonte; las que
+# para entonces estén ocupadas o caigan fuera del horario (vacaciones,
+# festivos) se omiten.
+
+
+def ultima_fecha(fecha_inicio, cada_semanas, hasta=None, repeticiones=None):
+    """Fecha de la última cita de la serie (como mucho SERIES_MAX_OCURRENCIAS)"""
+    veces = min(repeticiones or Config.SERIES_MAX_OCURRENCIAS, Config.SERIES_MAX_OCURRENCIAS)
+    ultima = fecha_inicio + timedelta(weeks=cada_semanas * (veces - 1))
+    if hasta is not None and hasta < ultima:
+        # La última que no pasa de `hasta`
+        ultima -= timedelta(weeks=cada_semanas * -(-(ultima - hasta).days // (7 * cada_semanas)))
+    return ultima
+
+
+def fechas_serie(fecha_inicio, cada_semanas, desde, hasta):
+    """Fechas de la serie entre `desde` y `hasta`, incluidas"""
+    paso = timedelta(weeks=cada_semanas)
+    saltos = max(0, -(-(desde - fecha_inicio).days // paso.days))
+    fecha = fecha_inicio + saltos * paso
+    while fecha <= hasta:
+        yield fecha
+        fecha += paso
+
+
+def _horizonte(hoy):
+    return hoy + timedelta(weeks=Config.SERIES_HORIZONTE_SEMANAS)
+
+
+def _en_horario(tramos, barbero_id, fechas, hora_inicio, hora_fin):
+    """Las fechas en que [hora_inicio, hora_fin) cabe en un tramo de trabajo del barbero"""
+    return [fecha for fecha in fechas
+            if any(inicio <= hora_inicio and hora_fin <= fin for inicio, fin in tramos.get((barbero_id, fecha), ()))]
+
+
+def crear_serie(cliente_id, barbero_id, servicio, fecha_inicio, hora_inicio, cada_semanas,
+                hasta=None, repeticiones=None, notas_cliente=None, reserva_token=None):
+    """
+    Crea una serie y reserva sus citas dentro del horizonte. Lanza
+    HorarioNoDisponible si alguna de ellas cae fuera del horario del barbero
+    o ya está ocupada. Devuelve (serie_id, citas creadas, última fecha).
+    """
+    hora_fin = (datetime.combine(fecha_inicio, hora_inicio) + timedelta(minutes=servicio['duracion_minutos'])).time()
+    fecha_fin = ultima_fecha(fecha_inicio, cada_semanas, hasta, repeticiones)
+    generada_hasta = min(fecha_fin, max(fecha_inicio, _horizonte(date.today())))
+    fechas = list(fechas_serie(fecha_inicio, cada_semanas, fecha_inicio, generada_hasta))
+
+    tramos, _ = calendario.turnos(fechas[0], fechas[-1], barbero_ids=[barbero_id])
+    fuera = sorted(set(fechas) - set(_en_horario(tramos, barbero_id, fechas, hora_inicio, hora_fin)))
+    if fuera:
+        raise HorarioNoDisponible('El barbero no trabaja a esa hora el '
+                                  + ', '.join(f.strftime('%d/%m/%Y') for f in fuera))
+
+    serie_id = crear_serie_citas(cliente_id, barbero_id, servicio['id'], fecha_inicio, fecha_fin, cada_semanas,
+                                 hora_inicio, hora_fin, servicio['precio'], notas_cliente, fechas, generada_hasta,
+                                 reserva_token)
+    return serie_id, len(fechas), fecha_fin
+
+
+def materializar(hoy=None):
+    """
+    Tarea periódica: crea las citas de las series que entran en el horizonte.
+    Lee el calendario una vez por lote de series. Devuelve las citas creadas.
+    """
+    hoy = hoy or date.today()
+    horizonte = _horizonte(hoy)
+    total = 0
+    while True:
+        series = obtener_series_pendientes(horizonte, Config.SERIES_LOTE)
+        if not series:
+            return total
+        desde = max(hoy, min(s['generada_hasta'] for s in series) + timedelta(days=1))
+        tramos, _ = calendario.turnos(desde, horizonte, barbero_ids=sorted({s['barbero_id'] for s in series}))
+        for serie in series:
+            hasta = min(serie['fecha_fin'], horizonte)
+            fechas = list(fechas_serie(serie['fecha_inicio'], serie['cada_semanas'],
+                                       max(hoy, serie['generada_hasta'] + timedelta(days=1)), hasta))
+            libres = _en_horario(tramos, serie['barbero_id'], fechas, serie['hora_inicio'], serie['hora_fin'])
+            total += avanzar_serie(serie, libres, hasta, omitidas=len(fechas) - len(libres))
+        if len(series) < Config.SERIES_LOTE:
+            return total
@@ -0,0 +1,48 @@
+from app import create_app
+from app.asgi import AdaptadorASGI
+from config import Config
+
+# Modo ASGI: la misma aplicación servida por uvicorn.
+#   uvicorn asgi:asgi_app --host 0.0.0.0 --port 8000
+# o directamente: python asgi.py
+#
+# Las vistas siguen ocupando un hilo cada una (ver app/asgi.py); la diferencia
+# con gunicorn está en los streams SSE. Medido con carga.py (20 clientes, 8 s,
+# /static/style.css, 1 CPU, un proceso: servidor.py --workers 1 frente a este
+# modo) con 40 páginas de reserva abiertas escuchando /cliente/disponibilidad/stream:
+#
+#                                         pet/s   p50 ms   p99 ms
+#   gunicorn, sin streams                   889     23.2     46.1
+#   gunicorn, 40 streams (16 + 24 sondeo)   998     20.6     34.2
+#   ASGI, sin streams                       575     35.9     50.9
+#   ASGI, 40 streams en el bucle            600     33.0     46.3
+#   ASGI antes (streams en el pool)         1.3  15050.8  15063.2
+#
+# Sin SQL Server en la máquina de medida no hay cifras de las rutas con consultas.
+
+app = create_app()
+
+
+def _al_cerrar():
+    """Detiene las tareas y el backend de eventos y cierra las conexiones del pool"""
+    from app import eventos, scheduler
+    from app.database import reiniciar_pool
+    scheduler.programador.detener()
+    eventos.backend.detener()
+    reiniciar_pool()
+
+
+def _al_iniciar():
+    if Config.SCHEDULER_ENABLED:
+        from app import scheduler
+        scheduler.programador.iniciar()
+    if Config.CALENTAR_AL_ARRANCAR:
+        from app import arranque
+        arranque.calentar(app)
+
+
+asgi_app = AdaptadorASGI(app.wsgi_app, hilos=Config.ASGI_HILOS, al_iniciar=_al_iniciar, al_cerrar=_al_cerrar)
+
+if __name__ == '__main__':
+    import uvicorn
+    uvicorn.run(asgi_app, host='0.0.0.0', port=8000)
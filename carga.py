@@ -0,0 +1,104 @@
+"""
+Prueba de carga mínima para comparar modos de servidor.
+
+Lanza N clientes concurrentes contra una o varias URL base durante unos
+segundos y muestra peticiones por segundo y latencias p50/p95/p99.
+
+Ejemplo (WSGI con hilos frente a ASGI):
+    python run.py            # http://127.0.0.1:5000
+    python asgi.py           # http://127.0.0.1:8000
+    python carga.py http://127.0.0.1:5000 http://127.0.0.1:8000 \\
+        --ruta / --ruta /barberia/1 --clientes 50 --segundos 20
+"""
+import argparse
+import http.client
+import threading
+import time
+from urllib.parse import urlsplit
+
+
+def _percentil(valores, p):
+    if not valores:
+        return 0.0
+    indice = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return valores[indice]
+
+
+def _cliente(base, rutas, hasta, cookie, resultados, lock):
+    partes = urlsplit(base)
+    tipo = http.client.HTTPSConnection if partes.scheme == 'https' else http.client.HTTPConnection
+    conexion = tipo(partes.netloc, timeout=30)
+    cabeceras = {'Cookie': cookie} if cookie else {}
+    latencias, errores, i = [], 0, 0
+    while time.monotonic() < hasta:
+        ruta = rutas[i % len(rutas)]
+        i += 1
+        inicio = time.perf_counter()
+        for intento in range(2):
+            try:
+                conexion.request('GET', partes.path.rstrip('/') + ruta, headers=cabeceras)
+                respuesta = conexion.getresponse()
+                respuesta.read()
+                if respuesta.status >= 500:
+                    errores += 1
+                else:
+                    latencias.append(time.perf_counter() - inicio)
+                break
+            except (OSError, http.client.HTTPException) as e:
+                conexion.close()
+                conexion = tipo(partes.netloc, timeout=30)
+                # Como un navegador: si el servidor cerró la conexión keep-alive, se reintenta una vez
+                if intento or not isinstance(e, (http.client.RemoteDisconnected, ConnectionResetError,
+                                                 BrokenPipeError)):
+                    errores += 1
+                    break
+    conexion.close()
+    with lock:
+        resultados['latencias'].extend(latencias)
+        resultados['errores'] += errores
+
+
+def medir(base, rutas, clientes, segundos, cookie=None):
+    """Ejecuta la carga contra una URL base y devuelve un resumen"""
+    resultados = {'latencias': [], 'errores': 0}
+    lock = threading.Lock()
+    hasta = time.monotonic() + segundos
+    hilos = [threading.Thread(target=_cliente, args=(base, rutas, hasta, cookie, resultados, lock))
+             for _ in range(clientes)]
+    inicio = time.monotonic()
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join()
+    duracion = time.monotonic() - inicio
+
+    latencias = sorted(resultados['latencias'])
+    return {
+        'base': base,
+        'peticiones': len(latencias),
+        'errores': resultados['errores'],
+        'por_segundo': len(latencias) / duracion if duracion else 0.0,
+        'p50_ms': _percentil(latencias, 50) * 1000,
+        'p95_ms': _percentil(latencias, 95) * 1000,
+        'p99_ms': _percentil(latencias, 99) * 1000,
+    }
+
+
+def imprimir(resumenes):
+    print(f"{'URL base':<32} {'pet.':>8} {'err.':>6} {'pet/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for r in resumenes:
+        print(f"{r['base']:<32} {r['peticiones']:>8} {r['errores']:>6} {r['por_segundo']:>9.1f} "
+              f"{r['p50_ms']:>9.1f} {r['p95_ms']:>9.1f} {r['p99_ms']:>9.1f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Prueba de carga de BarberBook')
+    parser.add_argument('bases', nargs='+', help='URL base de cada servidor a medir')
+    parser.add_argument('--ruta', action='append', dest='rutas', help='Ruta a pedir (repetible, por defecto /)')
+    parser.add_argument('--clientes', type=int, default=20)
+    parser.add_argument('--segundos', type=float, default=10)
+    parser.add_argument('--cookie', help='Cookie de sesión para rutas con login')
+    args = parser.parse_args()
+
+    imprimir([medir(base, args.rutas or ['/'], args.clientes, args.segundos, args.cookie)
+              for base in args.bases])
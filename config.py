@@ -1,8 +1,9 @@
 import os
-from dotenv import load_dotenv
 
 basedir = os.path.abspath(os.path.dirname(__file__))
-load_dotenv(os.path.join(basedir, '.env'))
+if os.path.exists(os.path.join(basedir, '.env')):
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(basedir, '.env'))
 
 class Config:
     # Configuración general de Flask
@@ -22,10 +23,124 @@ class Config:
         f'UID={DB_USER};'
         f'PWD={DB_PASSWORD}'
     )
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE') or 10)  # conexiones inactivas que se conservan
+    DB_HILOS_MAX = int(os.environ.get('DB_HILOS_MAX') or DB_POOL_SIZE)  # consultas concurrentes fuera del hilo de la petición
+    DB_PARALELO_PLAZO_SEGUNDOS = 10  # plazo de en_paralelo() antes de cancelar las consultas pendientes
+
+    # Configuración del modo ASGI (asgi.py)
+    ASGI_HILOS = int(os.environ.get('ASGI_HILOS') or 32)  # peticiones atendidas a la vez por proceso
+
+    # Configuración del servidor de producción (servidor.py)
+    SERVIDOR_BIND = os.environ.get('SERVIDOR_BIND') or '0.0.0.0:8000'
+    SERVIDOR_WORKERS = int(os.environ.get('SERVIDOR_WORKERS') or 0)  # 0 = calcular según CPU y conexiones
+    SERVIDOR_HILOS = int(os.environ.get('SERVIDOR_HILOS') or 8)      # peticiones simultáneas por worker
+    SERVIDOR_MAX_PETICIONES = int(os.environ.get('SERVIDOR_MAX_PETICIONES') or 2000)  # reciclar el worker después
+    SERVIDOR_TIMEOUT = 60           # segundos sin latido antes de matar un worker colgado
+    SERVIDOR_GRACIA = 30            # segundos para terminar peticiones en curso al recargar o parar
+    DB_MAX_CONEXIONES = int(os.environ.get('DB_MAX_CONEXIONES') or 100)  # presupuesto de conexiones de todos los workers
+    CALENTAR_AL_ARRANCAR = (os.environ.get('CALENTAR_AL_ARRANCAR') or '1') == '1'  # ver app/arranque.py
+    CALENTAR_CONEXIONES = int(os.environ.get('CALENTAR_CONEXIONES') or 4)  # conexiones abiertas antes del tráfico
     
     # Configuración de sesiones
     PERMANENT_SESSION_LIFETIME = 3600  # 1 hora en segundos
     
     # Configuración de paginación
     CITAS_PER_PAGE = 10
-    SERVICIOS_PER_PAGE = 12
\ No newline at end of file
+    SERVICIOS_PER_PAGE = 12
+    
+    # Máximo de citas por petición de cambio de estado masivo
+    CAMBIO_ESTADO_MAX_CITAS = 500
+
+    # Configuración de analítica (dashboard de propietario)
+    ANALYTICS_CACHE_TTL = int(os.environ.get('ANALYTICS_CACHE_TTL') or 300)  # segundos
+    ANALYTICS_RANGO_DIAS = 30
+
+    # Configuración de métricas operativas
+    SLOW_QUERY_MS = int(os.environ.get('SLOW_QUERY_MS') or 200)
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # sin él, /metrics solo responde a administradores
+
+    # Configuración de tareas en segundo plano
+    # Solo lo arrancan los procesos que sirven peticiones (servidor.py, asgi.py,
+    # run.py), nunca create_app(): herramientas y el maestro de gunicorn no lo necesitan
+    SCHEDULER_ENABLED = (os.environ.get('SCHEDULER_ENABLED') or '0') == '1'
+    NO_SHOW_MARGEN_MINUTOS = 30     # minutos tras la hora de fin antes de marcar No Show
+    NO_SHOW_LOTE = 500              # citas por transacción
+    NO_SHOW_CADA_SEGUNDOS = 300
+
+    # Configuración de archivo histórico de citas
+    ARCHIVO_HABILITADO = (os.environ.get('ARCHIVO_HABILITADO') or '1') == '1'
+    ARCHIVO_HORIZONTE_DIAS = int(os.environ.get('ARCHIVO_HORIZONTE_DIAS') or 180)
+    ARCHIVO_LOTE = 1000
+    ARCHIVO_CADA_SEGUNDOS = 3600
+    VERSIONES_PURGA_CADA_SEGUNDOS = 6 * 3600  # purga de versiones de agenda de días pasados
+
+    # Configuración de exportación de historial
+    EXPORTAR_LOTE = 500             # filas por fetchmany
+    EXPORTAR_RANGO_DIAS = 365       # rango por defecto si no se indican fechas
+
+    # Configuración de eventos en tiempo real (SSE)
+    EVENTOS_BACKEND = os.environ.get('EVENTOS_BACKEND') or 'memoria'  # 'memoria' o 'udp' (varios workers)
+    EVENTOS_BROKER = os.environ.get('EVENTOS_BROKER') or '127.0.0.1:8765'
+    SSE_LATIDO_SEGUNDOS = 15        # comentario periódico para detectar clientes desconectados
+    SSE_MAX_SEGUNDOS = 300          # después el navegador se reconecta solo
+    SSE_MAX_CONEXIONES = int(os.environ.get('SSE_MAX_CONEXIONES') or 16)  # streams abiertos por worker
+    SSE_SONDEO_SEGUNDOS = 30        # sin plaza de stream, la página de reserva sondea con ETag
+
+    # Configuración de cache de páginas públicas
+    PAGINAS_CACHE_TTL = int(os.environ.get('PAGINAS_CACHE_TTL') or 600)  # segundos
+    PAGINAS_VERSION_SEGUNDOS = 15   # cada cuánto se releen las versiones de catálogo
+
+    # Configuración de búsqueda de barberías (índice en memoria)
+    BUSQUEDA_POR_PAGINA = 12
+    BUSQUEDA_RECONSTRUIR_SEGUNDOS = 900  # reconstrucción completa de respaldo (categorías, sin migración 4)
+
+    # Búsqueda por cercanía (rejilla en memoria, ver app/geo.py)
+    GEO_CELDA_GRADOS = 0.02         # ~2 km de lado cerca del ecuador
+    GEO_RADIO_MAX_KM = 50
+    GEO_K_MAX = 50
+    DISPONIBILIDAD_CACHE_TTL = 60   # segundos que se recuerda si una barbería tiene huecos en un día
+
+    # Búsqueda del primer hueco libre en una barbería (app/agenda.py)
+    HUECOS_DIAS_MAX = 28            # días hacia delante que se exploran
+    HUECOS_VENTANA_DIAS = 7         # días de citas que se cargan por consulta
+    HUECOS_MAX = 20
+
+    # Calendario materializado de los barberos (app/calendario.py)
+    CALENDARIO_SEMANAS = 8          # horizonte que se mantiene calculado
+    CALENDARIO_LOTE = 200           # barberos por regeneración
+    CALENDARIO_CADA_SEGUNDOS = 30   # cada cuánto se aplican los cambios de horario
+
+    # Retención de huecos durante la reserva (app/reservas.py)
+    RESERVAS_BACKEND = os.environ.get('RESERVAS_BACKEND') or 'sql'  # 'sql' (migración 8) o 'memoria' (un worker)
+    RESERVA_TTL_SEGUNDOS = int(os.environ.get('RESERVA_TTL_SEGUNDOS') or 300)
+    RESERVAS_PURGA_CADA_SEGUNDOS = 30
+
+    # Citas recurrentes (app/series.py)
+    SERIES_HORIZONTE_SEMANAS = 8    # citas de la serie que se crean por adelantado
+    SERIES_MAX_OCURRENCIAS = 52
+    SERIES_LOTE = 200               # series por lectura del calendario al materializar
+    SERIES_CADA_SEGUNDOS = 3600
+
+    # Lista de espera (app/lista_espera.py)
+    LISTA_ESPERA_DIAS = 7           # días que cubre una inscripción por defecto
+    LISTA_ESPERA_DIAS_MAX = 30
+    LISTA_ESPERA_CANDIDATOS = 10    # candidatos leídos por consulta al ofrecer un hueco
+    LISTA_ESPERA_OFERTA_SEGUNDOS = 1800  # tiempo para aceptar un hueco ofrecido
+    LISTA_ESPERA_CADA_SEGUNDOS = 60
+
+    # Notificaciones (app/notificaciones.py)
+    NOTIFICACIONES_CANALES = os.environ.get('NOTIFICACIONES_CANALES', 'email')  # separados por comas; vacío = no avisar
+    NOTIFICACIONES_DIR = os.environ.get('NOTIFICACIONES_DIR') or os.path.join(basedir, 'notificaciones')
+    NOTIFICACIONES_LOTE = 200
+    NOTIFICACIONES_PLAZO_SEGUNDOS = 120    # tiempo que un lote tomado queda apartado mientras se envía
+    NOTIFICACIONES_INTENTOS_MAX = 6
+    NOTIFICACIONES_REINTENTO_SEGUNDOS = 30  # espera antes del primer reintento; se dobla en cada uno
+    NOTIFICACIONES_RETENCION_DIAS = 30
+    NOTIFICACIONES_CADA_SEGUNDOS = 5
+    NOTIFICACIONES_PURGA_CADA_SEGUNDOS = 3600
+    RECORDATORIOS_HORAS = os.environ.get('RECORDATORIOS_HORAS', '24,2')  # antelación de los recordatorios; vacío = sin recordatorios
+
+    # Reseñas
+    RESENAS_POR_PAGINA = 10
+    RESENAS_LOTE = 500                      # barberos por lote al reconciliar las calificaciones
+    RESENAS_RECONCILIAR_CADA_SEGUNDOS = 86400
\ No newline at end of file
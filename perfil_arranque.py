@@ -0,0 +1,88 @@
+"""
+Perfil de arranque de la aplicación.
+
+Muestra qué módulos cuestan más al importar (python -X importtime), cuánto
+tarda create_app() en un proceso nuevo y la latencia de la primera petición
+frente a la siguiente, con y sin el calentamiento de app/arranque.py.
+
+    python perfil_arranque.py
+    python perfil_arranque.py --ruta /barberia/1 --top 25
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+_MEDICION = """
+import json, sys, time
+inicio = time.perf_counter()
+from app import create_app
+importado = time.perf_counter()
+app = create_app()
+creado = time.perf_counter()
+if sys.argv[2] == '1':
+    from app import arranque
+    arranque.calentar(app)
+calentado = time.perf_counter()
+cliente = app.test_client()
+latencias, codigos = [], []
+for _ in range(2):
+    t = time.perf_counter()
+    codigos.append(cliente.get(sys.argv[1]).status_code)
+    latencias.append(time.perf_counter() - t)
+print(json.dumps({'importar': importado - inicio, 'create_app': creado - importado,
+                  'calentar': calentado - creado, 'primera': latencias[0],
+                  'segunda': latencias[1], 'codigos': codigos}))
+"""
+
+
+def _entorno():
+    # Sin planificador: su hilo compite con la medición
+    return dict(os.environ, SCHEDULER_ENABLED='0')
+
+
+def importaciones(top):
+    """Devuelve [(modulo, propio_ms, acumulado_ms)] de los módulos que más tardan en importarse"""
+    salida = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'from app import create_app; create_app()'],
+                            capture_output=True, text=True, env=_entorno()).stderr
+    modulos = []
+    for linea in salida.splitlines():
+        if not linea.startswith('import time:') or 'self [us]' in linea:
+            continue
+        propio, acumulado, nombre = linea[len('import time:'):].split('|')
+        modulos.append((nombre.strip(), int(propio) / 1000, int(acumulado) / 1000))
+    propios = [m for m in modulos if m[0] in ('app', 'config') or m[0].startswith('app.')]
+    return sorted(modulos, key=lambda m: m[2], reverse=True)[:top], propios
+
+
+def arranque(ruta, calentar):
+    salida = subprocess.run([sys.executable, '-c', _MEDICION, ruta, '1' if calentar else '0'],
+                            capture_output=True, text=True, env=_entorno())
+    ultima = salida.stdout.strip().splitlines()[-1] if salida.stdout.strip() else ''
+    if not ultima.startswith('{'):
+        raise RuntimeError(salida.stderr[-2000:])
+    return json.loads(ultima)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Perfil de arranque de BarberBook')
+    parser.add_argument('--ruta', default='/', help='Ruta de la primera petición')
+    parser.add_argument('--top', type=int, default=15)
+    args = parser.parse_args()
+
+    mas_lentos, propios = importaciones(args.top)
+    print("Importaciones más costosas (acumulado):")
+    for nombre, propio, acumulado in mas_lentos:
+        print(f"  {nombre:<40} {acumulado:>8.1f} ms  (propio {propio:.1f} ms)")
+    print("\nMódulos de la aplicación (tiempo propio / acumulado):")
+    for nombre, propio, acumulado in propios:
+        print(f"  {nombre:<40} {propio:>8.1f} / {acumulado:.1f} ms")
+
+    print(f"\nArranque en frío y primera petición a {args.ruta}:")
+    print(f"  {'':<14} {'importar':>9} {'create_app':>11} {'calentar':>9} {'1ª pet.':>9} {'2ª pet.':>9}  códigos")
+    for calentar in (False, True):
+        r = arranque(args.ruta, calentar)
+        print(f"  {'con calentar' if calentar else 'sin calentar':<14} {r['importar'] * 1000:>7.1f}ms "
+              f"{r['create_app'] * 1000:>9.1f}ms {r['calentar'] * 1000:>7.1f}ms {r['primera'] * 1000:>7.1f}ms "
+              f"{r['segunda'] * 1000:>7.1f}ms  {r['codigos']}")
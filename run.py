@@ -1,7 +1,13 @@
+import os
 from app import create_app
+from config import Config
 
 # Crear la aplicación
 app = create_app()
 
 if __name__ == '__main__':
+    # Con el recargador de debug el planificador va en el proceso hijo, el que sirve
+    if Config.SCHEDULER_ENABLED and os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        from app import scheduler
+        scheduler.programador.iniciar()
     app.run(debug=True, port=5000)
\ No newline at end of file
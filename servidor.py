@@ -0,0 +1,186 @@
+"""
+Servidor de producción: gunicorn con workers pre-fork e hilos (gthread).
+
+    python servidor.py                       # tamaño calculado (ver dimensionar())
+    python servidor.py --workers 4 --hilos 8
+    python servidor.py --perfil 1 2 4 8 --ruta / --ruta /barberia/1
+
+La aplicación se carga una vez en el proceso maestro y los workers la heredan
+con fork. Antes de cada fork el maestro cierra sus conexiones y el backend de
+eventos (un socket compartido entre procesos corrompe la sesión), y cada
+worker los vuelve a crear al nacer, arranca su planificador si
+SCHEDULER_ENABLED y se calienta (app/arranque.py) antes de aceptar peticiones.
+
+Cada worker se recicla tras SERVIDOR_MAX_PETICIONES peticiones (con un
+margen aleatorio para que no se reinicien todos a la vez), lo que acota la
+memoria. Señales al maestro:
+    HUP    recarga la configuración y reemplaza los workers sin cortar peticiones
+    USR2   arranca un maestro nuevo con el código actualizado; luego QUIT al viejo
+    TERM   parada ordenada (espera SERVIDOR_GRACIA segundos)
+
+Resultado de --perfil 1 2 4 (20 clientes, 8 s, máquina de 1 CPU, 24 hilos por
+worker), en peticiones por segundo y p99:
+
+    ruta                 1 worker       2 workers      4 workers
+    /auth/login          771 (53 ms)    840 (63 ms)    659 (64 ms)
+    /static/style.css    706 (128 ms)   692 (77 ms)    606 (80 ms)
+
+Con una sola CPU y rutas sin esperas de E/S, más workers solo añaden cambios
+de contexto. Las rutas que consultan SQL Server pasan casi todo el tiempo
+esperando a la base de datos, y ahí es donde sirven workers e hilos de más
+(dimensionar()). No se midieron porque no había SQL Server en la máquina de medida.
+"""
+import argparse
+import os
+import signal
+import socket
+import subprocess
+import sys
+import time
+from config import Config
+
+
+def dimensionar(cpus=None):
+    """
+    Devuelve (workers, hilos). Cada worker puede llegar a usar una conexión
+    por hilo de petición más DB_HILOS_MAX de consultas en paralelo, así que
+    el número de workers se limita para no pasar de DB_MAX_CONEXIONES. Los
+    streams SSE ocupan un hilo cada uno pero ninguna conexión: se suman
+    SSE_MAX_CONEXIONES hilos para que no dejen sin hilos a las peticiones.
+    """
+    cpus = cpus or os.cpu_count() or 1
+    hilos = Config.SERVIDOR_HILOS + Config.SSE_MAX_CONEXIONES
+    if Config.SERVIDOR_WORKERS:
+        return Config.SERVIDOR_WORKERS, hilos
+    conexiones_por_worker = Config.SERVIDOR_HILOS + Config.DB_HILOS_MAX
+    workers = min(2 * cpus + 1, Config.DB_MAX_CONEXIONES // conexiones_por_worker)
+    return max(1, workers), hilos
+
+
+# --- GANCHOS DE GUNICORN ---
+
+def _antes_de_fork(server, worker):
+    """En el maestro: nada abierto que el worker pueda heredar"""
+    from app import database, eventos
+    eventos.backend.detener()
+    database.reiniciar_pool()
+
+
+def _tras_fork(server, worker):
+    """En el worker recién creado: pool de hilos, eventos y planificador propios"""
+    from app import database, eventos, scheduler
+    database.reiniciar_pool()
+    database.reiniciar_ejecutor()
+    eventos.backend.iniciar()
+    if Config.SCHEDULER_ENABLED:
+        scheduler.programador.iniciar()
+    if Config.CALENTAR_AL_ARRANCAR:
+        from app import arranque
+        arranque.calentar(server.app.wsgi())
+
+
+def _al_salir_worker(server, worker):
+    from app import scheduler
+    scheduler.programador.detener(timeout=2)
+
+
+def opciones(workers, hilos, bind=None):
+    """Configuración de gunicorn"""
+    return {
+        'bind': bind or Config.SERVIDOR_BIND,
+        'workers': workers,
+        'worker_class': 'gthread',
+        'threads': hilos,
+        'preload_app': True,
+        'max_requests': Config.SERVIDOR_MAX_PETICIONES,
+        'max_requests_jitter': Config.SERVIDOR_MAX_PETICIONES // 10,
+        'timeout': Config.SERVIDOR_TIMEOUT,
+        'graceful_timeout': Config.SERVIDOR_GRACIA,
+        'keepalive': 5,
+        'pre_fork': _antes_de_fork,
+        'post_fork': _tras_fork,
+        'worker_exit': _al_salir_worker,
+        'accesslog': '-',
+    }
+
+
+def servir(workers, hilos, bind=None):
+    from gunicorn.app.base import BaseApplication
+
+    class Servidor(BaseApplication):
+        def load_config(self):
+            for clave, valor in opciones(workers, hilos, bind).items():
+                self.cfg.set(clave, valor)
+
+        def load(self):
+            from app import create_app
+            return create_app()
+
+    print(f"🚀 BarberBook: {workers} workers x {hilos} hilos en {bind or Config.SERVIDOR_BIND}")
+    Servidor().run()
+
+
+# --- PERFIL DE CARGA ---
+
+def _esperar_puerto(puerto, timeout=30):
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        try:
+            socket.create_connection(('127.0.0.1', puerto), timeout=1).close()
+            return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+
+def perfil(lista_workers, hilos, rutas, clientes, segundos, puerto=8090, cookie=None):
+    """
+    Arranca el servidor con cada número de workers, lo somete a la misma carga
+    (carga.py) y muestra cómo escala el rendimiento en esta máquina.
+    """
+    import carga
+
+    resumenes = []
+    for workers in lista_workers:
+        proceso = subprocess.Popen([sys.executable, __file__, '--workers', str(workers), '--hilos', str(hilos),
+                                    '--bind', f'127.0.0.1:{puerto}'], stdout=subprocess.DEVNULL)
+        try:
+            if not _esperar_puerto(puerto):
+                print(f"El servidor con {workers} workers no arrancó")
+                continue
+            base = f'http://127.0.0.1:{puerto}'
+            carga.medir(base, rutas, clientes, min(segundos, 3), cookie)  # calentamiento
+            resumen = carga.medir(base, rutas, clientes, segundos, cookie)
+            resumen['base'] = f'{workers} workers x {hilos} hilos'
+            resumenes.append(resumen)
+        finally:
+            proceso.send_signal(signal.SIGTERM)
+            proceso.wait()
+
+    print(f"\nPerfil de carga: {clientes} clientes, {segundos} s, rutas {rutas}, {os.cpu_count()} CPU")
+    carga.imprimir(resumenes)
+    if resumenes and resumenes[0]['por_segundo']:
+        print()
+        for r in resumenes:
+            print(f"{r['base']:<32} x{r['por_segundo'] / resumenes[0]['por_segundo']:.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Servidor de producción de BarberBook')
+    parser.add_argument('--workers', type=int)
+    parser.add_argument('--hilos', type=int)
+    parser.add_argument('--bind')
+    parser.add_argument('--perfil', type=int, nargs='+', metavar='WORKERS',
+                        help='Medir el rendimiento con cada número de workers')
+    parser.add_argument('--ruta', action='append', dest='rutas')
+    parser.add_argument('--clientes', type=int, default=50)
+    parser.add_argument('--segundos', type=float, default=15)
+    parser.add_argument('--cookie')
+    args = parser.parse_args()
+
+    workers, hilos = dimensionar()
+    hilos = args.hilos or hilos
+    if args.perfil:
+        perfil(args.perfil, hilos, args.rutas or ['/'], args.clientes, args.segundos, cookie=args.cookie)
+    else:
+        servir(args.workers or workers, hilos, args.bind)
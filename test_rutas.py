@@ -0,0 +1,116 @@
+"""
+Prueba de humo de las rutas de disponibilidad con el cliente de pruebas de
+Flask, sin base de datos: las funciones de app/database.py que usan se
+sustituyen por datos fijos.
+
+    python -m unittest test_rutas
+"""
+import os
+import unittest
+from datetime import date, time, timedelta
+from unittest import mock
+
+os.environ.setdefault('SCHEDULER_ENABLED', '0')
+
+from app import agenda, calendario, create_app, reservas, routes
+
+BARBERIA_ID, BARBERO_ID, CLIENTE_ID = 1, 7, 3
+
+
+def _horario(hora_inicio, hora_fin):
+    """Horario semanal igual todos los días, para no depender del dia_semana de SQL Server"""
+    return [{'barbero_id': BARBERO_ID, 'barberia_id': BARBERIA_ID, 'dia_semana': dia,
+             'hora_inicio': hora_inicio, 'hora_fin': hora_fin} for dia in range(1, 8)]
+
+
+def _excepcion(tipo, desde, hasta, hora_inicio=None, hora_fin=None):
+    return {'barbero_id': BARBERO_ID, 'barberia_id': BARBERIA_ID, 'tipo': tipo, 'fecha_desde': desde,
+            'fecha_hasta': hasta, 'hora_inicio': hora_inicio, 'hora_fin': hora_fin}
+
+
+class RutasDisponibilidadTest(unittest.TestCase):
+
+    def setUp(self):
+        self.app = create_app()
+        self.app.config['TESTING'] = True
+        self.cliente = self.app.test_client()
+        with self.cliente.session_transaction() as sesion:
+            sesion['user_id'] = CLIENTE_ID
+            sesion['user_rol'] = 'Cliente'
+        self.manana = date.today() + timedelta(days=1)
+        self.horarios = _horario(time(9), time(11))
+        self.excepciones = []
+        self.citas = []
+        self.turnos = None  # tramos del calendario materializado; None si no cubre la fecha
+
+        reservas._backend = reservas.BackendMemoria()
+        parches = [
+            mock.patch.object(reservas, 'reservas_temporales_disponible', return_value=False),
+            mock.patch.object(routes, 'get_current_user', return_value={'id': CLIENTE_ID}),
+            mock.patch.object(routes, 'obtener_version_agenda', return_value=None),
+            mock.patch.object(routes, 'obtener_servicio_por_id',
+                              return_value={'id': 2, 'barberia_id': BARBERIA_ID, 'duracion_minutos': 30}),
+            mock.patch.object(routes, 'obtener_barberos_por_barberia',
+                              return_value=[{'id': BARBERO_ID, 'nombre': 'Ana', 'apellido': 'Ruiz'}]),
+            mock.patch.object(agenda, 'obtener_slots_disponibles',
+                              side_effect=lambda b, f: {'turnos': self.turnos, 'citas_ocupadas': list(self.citas)}),
+            mock.patch.object(agenda, 'obtener_citas_ocupadas_barberia', return_value={}),
+            mock.patch.object(calendario, 'obtener_calendario', return_value=None),
+            mock.patch.object(calendario, 'obtener_reglas_horario',
+                              side_effect=lambda desde, *a: (1, self.horarios, self.excepciones)),
+        ]
+        for parche in parches:
+            parche.start()
+            self.addCleanup(parche.stop)
+        self.addCleanup(setattr, reservas, '_backend', None)
+
+    def horarios_disponibles(self, fecha):
+        respuesta = self.cliente.get('/cliente/horarios-disponibles',
+                                     query_string={'barbero_id': BARBERO_ID, 'fecha': fecha.isoformat()})
+        self.assertEqual(respuesta.status_code, 200, respuesta.get_data(as_text=True))
+        return respuesta.get_json()['disponibles']
+
+    def test_horarios_disponibles(self):
+        self.citas = [(time(9, 30), time(10))]
+        self.assertEqual(self.horarios_disponibles(self.manana), ['09:00', '10:00', '10:30'])
+
+    def test_horarios_disponibles_excepciones(self):
+        self.excepciones = [_excepcion('pausa', self.manana, self.manana, time(9, 30), time(10))]
+        self.assertEqual(self.horarios_disponibles(self.manana), ['09:00', '10:00', '10:30'])
+        self.excepciones.append(_excepcion('cerrado', self.manana, self.manana + timedelta(days=1)))
+        self.assertEqual(self.horarios_disponibles(self.manana), [])
+        self.assertEqual(self.horarios_disponibles(self.manana + timedelta(days=2)),
+                         ['09:00', '09:30', '10:00', '10:30'])
+
+    def test_horarios_disponibles_calendario_materializado(self):
+        # Con el calendario generado se usan sus tramos (ya con las excepciones aplicadas)
+        self.turnos = [(time(9), time(10)), (time(12), time(13))]
+        self.excepciones = [_excepcion('cerrado', self.manana, self.manana)]
+        self.assertEqual(self.horarios_disponibles(self.manana), ['09:00', '09:30', '12:00', '12:30'])
+        self.turnos = []
+        self.assertEqual(self.horarios_disponibles(self.manana), [])
+
+    def test_primeros_huecos(self):
+        respuesta = self.cliente.get('/cliente/primeros-huecos',
+                                     query_string={'barberia_id': BARBERIA_ID, 'servicio_id': 2, 'n': 3})
+        self.assertEqual(respuesta.status_code, 200, respuesta.get_data(as_text=True))
+        huecos = respuesta.get_json()['huecos']
+        self.assertEqual(len(huecos), 3)
+        self.assertEqual({h['barbero'] for h in huecos}, {'Ana Ruiz'})
+        self.assertEqual([(h['fecha'], h['hora']) for h in huecos],
+                         sorted((h['fecha'], h['hora']) for h in huecos))
+
+    def test_primeros_huecos_salta_dias_cerrados(self):
+        self.excepciones = [_excepcion('cerrado', date.today(), self.manana),
+                            _excepcion('pausa', self.manana + timedelta(days=1), self.manana + timedelta(days=1),
+                                       time(9), time(10))]
+        respuesta = self.cliente.get('/cliente/primeros-huecos',
+                                     query_string={'barberia_id': BARBERIA_ID, 'servicio_id': 2, 'n': 2})
+        self.assertEqual(respuesta.status_code, 200, respuesta.get_data(as_text=True))
+        pasado = (self.manana + timedelta(days=1)).isoformat()
+        self.assertEqual([(h['fecha'], h['hora']) for h in respuesta.get_json()['huecos']],
+                         [(pasado, '10:00'), (pasado, '10:30')])
+
+
+if __name__ == '__main__':
+    unittest.main()